@@ -0,0 +1,59 @@
+import argparse
+import os
+import sys
+
+# Importing the stages registers the benchmarks
+from benchmarks import stages  # noqa: F401
+from benchmarks.runner import (
+    compare_to_baseline,
+    load_baseline,
+    registry,
+    run_benchmarks,
+    save_baseline,
+)
+from homr.simple_logging import eprint
+
+default_baseline = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="benchmarks", description="Measures the stages of homr on synthetic inputs."
+    )
+    parser.add_argument("names", nargs="*", help="Only run benchmarks containing these names")
+    parser.add_argument("--baseline", default=default_baseline, help="Path of the baseline")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Store the results as new baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Allowed slowdown, 0.25 is 25%%"
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=1.0, help="Minimal time per benchmark in seconds"
+    )
+    args = parser.parse_args()
+
+    selected = [
+        bench
+        for bench in registry
+        if len(args.names) == 0 or any(name in bench.name for name in args.names)
+    ]
+    results = run_benchmarks(selected, args.min_time)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        eprint("Baseline was written to", args.baseline)
+        return
+    if not os.path.exists(args.baseline):
+        eprint("No baseline found at", args.baseline)
+        for result in results:
+            eprint(f"{result.name:<32}{result.median_seconds:>12.5f}")
+        return
+    lines, regressions = compare_to_baseline(results, load_baseline(args.baseline), args.tolerance)
+    eprint("\n".join(lines))
+    if len(regressions) > 0:
+        eprint("Slower than the baseline:", ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
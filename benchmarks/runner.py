@@ -0,0 +1,155 @@
+import importlib.util
+import json
+import platform
+import statistics
+import time
+from collections.abc import Callable
+from typing import Any
+
+from homr.simple_logging import eprint
+
+
+class Task:
+    """
+    run is measured, prepare builds its input before every run without being
+    measured. Functions which change their input, e.g. add symbols to staffs,
+    need a fresh copy for every run.
+    """
+
+    def __init__(self, run: Callable[[Any], Any], prepare: Callable[[], Any] | None = None):
+        self.run = run
+        self.prepare = prepare if prepare is not None else lambda: None
+
+
+class Benchmark:
+    """
+    setup builds the inputs and returns the task which is measured,
+    so that building the inputs isn't part of the timing.
+    """
+
+    def __init__(self, name: str, setup: Callable[[], Task], requires: tuple[str, ...] = ()):
+        self.name = name
+        self.setup = setup
+        self.requires = requires
+
+    def get_missing_dependencies(self) -> list[str]:
+        return [module for module in self.requires if importlib.util.find_spec(module) is None]
+
+
+registry: list[Benchmark] = []
+
+
+def benchmark(
+    name: str, requires: tuple[str, ...] = ()
+) -> Callable[[Callable[[], Task]], Callable[[], Task]]:
+    """
+    Registers a setup function as a benchmark. requires lists optional
+    packages, the benchmark is skipped if one of them isn't installed.
+    """
+
+    def register(setup: Callable[[], Task]) -> Callable[[], Task]:
+        registry.append(Benchmark(name, setup, requires))
+        return setup
+
+    return register
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, timings: list[float]) -> None:
+        self.name = name
+        self.runs = len(timings)
+        self.min_seconds = min(timings)
+        self.median_seconds = statistics.median(timings)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "min_seconds": self.min_seconds,
+            "median_seconds": self.median_seconds,
+        }
+
+
+def measure(task: Task, min_time_in_seconds: float, min_runs: int = 3) -> list[float]:
+    """
+    Runs the task once to warm up caches and then until it ran
+    for min_time_in_seconds and at least min_runs times.
+    """
+    task.run(task.prepare())
+    timings: list[float] = []
+    start = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - start < min_time_in_seconds:
+        task_input = task.prepare()
+        before = time.perf_counter()
+        task.run(task_input)
+        timings.append(time.perf_counter() - before)
+    return timings
+
+
+def run_benchmarks(
+    benchmarks: list[Benchmark], min_time_in_seconds: float = 1.0
+) -> list[BenchmarkResult]:
+    results = []
+    for bench in benchmarks:
+        missing = bench.get_missing_dependencies()
+        if len(missing) > 0:
+            eprint(f"Skipping {bench.name}, missing {', '.join(missing)}")
+            continue
+        eprint("Running", bench.name)
+        task = bench.setup()
+        results.append(BenchmarkResult(bench.name, measure(task, min_time_in_seconds)))
+    return results
+
+
+def get_machine() -> dict[str, str]:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "python": platform.python_version(),
+    }
+
+
+def save_baseline(path: str, results: list[BenchmarkResult]) -> None:
+    content = {
+        "machine": get_machine(),
+        "results": {result.name: result.to_dict() for result in results},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(content, f, indent=2)
+        f.write("\n")
+
+
+def load_baseline(path: str) -> dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        baseline: dict[str, Any] = json.load(f)
+    return baseline
+
+
+def compare_to_baseline(
+    results: list[BenchmarkResult], baseline: dict[str, Any], tolerance: float
+) -> tuple[list[str], list[str]]:
+    """
+    Compares the medians with the baseline. A benchmark regressed if it's
+    more than tolerance (e.g. 0.25 for 25%) slower. Returns the report lines
+    and the names of the benchmarks which regressed.
+    """
+    if baseline.get("machine") != get_machine():
+        eprint("The baseline was measured on another machine:", baseline.get("machine"))
+    lines = [f"{'benchmark':<32}{'median s':>12}{'baseline s':>12}{'ratio':>8}"]
+    regressions = []
+    for result in results:
+        stored = baseline["results"].get(result.name)
+        if stored is None:
+            lines.append(f"{result.name:<32}{result.median_seconds:>12.5f}{'-':>12}{'new':>8}")
+            continue
+        ratio = result.median_seconds / stored["median_seconds"]
+        marker = ""
+        if ratio > 1 + tolerance:
+            regressions.append(result.name)
+            marker = "  slower"
+        elif ratio < 1 / (1 + tolerance):
+            marker = "  faster"
+        lines.append(
+            f"{result.name:<32}{result.median_seconds:>12.5f}"
+            + f"{stored['median_seconds']:>12.5f}{ratio:>8.2f}{marker}"
+        )
+    return lines, regressions
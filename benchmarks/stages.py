@@ -0,0 +1,193 @@
+import copy
+from typing import Any
+
+import numpy as np
+
+from benchmarks.runner import Task, benchmark
+from benchmarks.synthetic import SyntheticPage, random_staff_image
+from homr import color_adjust
+from homr.bounding_boxes import RotatedBoundingBox, create_rotated_bounding_boxes
+from homr.debug import Debug
+from homr.model import Staff
+from homr.noise_filtering import filter_predictions
+from homr.note_detection import NoteheadWithStem, add_notes_to_staffs, combine_noteheads_with_stems
+from homr.staff_detection import break_wide_fragments, detect_staff
+
+# main imports every stage, so it needs the packages of all of them
+main_requires = ("PIL", "skimage", "requests", "musicxml")
+
+
+class DetectedSymbols:
+    """
+    The inputs of the staff detection, found with the functions of main.detect_staffs.
+    """
+
+    def __init__(self, page: SyntheticPage) -> None:
+        from main import find_bar_lines, predict_symbols
+
+        self.predictions = page.get_predictions()
+        self.debug = Debug(self.predictions.original, "benchmark.png", False)
+        symbols = predict_symbols(self.debug, self.predictions)
+        self.staff_fragments = break_wide_fragments(symbols.staff_fragments)
+        self.clefs_keys = symbols.clefs_keys
+        self.noteheads: list[NoteheadWithStem]
+        self.noteheads, _likely_bar_or_rests_lines = combine_noteheads_with_stems(
+            symbols.noteheads, symbols.stems_rest
+        )
+        self.bar_lines: list[RotatedBoundingBox]
+        _bar_lines_or_rests, self.bar_lines = find_bar_lines(self.noteheads, symbols.bar_lines)
+
+    def detect_staffs(self) -> list[Staff]:
+        return detect_staff(
+            self.debug,
+            self.predictions.staff,
+            self.staff_fragments,
+            self.clefs_keys,
+            self.bar_lines,
+            self.predictions.original,
+        )
+
+    def detect_staffs_with_notes(self) -> list[Staff]:
+        staffs = self.detect_staffs()
+        add_notes_to_staffs(
+            staffs, self.noteheads, self.predictions.symbols, self.predictions.notehead
+        )
+        return staffs
+
+
+@benchmark("color_adjust")
+def color_adjust_page() -> Task:
+    image = SyntheticPage().image
+    return Task(lambda _input: color_adjust.color_adjust(image, 40))
+
+
+@benchmark("noise_filtering", requires=main_requires)
+def noise_filtering_page() -> Task:
+    symbols = DetectedSymbols(SyntheticPage())
+    return Task(lambda _input: filter_predictions(symbols.predictions, symbols.debug))
+
+
+@benchmark("predict_symbols", requires=main_requires)
+def predict_symbols_of_page() -> Task:
+    from main import predict_symbols
+
+    predictions = SyntheticPage().get_predictions()
+    debug = Debug(predictions.original, "benchmark.png", False)
+    return Task(lambda _input: predict_symbols(debug, predictions))
+
+
+@benchmark("create_rotated_bounding_boxes")
+def bounding_boxes_of_stems() -> Task:
+    page = SyntheticPage()
+    return Task(
+        lambda _input: create_rotated_bounding_boxes(
+            page.stems_rest, skip_merging=True, min_size=(1, 5)
+        )
+    )
+
+
+@benchmark("detect_staff", requires=main_requires)
+def detect_staffs_on_page() -> Task:
+    symbols = DetectedSymbols(SyntheticPage())
+    return Task(lambda _input: symbols.detect_staffs())
+
+
+@benchmark("add_notes_to_staffs", requires=main_requires)
+def add_notes_to_page() -> Task:
+    symbols = DetectedSymbols(SyntheticPage())
+    staffs = symbols.detect_staffs()
+    predictions = symbols.predictions
+
+    def run(fresh_staffs: list[Staff]) -> Any:
+        return add_notes_to_staffs(
+            fresh_staffs, symbols.noteheads, predictions.symbols, predictions.notehead
+        )
+
+    # Adding the notes changes the staffs
+    return Task(run, lambda: copy.deepcopy(staffs))
+
+
+@benchmark("prepare_staff_image", requires=main_requires)
+def prepare_staff_images() -> Task:
+    from homr.staff_parsing import prepare_staff_image
+
+    symbols = DetectedSymbols(SyntheticPage())
+    staffs = symbols.detect_staffs_with_notes()
+    ranges = sorted((staff.max_y + staff.min_y) // 2 for staff in staffs)
+
+    def run(_input: None) -> Any:
+        return prepare_staff_image(symbols.debug, 0, ranges, staffs[0], symbols.predictions)
+
+    return Task(run)
+
+
+@benchmark("StaffDewarping.dewarp", requires=main_requires)
+def dewarp_staff() -> Task:
+    from homr.staff_dewarping import dewarp_staff_image
+
+    symbols = DetectedSymbols(SyntheticPage())
+    staff = symbols.detect_staffs_with_notes()[0]
+    image = symbols.predictions.preprocessed
+    top, bottom = int(staff.min_y) - 50, int(staff.max_y) + 50
+    staff_image = image[top:bottom]
+    staff = staff.transform_coordinates_in_bulk(lambda points: points - np.array([0, top]))
+    dewarp = dewarp_staff_image(staff_image, staff, 0, symbols.debug)
+    return Task(lambda _input: dewarp.dewarp(staff_image))
+
+
+@benchmark("ScoreDecoder.generate", requires=("torch", "transformers", "x_transformers"))
+def generate_with_small_decoder() -> Task:
+    import torch
+
+    from homr.transformer.configs import Config
+    from homr.transformer.decoder import get_decoder
+
+    torch.manual_seed(0)
+    config = Config()
+    config.decoder_dim = 64
+    config.decoder_depth = 2
+    config.decoder_heads = 2
+    config.max_seq_len = 64
+    decoder = get_decoder(config)
+    batch_size = 4
+    number_of_patches = 80
+    context = torch.randn(batch_size, number_of_patches, config.decoder_dim)
+    start_tokens = torch.full((batch_size, 1), config.bos_token, dtype=torch.long)
+    nonote_tokens = torch.full((batch_size, 1), config.nonote_token, dtype=torch.long)
+
+    def run(_input: None) -> Any:
+        # The weights are random, so every run decodes max_seq_len steps
+        return decoder.generate(
+            start_tokens, nonote_tokens, config.max_seq_len, eos_token=None, context=context
+        )
+
+    return Task(run)
+
+
+def random_tr_omr_output(rng: np.random.Generator, number_of_measures: int) -> str:
+    pitches = ["C4", "D4", "E4", "F4", "G4", "A4", "B4", "C5", "D5", "E5"]
+    symbols = ["clef-G2", "keySignature-DM", "timeSignature-4/4"]
+    for _ in range(number_of_measures):
+        for _ in range(4):
+            chord = [f"note-{pitch}_quarter" for pitch in rng.choice(pitches, rng.integers(1, 3))]
+            symbols.append("|".join(chord))
+        symbols.append("barline")
+    return "+".join(symbols)
+
+
+@benchmark("generate_xml", requires=("musicxml",))
+def generate_xml_of_page() -> Task:
+    from homr.tr_omr_parser import TrOMRParser
+    from homr.xml_generator import generate_xml
+
+    rng = np.random.default_rng(0)
+    staffs = [TrOMRParser().parse_tr_omr_output(random_tr_omr_output(rng, 40)) for _ in range(2)]
+    return Task(lambda _input: generate_xml(staffs, "Benchmark"))
+
+
+@benchmark("build_image_options")
+def build_image_options_of_staff() -> Task:
+    from homr.staff_parsing_tromr import build_image_options
+
+    image = random_staff_image()
+    return Task(lambda _input: build_image_options(image))
@@ -0,0 +1,112 @@
+import cv2
+import numpy as np
+
+from homr.model import InputPredictions
+from homr.type_definitions import NDArray
+
+line_thickness = 2
+stem_thickness = 2
+
+
+class SyntheticPage:
+    """
+    Segmentation layers with procedurally drawn staffs, clefs, bar lines,
+    noteheads and stems, together with an image of the page. It replaces
+    the output of the segmentation models, so that the later stages
+    can be measured without any downloads.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        seed: int = 0,
+        number_of_staffs: int = 6,
+        width: int = 2000,
+        unit_size: int = 16,
+        notes_per_staff: int = 24,
+        measures_per_staff: int = 4,
+    ) -> None:
+        rng = np.random.default_rng(seed)
+        self.unit_size = unit_size
+        staff_height = 4 * unit_size
+        height = (number_of_staffs + 1) * 3 * staff_height
+        shape = (height, width)
+        self.staff = np.zeros(shape, np.uint8)
+        self.notehead = np.zeros(shape, np.uint8)
+        self.stems_rest = np.zeros(shape, np.uint8)
+        self.clefs_keys = np.zeros(shape, np.uint8)
+        self.staff_tops: list[int] = []
+        margin = 3 * unit_size
+        for i in range(number_of_staffs):
+            top = (3 * i + 2) * staff_height
+            self.staff_tops.append(top)
+            for line in range(5):
+                y = top + line * unit_size
+                cv2.line(self.staff, (margin, y), (width - margin, y), (1,), line_thickness)
+            clef_center = (margin + 2 * unit_size, top + 2 * unit_size)
+            axes = (unit_size, int(3.5 * unit_size))
+            cv2.ellipse(self.clefs_keys, clef_center, axes, 0, 0, 360, (1,), -1)
+            bar_positions = np.linspace(margin, width - margin, measures_per_staff + 1)
+            for x in bar_positions.astype(int):
+                cv2.line(self.stems_rest, (x, top), (x, top + staff_height), (1,), stem_thickness)
+            self._draw_notes(rng, top, margin + 5 * unit_size, width - margin, notes_per_staff)
+        self.symbols = np.clip(self.notehead + self.stems_rest + self.clefs_keys, 0, 1).astype(
+            np.uint8
+        )
+        self.image = self._render(rng)
+
+    def _draw_notes(
+        self, rng: np.random.Generator, top: int, start: int, end: int, notes_per_staff: int
+    ) -> None:
+        unit_size = self.unit_size
+        spacing = (end - start) / notes_per_staff
+        for i in range(notes_per_staff):
+            x = int(start + (i + 0.5) * spacing)
+            # Positions on lines and in spaces, from the top line to the bottom line
+            y = top + int(rng.integers(0, 9)) * unit_size // 2
+            axes = (int(0.65 * unit_size), int(0.45 * unit_size))
+            cv2.ellipse(self.notehead, (x, y), axes, -20, 0, 360, (1,), -1)
+            stem_x = x + axes[0] - 1
+            cv2.line(
+                self.stems_rest, (stem_x, y), (stem_x, y - 3 * unit_size), (1,), stem_thickness
+            )
+
+    def _render(self, rng: np.random.Generator) -> NDArray:
+        ink = np.clip(self.staff + self.symbols, 0, 1)
+        gray = np.where(ink > 0, 20, 235).astype(np.float64)
+        # Uneven lighting and sensor noise, which color_adjust has to remove
+        gradient = np.linspace(-25, 15, gray.shape[1])[None, :]
+        gray = gray + gradient + rng.normal(0, 6, gray.shape)
+        gray_image = np.clip(gray, 0, 255).astype(np.uint8)
+        image: NDArray = cv2.cvtColor(gray_image, cv2.COLOR_GRAY2BGR)
+        return image
+
+    def get_predictions(self) -> InputPredictions:
+        return InputPredictions(
+            original=self.image.copy(),
+            preprocessed=self.image.copy(),
+            notehead=self.notehead.copy(),
+            symbols=self.symbols.copy(),
+            staff=self.staff.copy(),
+            clefs_keys=self.clefs_keys.copy(),
+            stems_rest=self.stems_rest.copy(),
+        )
+
+
+def random_staff_image(seed: int = 0, height: int = 128, width: int = 1280) -> NDArray:
+    """
+    A staff image on the canvas of the transformer: five lines and
+    random blobs on a white background.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 255, np.uint8)
+    unit_size = height // 10
+    top = (height - 4 * unit_size) // 2
+    content_width = int(rng.integers(width // 2, width))
+    for line in range(5):
+        y = top + line * unit_size
+        cv2.line(image, (0, y), (content_width, y), (0, 0, 0), 1)
+    for x in range(2 * unit_size, content_width, 3 * unit_size):
+        y = top + int(rng.integers(0, 9)) * unit_size // 2
+        cv2.ellipse(image, (x, y), (unit_size // 2, unit_size // 3), -20, 0, 360, (0, 0, 0), -1)
+    noise = rng.normal(0, 8, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
@@ -1,6 +1,7 @@
 from homr import constants
 from homr.bounding_boxes import RotatedBoundingBox
 from homr.model import BarLine, Staff
+from homr.staff_assignment import find_symbols_on_staffs
 
 
 def detect_bar_lines(
@@ -23,25 +24,19 @@ def add_bar_lines_to_staffs(
     staffs: list[Staff], bar_lines: list[RotatedBoundingBox]
 ) -> list[BarLine]:
     result = []
-    for staff in staffs:
-        for bar_line in bar_lines:
-            if not staff.is_on_staff_zone(bar_line):
-                continue
-            point = staff.get_at(bar_line.center[0])
-            if point is None:
-                continue
-
-            if abs(bar_line.top_left[1] - point.y[0]) > constants.bar_line_to_staff_tolerance(
-                point.average_unit_size
-            ):
-                continue
+    for staff, point, index in find_symbols_on_staffs(staffs, bar_lines):
+        bar_line = bar_lines[index]
+        if abs(bar_line.top_left[1] - point.y[0]) > constants.bar_line_to_staff_tolerance(
+            point.average_unit_size
+        ):
+            continue
 
-            if abs(bar_line.bottom_left[1] - point.y[-1]) > constants.bar_line_to_staff_tolerance(
-                point.average_unit_size
-            ):
-                continue
+        if abs(bar_line.bottom_left[1] - point.y[-1]) > constants.bar_line_to_staff_tolerance(
+            point.average_unit_size
+        ):
+            continue
 
-            bar_line_symbol = BarLine(bar_line)
-            staff.add_symbol(bar_line_symbol)
-            result.append(bar_line_symbol)
+        bar_line_symbol = BarLine(bar_line)
+        staff.add_symbol(bar_line_symbol)
+        result.append(bar_line_symbol)
     return result
@@ -1,7 +1,6 @@
-import math
 from abc import ABC, abstractmethod
-from collections.abc import Sequence
-from typing import Any, TypeVar, cast
+from collections.abc import Iterator, Sequence
+from typing import Any, TypeVar, cast, overload
 
 import cv2
 import cv2.typing as cvt
@@ -42,16 +41,153 @@ def calculate_edges_of_rotated_rectangle(
     )
 
 
+def _as_points(polygon: cvt.MatLike) -> NDArray:
+    return np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+
+
+def _stack_polygons(polygons: Sequence[NDArray]) -> NDArray:
+    """
+    Stacks the polygons into an (N, K, 2) array. Shorter polygons are padded by repeating
+    their last point, the resulting zero length edges don't change any of the tests below.
+    """
+    max_length = max(len(polygon) for polygon in polygons)
+    result = np.empty((len(polygons), max_length, 2), dtype=np.float64)
+    for i, polygon in enumerate(polygons):
+        result[i, : len(polygon)] = polygon
+        result[i, len(polygon) :] = polygon[-1]
+    return result
+
+
+def _do_quadrilaterals_overlap(first: NDArray, others: NDArray) -> NDArray:
+    """
+    Separating axis test of one convex quadrilateral (4, 2) against many (N, 4, 2).
+    Touching edges count as overlap.
+    """
+    firsts = np.broadcast_to(first, others.shape)
+    edges = np.concatenate(
+        [np.roll(firsts, -1, axis=1) - firsts, np.roll(others, -1, axis=1) - others], axis=1
+    )
+    axes = np.stack([-edges[..., 1], edges[..., 0]], axis=-1)
+    projected_first = np.einsum("nkd,nad->nka", firsts, axes)
+    projected_others = np.einsum("nkd,nad->nka", others, axes)
+    separated = (projected_first.max(axis=1) < projected_others.min(axis=1)) | (
+        projected_others.max(axis=1) < projected_first.min(axis=1)
+    )
+    overlapping: NDArray = ~separated.any(axis=1)
+    return overlapping
+
+
+def _are_points_in_polygons(points: NDArray, polygons: NDArray) -> NDArray:
+    """
+    Tests points (N, M, 2) against polygons (N, K, 2) and returns an (N, M) mask.
+    Points on an edge are inside, the same as cv2.pointPolygonTest(...) >= 0.
+    The outlines of ellipses aren't strictly convex after rounding, so this uses
+    the crossing number and not a convexity based test.
+    """
+    start = polygons[:, None, :, :]
+    end = np.roll(polygons, -1, axis=1)[:, None, :, :]
+    ax, ay = start[..., 0], start[..., 1]
+    bx, by = end[..., 0], end[..., 1]
+    px, py = points[:, :, None, 0], points[:, :, None, 1]
+    cross = (bx - ax) * (py - ay) - (by - ay) * (px - ax)
+    on_edge = (
+        (cross == 0)
+        & (px >= np.minimum(ax, bx))
+        & (px <= np.maximum(ax, bx))
+        & (py >= np.minimum(ay, by))
+        & (py <= np.maximum(ay, by))
+    )
+    # The edge crosses the horizontal ray which goes from the point to the right
+    crossing = ((ay > py) != (by > py)) & ((cross > 0) == (by > ay))
+    inside: NDArray = on_edge.any(axis=-1) | (crossing.sum(axis=-1) % 2 == 1)
+    return inside
+
+
+def _do_polygon_points_overlap(first: NDArray, others: NDArray) -> NDArray:
+    """
+    Checks if any point of one polygon is inside the other one, for one polygon (K, 2)
+    against many (N, L, 2).
+    """
+    max_elements_per_chunk = 2**20
+    chunk_size = max(1, max_elements_per_chunk // (len(first) * others.shape[1]))
+    result = np.zeros(len(others), dtype=bool)
+    for start in range(0, len(others), chunk_size):
+        chunk = others[start : start + chunk_size]
+        firsts = np.broadcast_to(first, (len(chunk), *first.shape))
+        result[start : start + chunk_size] = _are_points_in_polygons(firsts, chunk).any(
+            axis=1
+        ) | _are_points_in_polygons(chunk, firsts).any(axis=1)
+    return result
+
+
+def do_polygons_overlap_many(polygon: cvt.MatLike, others: Sequence[cvt.MatLike]) -> NDArray:
+    """
+    Tests one polygon against many others and returns a boolean mask.
+
+    Two polygons overlap if a point of one polygon is inside the other one,
+    the same as do_polygons_overlap. Shapes whose edges only cross don't overlap.
+    """
+    result = np.zeros(len(others), dtype=bool)
+    if len(others) == 0:
+        return result
+    first = _as_points(polygon)
+    other_points = [_as_points(other) for other in others]
+    lengths = np.array([len(other) for other in other_points])
+    stacked = _stack_polygons(other_points)
+    lower = first.min(axis=0)
+    upper = first.max(axis=0)
+    bounding_boxes_overlap = ((stacked.min(axis=1) <= upper) & (stacked.max(axis=1) >= lower)).all(
+        axis=1
+    )
+    remaining = np.flatnonzero(bounding_boxes_overlap)
+    if len(remaining) > 0:
+        longest = int(lengths[remaining].max())
+        result[remaining] = _do_polygon_points_overlap(first, stacked[remaining, :longest])
+    return result
+
+
+def get_rectangle_corners(boxes: Sequence[cvt.RotatedRect]) -> NDArray:
+    """
+    The corners (N, 4, 2) of rotated rectangles without rounding, see cv2.boxPoints.
+    """
+    corners = [cv2.boxPoints(box) for box in boxes]
+    return np.array(corners, dtype=np.float64).reshape(-1, 4, 2)
+
+
+def are_rectangles_intersecting(corners: NDArray, others: NDArray) -> NDArray:
+    """
+    Vectorized RotatedBoundingBox.is_intersecting for the corners (4, 2) of one rectangle
+    against the corners (N, 4, 2) of many. Touching rectangles intersect,
+    the same as for cv2.rotatedRectangleIntersection.
+    """
+    if len(others) == 0:
+        return np.zeros(0, dtype=bool)
+    return _do_quadrilaterals_overlap(corners, others)
+
+
 def do_polygons_overlap(poly1: cvt.MatLike, poly2: cvt.MatLike) -> bool:
-    # Check if any point of one ellipse is inside the other ellipse
-    for point in poly1:
-        if cv2.pointPolygonTest(poly2, (float(point[0]), float(point[1])), False) >= 0:
-            return True
-    for point in poly2:
-        if cv2.pointPolygonTest(poly1, (float(point[0]), float(point[1])), False) >= 0:
-            return True
+    return bool(do_polygons_overlap_many(poly1, [poly2])[0])
 
-    return False
+
+def extract_polygon_from_image(img: NDArray, polygon: cvt.MatLike) -> NDArray:
+    """
+    Returns the pixels of the image which are inside the polygon, in row-major order.
+    The mask is only rasterized for the bounding rectangle of the polygon
+    and not for the whole image.
+    """
+    points = np.asarray(polygon).reshape(-1, 2)
+    x_min = max(int(points[:, 0].min()), 0)
+    y_min = max(int(points[:, 1].min()), 0)
+    x_max = min(int(points[:, 0].max()) + 1, img.shape[1])
+    y_max = min(int(points[:, 1].max()) + 1, img.shape[0])
+    if x_max <= x_min or y_max <= y_min:
+        return img[:0, 0]
+    region = img[y_min:y_max, x_min:x_max]
+    mask = np.zeros(region.shape[:2], dtype=np.uint8)
+    offset = np.array([x_min, y_min])
+    cv2.fillPoly(mask, [(points - offset).astype(np.int32)], 1)  # type: ignore
+    result: NDArray = region[mask == 1]
+    return result
 
 
 class DebugDrawable(ABC):
@@ -182,10 +318,28 @@ class AngledBoundingBox(AnyPolygon):
         return do_polygons_overlap(self.polygon, other.polygon)
 
     def is_overlapping_with_any(self, others: Sequence["AngledBoundingBox"]) -> bool:
-        for other in others:
-            if self.is_overlapping(other):
-                return True
-        return False
+        return bool(self.is_overlapping_with_each(others).any())
+
+    def is_overlapping_with_each(self, others: Sequence[AnyPolygon]) -> NDArray:
+        """
+        Vectorized version of is_overlapping, returns a boolean mask with one entry per other.
+        """
+        result = np.zeros(len(others), dtype=bool)
+        if len(others) == 0:
+            return result
+        centers = np.empty((len(others), 2), dtype=np.float64)
+        major_axes = np.empty(len(others), dtype=np.float64)
+        for i, other in enumerate(others):
+            if not isinstance(other, BoundingBox | AngledBoundingBox):
+                raise ValueError(f"Unknown type {type(other)}")
+            centers[i] = other.center
+            major_axes[i] = max(other.size)
+        distances = np.hypot(centers[:, 0] - self.center[0], centers[:, 1] - self.center[1])
+        candidates = np.flatnonzero(distances <= max(self.size) + major_axes)
+        result[candidates] = do_polygons_overlap_many(
+            self.polygon, [others[i].polygon for i in candidates]
+        )
+        return result
 
     def _can_shapes_possibly_touch(self, other: "AnyPolygon") -> bool:
         """
@@ -232,7 +386,7 @@ class AngledBoundingBox(AnyPolygon):
         Gets the ratio of white to total pixels for this bounding box in the image.
         """
         colors = self.extract_point_sequence_from_image(img)
-        white = len([color for color in colors if color == 1])
+        white = int(np.count_nonzero(colors == 1))
         total = len(colors)
         ratio = white / total
         return ratio
@@ -326,17 +480,7 @@ class RotatedBoundingBox(AngledBoundingBox):
     def extract_point_sequence_from_image(self, img: NDArray) -> NDArray:
         rectangle = self.box
         poly = cv2.boxPoints(rectangle).astype(np.int64)
-
-        # Create an empty mask
-        mask = np.zeros_like(img)
-
-        # Fill the polygon in the mask
-        cv2.fillPoly(mask, [poly], 1)  # type: ignore
-
-        # Use the mask to index the image
-        points = img[mask == 1]
-
-        return points  # type: ignore
+        return extract_polygon_from_image(img, poly)
 
     def to_bounding_box(self) -> BoundingBox:
         return BoundingBox(
@@ -393,16 +537,162 @@ class BoundingEllipse(AngledBoundingBox):
         )
 
     def extract_point_sequence_from_image(self, img: NDArray) -> NDArray:
-        # Create an empty mask
-        mask = np.zeros_like(img)
+        return extract_polygon_from_image(img, self.polygon)
+
+
+def _normalize_rotated_rects(sizes: NDArray, angles: NDArray) -> tuple[NDArray, NDArray]:
+    """
+    Vectorized version of the angle normalization in AngledBoundingBox.__init__:
+    the angle ends up in [-45, 45] and width and height are swapped where needed.
+    """
+    angle_offsets = np.select(
+        [angles > 135, angles < -135, angles > 45, angles < -45],  # noqa: PLR2004
+        [-180.0, 180.0, -90.0, 90.0],
+        default=0.0,
+    )
+    swap = (angles <= 135) & (angles >= -135) & ((angles > 45) | (angles < -45))  # noqa: PLR2004
+    normalized_sizes = np.where(swap[:, None], sizes[:, ::-1], sizes)
+    return normalized_sizes, angles + angle_offsets
+
+
+def _has_valid_size(fitted_rects: NDArray) -> NDArray:
+    sizes = fitted_rects[:, 2:4]
+    valid: NDArray = ~np.isnan(sizes).any(axis=1) & (sizes > 0).all(axis=1)
+    return valid
+
+
+def _has_size_within(
+    sizes: NDArray,
+    min_size: tuple[float, float] | None,
+    max_size: tuple[float, float] | None,
+) -> NDArray:
+    keep = np.ones(len(sizes), dtype=bool)
+    if min_size is not None:
+        keep &= (sizes[:, 0] >= min_size[0]) & (sizes[:, 1] >= min_size[1])
+    if max_size is not None:
+        keep &= (sizes[:, 0] <= max_size[0]) & (sizes[:, 1] <= max_size[1])
+    return keep
+
+
+class BoxSet:
+    """
+    A structure of arrays for many rotated bounding boxes.
+
+    Geometry and contours are kept in contiguous arrays, so filtering and slicing
+    don't create any Python objects. RotatedBoundingBox objects are only created when
+    single boxes are accessed.
+    """
+
+    def __init__(
+        self,
+        fitted_rects: NDArray,
+        contour_points: NDArray,
+        contour_offsets: NDArray,
+        debug_ids: NDArray,
+    ) -> None:
+        # The rects as OpenCV returned them, we need them to create the same polygons
+        # as RotatedBoundingBox does
+        self._fitted_rects = fitted_rects
+        self.contour_points = contour_points
+        self.contour_offsets = contour_offsets
+        self.debug_ids = debug_ids
+        self.centers = fitted_rects[:, 0:2]
+        self.sizes, self.angles = _normalize_rotated_rects(fitted_rects[:, 2:4], fitted_rects[:, 4])
+        half_sizes = self.sizes / 2
+        flip_y = np.array([1, -1])
+        # Same order as calculate_edges_of_rotated_rectangle:
+        # top left, bottom left, top right, bottom right
+        self.corners = np.stack(
+            [
+                self.centers - half_sizes,
+                self.centers - half_sizes * flip_y,
+                self.centers + half_sizes * flip_y,
+                self.centers + half_sizes,
+            ],
+            axis=1,
+        )
 
-        # Fill the polygon in the mask
-        cv2.fillPoly(mask, [self.polygon], 1)  # type: ignore
+    @staticmethod
+    def from_contours(
+        contours: Sequence[cvt.MatLike], debug_ids: NDArray | None = None
+    ) -> "BoxSet":
+        """
+        Fits a rotated rectangle around every contour. Contours which result in an
+        invalid rectangle are skipped. The debug ids default to the contour indices.
+        """
+        fitted_rects = np.empty((len(contours), 5), dtype=np.float64)
+        for i, contour in enumerate(contours):
+            (center_x, center_y), (width, height), angle = cv2.minAreaRect(contour)
+            fitted_rects[i] = (center_x, center_y, width, height, angle)
+        lengths = np.array([len(contour) for contour in contours], dtype=np.int64)
+        contour_points = (
+            np.concatenate(contours) if len(contours) > 0 else np.empty((0, 1, 2), np.int32)
+        )
+        contour_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        if debug_ids is None:
+            debug_ids = np.arange(len(contours))
+        result = BoxSet(fitted_rects, contour_points, contour_offsets, debug_ids)
+        return result._take(np.flatnonzero(_has_valid_size(fitted_rects)))
+
+    def __len__(self) -> int:
+        return len(self._fitted_rects)
+
+    @overload
+    def __getitem__(self, index: int) -> "RotatedBoundingBox": ...
+
+    @overload
+    def __getitem__(self, index: slice | NDArray) -> "BoxSet": ...
+
+    def __getitem__(self, index: int | slice | NDArray) -> "RotatedBoundingBox | BoxSet":
+        if isinstance(index, int | np.integer):
+            return self._create_box(int(index))
+        return self._take(np.arange(len(self))[index])
+
+    def __iter__(self) -> Iterator["RotatedBoundingBox"]:
+        for i in range(len(self)):
+            yield self._create_box(i)
+
+    def get_contour(self, index: int) -> NDArray:
+        return self.contour_points[self.contour_offsets[index] : self.contour_offsets[index + 1]]
+
+    def _create_box(self, index: int) -> "RotatedBoundingBox":
+        center_x, center_y, width, height, angle = self._fitted_rects[index].tolist()
+        return RotatedBoundingBox(
+            ((center_x, center_y), (width, height), angle),
+            self.get_contour(index),
+            debug_id=int(self.debug_ids[index]),
+        )
 
-        # Use the mask to index the image
-        points = img[mask == 1]
+    def _take(self, indices: NDArray) -> "BoxSet":
+        starts = self.contour_offsets[indices]
+        lengths = self.contour_offsets[indices + 1] - starts
+        new_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        point_indices = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+        return BoxSet(
+            self._fitted_rects[indices],
+            self.contour_points[point_indices],
+            new_offsets,
+            self.debug_ids[indices],
+        )
 
-        return points  # type: ignore
+    def filter_by_size(
+        self,
+        min_size: tuple[float, float] | None = None,
+        max_size: tuple[float, float] | None = None,
+    ) -> "BoxSet":
+        return self[_has_size_within(self.sizes, min_size, max_size)]
+
+    def make_boxes_thicker(self, thickness: int) -> "BoxSet":
+        """
+        Vectorized version of RotatedBoundingBox.make_box_thicker.
+        """
+        if thickness <= 0:
+            return self
+        fitted_rects = np.column_stack([self.centers, self.sizes + thickness, self.angles])
+        return BoxSet(fitted_rects, self.contour_points, self.contour_offsets, self.debug_ids)
+
+    def to_list(self) -> list["RotatedBoundingBox"]:
+        return list(self)
 
 
 def create_bounding_boxes(img: NDArray) -> list[BoundingBox]:
@@ -419,10 +709,25 @@ def create_bounding_box(contour: cvt.MatLike, debug_id: int) -> BoundingBox:
     return BoundingBox(box, contour, debug_id=debug_id)
 
 
-def _has_box_valid_size(box: cvt.RotatedRect) -> bool:
-    return (
-        not math.isnan(box[1][0]) and not math.isnan(box[1][1]) and box[1][0] > 0 and box[1][1] > 0
-    )
+def create_rotated_box_set(
+    img: NDArray,
+    min_size: tuple[int, int] | None = None,
+    max_size: tuple[int, int] | None = None,
+) -> BoxSet:
+    contours, _ = cv2.findContours(img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return BoxSet.from_contours(contours).filter_by_size(min_size, max_size)
+
+
+def _create_rotated_bounding_boxes_from_set(
+    box_set: BoxSet,
+    skip_merging: bool,
+    thicken_boxes: int | None,
+) -> list[RotatedBoundingBox]:
+    if skip_merging:
+        return box_set.to_list()
+    if thicken_boxes is not None:
+        box_set = box_set.make_boxes_thicker(thicken_boxes)
+    return _get_box_for_whole_group(merge_overlaying_bounding_boxes(box_set.to_list()))
 
 
 def create_rotated_bounding_boxes(
@@ -432,23 +737,8 @@ def create_rotated_bounding_boxes(
     max_size: tuple[int, int] | None = None,
     thicken_boxes: int | None = None,
 ) -> list[RotatedBoundingBox]:
-    contours, _ = cv2.findContours(img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-    boxes: list[RotatedBoundingBox] = []
-    for i, countour in enumerate(contours):
-        fitBox = cv2.minAreaRect(countour)
-        if not _has_box_valid_size(fitBox):
-            continue
-        box = RotatedBoundingBox(fitBox, countour, debug_id=i)
-        if min_size is not None and (box.size[0] < min_size[0] or box.size[1] < min_size[1]):
-            continue
-        if max_size is not None and (box.size[0] > max_size[0] or box.size[1] > max_size[1]):
-            continue
-        boxes.append(box)
-    if skip_merging:
-        return boxes
-    if thicken_boxes is not None:
-        boxes = [box.make_box_thicker(thicken_boxes) for box in boxes]
-    return _get_box_for_whole_group(merge_overlaying_bounding_boxes(boxes))
+    box_set = create_rotated_box_set(img, min_size, max_size)
+    return _create_rotated_bounding_boxes_from_set(box_set, skip_merging, thicken_boxes)
 
 
 def create_rotated_bounding_box(contour: cvt.MatLike, debug_id: int) -> RotatedBoundingBox:
@@ -478,6 +768,58 @@ def create_lines(
     return _get_box_for_whole_group(merge_overlaying_bounding_boxes(boxes))
 
 
+class _FittedEllipses:
+    """
+    The ellipses fitted around a list of contours, kept as arrays
+    so that they can be filtered before any BoundingEllipse is created.
+    """
+
+    def __init__(self, contours: Sequence[cvt.MatLike]) -> None:
+        min_length_to_fit_ellipse = 5  # this is a requirement by opencv
+        indices = [
+            i for i, contour in enumerate(contours) if len(contour) >= min_length_to_fit_ellipse
+        ]
+        fitted_rects = np.empty((len(indices), 5), dtype=np.float64)
+        for row, i in enumerate(indices):
+            (center_x, center_y), (width, height), angle = cv2.fitEllipse(contours[i])
+            fitted_rects[row] = (center_x, center_y, width, height, angle)
+        valid = _has_valid_size(fitted_rects)
+        self.contours = contours
+        self.debug_ids = np.array(indices, dtype=np.int64)[valid]
+        self.fitted_rects = fitted_rects[valid]
+        self.sizes, _ = _normalize_rotated_rects(self.fitted_rects[:, 2:4], self.fitted_rects[:, 4])
+
+    def select(
+        self,
+        min_size: tuple[int, int] | None = None,
+        max_size: tuple[int, int] | None = None,
+    ) -> list[BoundingEllipse]:
+        result = []
+        for row in np.flatnonzero(_has_size_within(self.sizes, min_size, max_size)):
+            center_x, center_y, width, height, angle = self.fitted_rects[row].tolist()
+            debug_id = int(self.debug_ids[row])
+            result.append(
+                BoundingEllipse(
+                    ((center_x, center_y), (width, height), angle),
+                    self.contours[debug_id],
+                    debug_id=debug_id,
+                )
+            )
+        return result
+
+
+def _create_bounding_ellipses_from_fits(
+    fits: _FittedEllipses,
+    skip_merging: bool,
+    min_size: tuple[int, int] | None,
+    max_size: tuple[int, int] | None,
+) -> list[BoundingEllipse]:
+    boxes = fits.select(min_size, max_size)
+    if skip_merging:
+        return boxes
+    return _get_ellipse_for_whole_group(merge_overlaying_bounding_boxes(boxes))
+
+
 def create_bounding_ellipses(
     img: NDArray,
     skip_merging: bool = False,
@@ -485,23 +827,192 @@ def create_bounding_ellipses(
     max_size: tuple[int, int] | None = None,
 ) -> list[BoundingEllipse]:
     contours, _ = cv2.findContours(img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-    boxes = []
-    for i, countour in enumerate(contours):
-        min_length_to_fit_ellipse = 5  # this is a requirement by opencv
-        if len(countour) < min_length_to_fit_ellipse:
-            continue
-        fitBox = cv2.fitEllipse(countour)
-        if not _has_box_valid_size(fitBox):
-            continue
-        box = BoundingEllipse(fitBox, countour, debug_id=i)
-        if min_size is not None and (box.size[0] < min_size[0] or box.size[1] < min_size[1]):
-            continue
-        if max_size is not None and (box.size[0] > max_size[0] or box.size[1] > max_size[1]):
-            continue
-        boxes.append(box)
-    if skip_merging:
-        return boxes
-    return _get_ellipse_for_whole_group(merge_overlaying_bounding_boxes(boxes))
+    return _create_bounding_ellipses_from_fits(
+        _FittedEllipses(contours), skip_merging, min_size, max_size
+    )
+
+
+def _may_have_size_within(
+    stats: NDArray,
+    min_size: tuple[float, float] | None,
+    max_size: tuple[float, float] | None,
+) -> NDArray:
+    """
+    Rejects connected components whose rotated rectangle can't pass _has_size_within
+    by looking only at their axis aligned bounding box. The rotated rectangle is
+    at most as large as the bounding box and its diagonal is at least as long
+    as the longer side of the bounding box.
+    """
+    widths = stats[:, cv2.CC_STAT_WIDTH].astype(np.float64)
+    heights = stats[:, cv2.CC_STAT_HEIGHT].astype(np.float64)
+    keep = np.ones(len(stats), dtype=bool)
+    if min_size is not None:
+        keep &= widths * heights >= min_size[0] * min_size[1]
+        keep &= widths**2 + heights**2 >= max(min_size) ** 2
+    if max_size is not None:
+        longer_side = np.maximum(widths, heights) - 1
+        keep &= longer_side**2 <= (max_size[0] + 1) ** 2 + (max_size[1] + 1) ** 2
+    return keep
+
+
+def _trace_components(labels: NDArray, stats: NDArray, components: NDArray) -> list[NDArray]:
+    """
+    Traces the outer contour of each of the given components in its own bounding box.
+    """
+    contours = []
+    for component in components:
+        x, y, width, height = stats[component, :4].tolist()
+        roi = (labels[y : y + height, x : x + width] == component).astype(np.uint8)
+        # The padding makes sure that the contour is traced as in the full image
+        roi = np.pad(roi, 1)
+        traced, _ = cv2.findContours(
+            roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x - 1, y - 1)
+        )
+        contours.append(traced[0])
+    return contours
+
+
+def _find_outer_components(img: NDArray, labels: NDArray, number_of_labels: int) -> NDArray:
+    """
+    Marks the components which aren't inside the hole of another component,
+    those are the ones which RETR_EXTERNAL returns.
+
+    findContours treats the foreground as 8-connected and the background as
+    4-connected, a component is outside of all holes if it touches the background
+    which is connected to the border of the image.
+    """
+    background = np.pad(img == 0, 1, constant_values=True).astype(np.uint8)
+    _, regions = cv2.connectedComponents(background, connectivity=4)
+    outside = (regions == regions[0, 0]).astype(np.uint8)
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    next_to_outside = cv2.dilate(outside, cross)[1:-1, 1:-1] > 0
+    is_outer = np.zeros(number_of_labels, dtype=bool)
+    is_outer[labels[next_to_outside & (img != 0)]] = True
+    return is_outer
+
+
+def _get_contour_indices(labels: NDArray, is_outer: NDArray) -> NDArray:
+    """
+    The index which the outer contour of every component has in the result of
+    findContours with RETR_EXTERNAL, -1 for the background and nested components.
+
+    findContours lists the outer contours in reverse raster order of their first point,
+    which is the first pixel of the component in raster order.
+    """
+    pixels = np.flatnonzero(labels)
+    first_pixels = np.full(len(is_outer), labels.size, dtype=np.int64)
+    np.minimum.at(first_pixels, labels.ravel()[pixels], pixels)
+    outer = np.flatnonzero(is_outer)
+    contour_indices = np.full(len(is_outer), -1, dtype=np.int64)
+    contour_indices[outer[np.argsort(-first_pixels[outer])]] = np.arange(len(outer))
+    return contour_indices
+
+
+class ContourStore:
+    """
+    Extracts the contours of every layer of a page only once.
+
+    The contours and the rectangles and ellipses fitted around them are cached
+    per layer and retrieval mode, every call then only applies its own size filter.
+    Most symbols are merged with the boxes they overlap, for those the outer contours
+    are enough and RETR_EXTERNAL is the default.
+
+    Requests with a size filter which can't reuse an already fitted layer are
+    answered from the connected components of the layer: only the components
+    which can pass the filter are traced and fitted.
+    """
+
+    def __init__(self) -> None:
+        # The images are kept as part of the value so that their ids stay unique
+        self._contours: dict[tuple[int, int], tuple[NDArray, Sequence[cvt.MatLike]]] = {}
+        self._box_sets: dict[tuple[int, int], BoxSet] = {}
+        self._ellipses: dict[tuple[int, int], _FittedEllipses] = {}
+        self._components: dict[int, tuple[NDArray, NDArray, NDArray, NDArray]] = {}
+
+    def get_contours(self, img: NDArray, mode: int = cv2.RETR_EXTERNAL) -> Sequence[cvt.MatLike]:
+        key = (id(img), mode)
+        if key not in self._contours:
+            contours, _ = cv2.findContours(img, mode, cv2.CHAIN_APPROX_SIMPLE)
+            self._contours[key] = (img, contours)
+        return self._contours[key][1]
+
+    def get_rotated_box_set(self, img: NDArray, mode: int = cv2.RETR_EXTERNAL) -> BoxSet:
+        key = (id(img), mode)
+        if key not in self._box_sets:
+            self._box_sets[key] = BoxSet.from_contours(self.get_contours(img, mode))
+        return self._box_sets[key]
+
+    def get_components(self, img: NDArray) -> tuple[NDArray, NDArray, NDArray]:
+        """
+        Returns the labels and stats of the 8-connected components of the image
+        and the index of their contour in get_contours(img, cv2.RETR_EXTERNAL).
+        Components inside the hole of another component have no contour there
+        and get -1.
+        """
+        key = id(img)
+        if key not in self._components:
+            count, labels, stats, _ = cv2.connectedComponentsWithStats(img, connectivity=8)
+            is_outer = _find_outer_components(img, labels, count)
+            contour_indices = _get_contour_indices(labels, is_outer)
+            self._components[key] = (img, labels, stats, contour_indices)
+        _, labels, stats, contour_indices = self._components[key]
+        return labels, stats, contour_indices
+
+    def get_filtered_box_set(
+        self,
+        img: NDArray,
+        min_size: tuple[int, int] | None = None,
+        max_size: tuple[int, int] | None = None,
+    ) -> BoxSet:
+        """
+        Like get_rotated_box_set(img, cv2.RETR_EXTERNAL).filter_by_size(min_size, max_size)
+        but components which are too small or too large are rejected before any
+        contour tracing. Components in the holes of other components are skipped
+        as RETR_EXTERNAL does.
+        """
+        labels, stats, contour_indices = self.get_components(img)
+        components = np.flatnonzero(contour_indices >= 0)
+        components = components[_may_have_size_within(stats[components], min_size, max_size)]
+        components = components[np.argsort(contour_indices[components])]
+        contours = _trace_components(labels, stats, components)
+        # The debug ids are the same as if all contours had been fitted
+        box_set = BoxSet.from_contours(contours, debug_ids=contour_indices[components])
+        return box_set.filter_by_size(min_size, max_size)
+
+    def create_rotated_bounding_boxes(
+        self,
+        img: NDArray,
+        skip_merging: bool = False,
+        min_size: tuple[int, int] | None = None,
+        max_size: tuple[int, int] | None = None,
+        thicken_boxes: int | None = None,
+        mode: int = cv2.RETR_EXTERNAL,
+    ) -> list[RotatedBoundingBox]:
+        # Only a minimum size gets rid of the many specks of noise
+        if (
+            mode == cv2.RETR_EXTERNAL
+            and min_size is not None
+            and (id(img), mode) not in self._box_sets
+        ):
+            box_set = self.get_filtered_box_set(img, min_size, max_size)
+        else:
+            box_set = self.get_rotated_box_set(img, mode).filter_by_size(min_size, max_size)
+        return _create_rotated_bounding_boxes_from_set(box_set, skip_merging, thicken_boxes)
+
+    def create_bounding_ellipses(
+        self,
+        img: NDArray,
+        skip_merging: bool = False,
+        min_size: tuple[int, int] | None = None,
+        max_size: tuple[int, int] | None = None,
+        mode: int = cv2.RETR_EXTERNAL,
+    ) -> list[BoundingEllipse]:
+        key = (id(img), mode)
+        if key not in self._ellipses:
+            self._ellipses[key] = _FittedEllipses(self.get_contours(img, mode))
+        return _create_bounding_ellipses_from_fits(
+            self._ellipses[key], skip_merging, min_size, max_size
+        )
 
 
 def move_overlaying_bounding_boxes(
@@ -521,46 +1032,63 @@ def move_overlaying_bounding_boxes(
     return result_src, result_img
 
 
-def _do_groups_overlap(group1: list[AngledBoundingBox], group2: list[AngledBoundingBox]) -> bool:
-    for box1 in group1:
-        for box2 in group2:
-            if box1.is_overlapping(box2):
-                return True
-    return False
+class _UnionFind:
+    """
+    Disjoint sets over the indices 0..size-1, used to build the connected components
+    of overlapping boxes.
+    """
 
+    def __init__(self, size: int) -> None:
+        self.parent = list(range(size))
 
-def _merge_groups_recursive(
-    groups: list[list[AngledBoundingBox]], step: int
-) -> list[list[AngledBoundingBox]]:
-    step_limit = 10
-    if step > step_limit:
-        eprint("Too many steps in _merge_groups_recursive, giving back current results")
-        return groups
-    eprint("Merging symbol groups " + str(len(groups)))
-    number_of_changes = 0
-    merged: list[list[AngledBoundingBox]] = []
-    used_groups = set()
-    for i, group in enumerate(groups):
-        match_found = False
-        if i in used_groups:
-            continue
-        for j in range(i + 1, len(groups)):
-            if j in used_groups:
-                continue
-            other_group = groups[j]
-            if _do_groups_overlap(group, other_group):
-                merged.append(group + other_group)
-                number_of_changes += 1
-                used_groups.add(j)
-                match_found = True
-                break
-        if not match_found:
-            merged.append(group)
-
-    if number_of_changes == 0:
-        return merged
-    else:
-        return _merge_groups_recursive(merged, step + 1)
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            # Path halving keeps the trees flat
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> bool:
+        root_i = self.find(i)
+        root_j = self.find(j)
+        if root_i == root_j:
+            return False
+        # Attach to the smaller index so that the root is the first box of a group
+        if root_i < root_j:
+            self.parent[root_j] = root_i
+        else:
+            self.parent[root_i] = root_j
+        return True
+
+
+def _find_candidate_pairs(boxes: Sequence[AngledBoundingBox]) -> NDArray:
+    """
+    Returns all index pairs (i, j) with i < j for which
+    AngledBoundingBox._can_shapes_possibly_touch is true.
+
+    The boxes are sorted by the left edge of their bounding circle, every box then only
+    needs to look at the boxes which start before its own bounding circle ends.
+    """
+    if len(boxes) < 2:  # noqa: PLR2004
+        return np.empty((0, 2), dtype=np.int64)
+    centers = np.array([box.box[0] for box in boxes], dtype=np.float64)
+    radii = np.array([max(box.box[1]) for box in boxes], dtype=np.float64)
+    order = np.argsort(centers[:, 0] - radii, kind="stable")
+    left = (centers[:, 0] - radii)[order]
+    right = (centers[:, 0] + radii)[order]
+    ends = np.searchsorted(left, right, side="right")
+    starts = np.arange(1, len(boxes) + 1)
+    counts = np.maximum(ends - starts, 0)
+    first = np.repeat(np.arange(len(boxes)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = np.repeat(starts, counts) + offsets
+    i = order[first]
+    j = order[second]
+    distance = np.hypot(centers[i, 0] - centers[j, 0], centers[i, 1] - centers[j, 1])
+    possibly_touching = distance <= radii[i] + radii[j]
+    pairs = np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1)[possibly_touching]
+    sorted_pairs: NDArray = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return sorted_pairs
 
 
 def get_largest_of_every_group(groups: list[list[AngledBoundingBox]]) -> list[AngledBoundingBox]:
@@ -592,7 +1120,26 @@ def _get_box_for_whole_group(groups: list[list[AngledBoundingBox]]) -> list[Rota
 def merge_overlaying_bounding_boxes(
     boxes: Sequence[AngledBoundingBox],
 ) -> list[list[AngledBoundingBox]]:
-    initial_groups: list[list[AngledBoundingBox]] = []
-    for box in boxes:
-        initial_groups.append([box])
-    return _merge_groups_recursive(initial_groups, 0)
+    """
+    Groups the boxes into connected components: two boxes end up in the same group
+    if they overlap directly or through a chain of overlapping boxes.
+    The groups are ordered by their first box and keep the input order of the boxes.
+    """
+    eprint("Merging symbol groups " + str(len(boxes)))
+    components = _UnionFind(len(boxes))
+    pairs = _find_candidate_pairs(boxes)
+    firsts, starts = np.unique(pairs[:, 0], return_index=True)
+    if len(firsts) == 0:
+        return [[box] for box in boxes]
+    for i, candidates in zip(firsts.tolist(), np.split(pairs[:, 1], starts[1:]), strict=True):
+        root = components.find(i)
+        others = [j for j in candidates.tolist() if components.find(j) != root]
+        if len(others) == 0:
+            continue
+        overlapping = do_polygons_overlap_many(boxes[i].polygon, [boxes[j].polygon for j in others])
+        for j in np.array(others)[overlapping].tolist():
+            components.union(i, j)
+    groups: dict[int, list[AngledBoundingBox]] = {}
+    for i, box in enumerate(boxes):
+        groups.setdefault(components.find(i), []).append(box)
+    return list(groups.values())
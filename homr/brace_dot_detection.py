@@ -5,6 +5,7 @@ from homr import constants
 from homr.bounding_boxes import RotatedBoundingBox
 from homr.debug import Debug
 from homr.model import MultiStaff, Staff
+from homr.staff_assignment import find_symbols_on_staffs
 from homr.type_definitions import NDArray
 
 
@@ -167,18 +168,13 @@ def find_dots(
 ) -> list[RotatedBoundingBox]:
     brace_dot = [symbol for symbol in brace_dot if _is_tiny_square(symbol, unit_size)]
     result = []
-    for staff in staffs:
-        for symbol in brace_dot:
-            if not staff.is_on_staff_zone(symbol):
-                continue
-            point = staff.get_at(symbol.center[0])
-            if point is None:
-                continue
-            position = point.find_position_in_unit_sizes(symbol)
-            is_even_position = position % 2 == 0
-            # Dots are never on staff lines which would be indicated by an odd position
-            if not is_even_position:
-                continue
-            result.append(symbol)
+    for _staff, point, index in find_symbols_on_staffs(staffs, brace_dot):
+        symbol = brace_dot[index]
+        position = point.find_position_in_unit_sizes(symbol)
+        is_even_position = position % 2 == 0
+        # Dots are never on staff lines which would be indicated by an odd position
+        if not is_even_position:
+            continue
+        result.append(symbol)
 
     return result
@@ -1,4 +1,5 @@
 from abc import abstractmethod
+from bisect import bisect_left
 from collections.abc import Callable
 from enum import Enum
 from typing import Any
@@ -77,6 +78,22 @@ class SymbolOnStaff(DebugDrawable):
         copy.center = transformation(self.center)
         return copy
 
+    def get_coordinates(self) -> list[tuple[float, float]]:
+        """
+        All points which transform_coordinates would transform.
+        """
+        return [self.center]
+
+    def with_coordinates(self, points: NDArray) -> Self:
+        """
+        Returns a copy with the points (N, 2) which were returned by get_coordinates
+        replaced, e.g. after transforming them.
+        """
+        copy = self.copy()
+        x, y = points[0].tolist()
+        copy.center = (x, y)
+        return copy
+
     def calc_distance_to(self, point: tuple[float, float]) -> float:
         return float(np.linalg.norm(np.array(self.center) - np.array(point)))
 
@@ -412,6 +429,14 @@ class NoteGroup(SymbolOnStaff):
     ) -> "NoteGroup":
         return NoteGroup([note.transform_coordinates(transformation) for note in self.notes])
 
+    def get_coordinates(self) -> list[tuple[float, float]]:
+        return [note.center for note in self.notes]
+
+    def with_coordinates(self, points: NDArray) -> "NoteGroup":
+        return NoteGroup(
+            [note.with_coordinates(points[i : i + 1]) for i, note in enumerate(self.notes)]
+        )
+
 
 class BarLine(SymbolOnStaff):
     def __init__(self, box: RotatedBoundingBox):
@@ -490,13 +515,17 @@ class Clef(SymbolOnStaff):
 
 
 class StaffPoint:
-    def __init__(self, x: float, y: list[float], angle: float):
+    def __init__(
+        self, x: float, y: list[float], angle: float, average_unit_size: float | None = None
+    ):
         if len(y) != constants.number_of_lines_on_a_staff:
             raise Exception("A staff must consist of exactly 5 lines")
         self.x = x
         self.y = y
         self.angle = angle
-        self.average_unit_size = np.mean(np.diff(y))
+        self.average_unit_size = (
+            np.mean(np.diff(y)) if average_unit_size is None else average_unit_size
+        )
 
     def find_position_in_unit_sizes(self, box: AngledBoundingBox) -> int:
         center = box.center
@@ -526,6 +555,14 @@ class StaffPoint:
 class Staff(DebugDrawable):
     def __init__(self, grid: list[StaffPoint]):
         self.grid = grid
+        # The grid as arrays, row i of grid_y holds the 5 line positions of grid[i]
+        self.grid_x = np.array([p.x for p in grid], dtype=np.float64)
+        self.grid_y = np.array([p.y for p in grid], dtype=np.float64)
+        self.grid_angle = np.array([p.angle for p in grid], dtype=np.float64)
+        # Sorted x values and the first grid index with that value, as min() would pick
+        self._sorted_x, self._sorted_index = np.unique(self.grid_x, return_index=True)
+        self._sorted_x_list: list[float] = self._sorted_x.tolist()
+        self._sorted_index_list: list[int] = self._sorted_index.tolist()
         self.min_x = grid[0].x
         self.max_x = grid[-1].x
         self.min_y = min([min(p.y) for p in grid])
@@ -535,17 +572,52 @@ class Staff(DebugDrawable):
         self.symbols: list[SymbolOnStaff] = []
         self._y_tolerance = constants.max_number_of_ledger_lines * self.average_unit_size
 
+    @staticmethod
+    def from_arrays(x: NDArray, y: NDArray, angle: NDArray) -> "Staff":
+        """
+        Creates a staff from its grid as arrays: x (N), the line positions y (N, 5)
+        and angle (N).
+        """
+        average_unit_sizes = np.mean(np.diff(y, axis=1), axis=1)
+        grid = [
+            StaffPoint(x_value, y_values, angle_value, unit_size)
+            for x_value, y_values, angle_value, unit_size in zip(
+                x.tolist(), y.tolist(), angle.tolist(), average_unit_sizes, strict=True
+            )
+        ]
+        return Staff(grid)
+
     def is_on_staff_zone(self, item: AngledBoundingBox) -> bool:
-        point = self.get_at(item.center[0])
-        if point is None:
+        index = self.get_index_at(item.center[0])
+        if index < 0:
             return False
         if (
-            item.center[1] > point.y[-1] + self._y_tolerance
-            or item.center[1] < point.y[0] - self._y_tolerance
+            item.center[1] > self.grid_y[index, -1] + self._y_tolerance
+            or item.center[1] < self.grid_y[index, 0] - self._y_tolerance
         ):
             return False
         return True
 
+    def get_zone_points(self, centers: NDArray) -> NDArray:
+        """
+        Vectorized version of is_on_staff_zone for the centers of many symbols.
+        Returns the index of the grid point at each center or -1 if the center
+        isn't on the staff zone.
+        """
+        indices = self.get_at_many(centers[:, 0])
+        y = centers[:, 1]
+        is_outside = (y > self.grid_y[indices, -1] + self._y_tolerance) | (
+            y < self.grid_y[indices, 0] - self._y_tolerance
+        )
+        result: NDArray = np.where((indices < 0) | is_outside, -1, indices)
+        return result
+
+    def get_zone_y_range(self) -> tuple[float, float]:
+        """
+        The range of y values which can pass is_on_staff_zone at any x.
+        """
+        return self.min_y - self._y_tolerance, self.max_y + self._y_tolerance
+
     def add_symbol(self, symbol: SymbolOnStaff) -> None:
         self.symbols.append(symbol)
 
@@ -570,17 +642,59 @@ class Staff(DebugDrawable):
         measures = [measure for measure in measures if len(measure) > 0]
         return measures
 
+    def get_at_many(self, xs: NDArray | list[float]) -> NDArray:
+        """
+        Returns for every x the index of the closest grid point,
+        or -1 if it is further away than the staff_position_tolerance.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        right = np.clip(np.searchsorted(self._sorted_x, xs), 0, len(self._sorted_x) - 1)
+        left = np.maximum(right - 1, 0)
+        left_distance = np.abs(self._sorted_x[left] - xs)
+        right_distance = np.abs(self._sorted_x[right] - xs)
+        left_index = self._sorted_index[left]
+        right_index = self._sorted_index[right]
+        # On a tie the point which comes first in the grid wins, same as min() does
+        use_left = (left_distance < right_distance) | (
+            (left_distance == right_distance) & (left_index < right_index)
+        )
+        indices = np.where(use_left, left_index, right_index)
+        distances = np.where(use_left, left_distance, right_distance)
+        result: NDArray = np.where(distances > constants.staff_position_tolerance, -1, indices)
+        return result
+
+    def get_index_at(self, x: float) -> int:
+        """
+        Single value version of get_at_many, without the overhead of numpy.
+        """
+        sorted_x = self._sorted_x_list
+        right = min(bisect_left(sorted_x, x), len(sorted_x) - 1)
+        left = max(right - 1, 0)
+        left_distance = abs(sorted_x[left] - x)
+        right_distance = abs(sorted_x[right] - x)
+        left_index = self._sorted_index_list[left]
+        right_index = self._sorted_index_list[right]
+        if left_distance < right_distance or (
+            left_distance == right_distance and left_index < right_index
+        ):
+            index, distance = left_index, left_distance
+        else:
+            index, distance = right_index, right_distance
+        if distance > constants.staff_position_tolerance:
+            return -1
+        return index
+
     def get_at(self, x: float) -> StaffPoint | None:
-        closest_point = min(self.grid, key=lambda p: abs(p.x - x))
-        if abs(closest_point.x - x) > constants.staff_position_tolerance:
+        index = self.get_index_at(x)
+        if index < 0:
             return None
-        return closest_point
+        return self.grid[index]
 
     def y_distance_to(self, point: tuple[float, float]) -> float:
-        staff_point = self.get_at(point[0])
-        if staff_point is None:
+        index = self.get_index_at(point[0])
+        if index < 0:
             return 1e10  # Something large to mimic infinity
-        return min([abs(y - point[1]) for y in staff_point.y])
+        return float(np.min(np.abs(self.grid_y[index] - point[1])))
 
     def draw_onto_image(self, img: NDArray, color: tuple[int, int, int] = (255, 0, 0)) -> None:
         for i in range(constants.number_of_lines_on_a_staff):
@@ -656,6 +770,33 @@ class Staff(DebugDrawable):
         copy.symbols = [symbol.transform_coordinates(transformation) for symbol in self.symbols]
         return copy
 
+    def transform_coordinates_in_bulk(
+        self, transformation: Callable[[NDArray], NDArray]
+    ) -> "Staff":
+        """
+        Same as transform_coordinates, but the transformation is called only once
+        with all points (N, 2) of the grid and the symbols.
+        """
+        number_of_lines = self.grid_y.shape[1]
+        grid_points = np.stack(
+            [np.repeat(self.grid_x, number_of_lines), self.grid_y.ravel()], axis=1
+        )
+        symbol_points = [symbol.get_coordinates() for symbol in self.symbols]
+        all_symbol_points = [point for points in symbol_points for point in points]
+        points = np.concatenate([grid_points, np.array(all_symbol_points).reshape(-1, 2)])
+        transformed = np.asarray(transformation(points), dtype=np.float64)
+        transformed_grid = transformed[: len(grid_points)].reshape(-1, number_of_lines, 2)
+        copy = Staff.from_arrays(
+            np.mean(transformed_grid[:, :, 0], axis=1), transformed_grid[:, :, 1], self.grid_angle
+        )
+        offset = len(grid_points)
+        for symbol, points_of_symbol in zip(self.symbols, symbol_points, strict=True):
+            copy.symbols.append(
+                symbol.with_coordinates(transformed[offset : offset + len(points_of_symbol)])
+            )
+            offset += len(points_of_symbol)
+        return copy
+
 
 class MultiStaff(DebugDrawable):
     """
@@ -1,3 +1,5 @@
+from bisect import bisect_left, bisect_right
+
 import cv2.typing as cvt
 import numpy as np
 
@@ -13,6 +15,7 @@ from homr.model import (
     SymbolOnStaff,
 )
 from homr.simple_logging import eprint
+from homr.staff_assignment import find_symbols_on_staffs
 from homr.type_definitions import NDArray
 
 
@@ -125,6 +128,44 @@ def split_clumps_of_noteheads(
     return result
 
 
+class StemIndex:
+    """
+    The stems sorted by the left end of their polygons. A running maximum of the
+    right ends limits the search from the other side, so every notehead only looks
+    at the stems around its x position.
+    """
+
+    def __init__(self, stems: list[RotatedBoundingBox]) -> None:
+        self.stems = stems
+        polygons = [np.asarray(stem.polygon).reshape(-1, 2) for stem in stems]
+        self._min_xy = np.array([polygon.min(axis=0) for polygon in polygons]).reshape(-1, 2)
+        self._max_xy = np.array([polygon.max(axis=0) for polygon in polygons]).reshape(-1, 2)
+        self._order = np.argsort(self._min_xy[:, 0], kind="stable")
+        self._sorted_min_x = self._min_xy[self._order, 0]
+        self._max_max_x = np.maximum.accumulate(self._max_xy[self._order, 0])
+
+    def get_first_overlapping(self, box: BoundingEllipse) -> RotatedBoundingBox | None:
+        """
+        Returns the first stem in the original order which overlaps the box,
+        see RotatedBoundingBox.is_overlapping.
+        """
+        polygon = np.asarray(box.polygon).reshape(-1, 2)
+        box_min, box_max = polygon.min(axis=0), polygon.max(axis=0)
+        first = np.searchsorted(self._max_max_x, box_min[0], side="left")
+        end = np.searchsorted(self._sorted_min_x, box_max[0], side="right")
+        candidates = np.sort(self._order[first:end])
+        in_window = np.all(
+            (self._min_xy[candidates] <= box_max) & (self._max_xy[candidates] >= box_min),
+            axis=1,
+        )
+        candidates = candidates[in_window]
+        is_overlapping = box.is_overlapping_with_each([self.stems[i] for i in candidates])
+        overlapping = candidates[is_overlapping]
+        if len(overlapping) == 0:
+            return None
+        return self.stems[int(overlapping[0])]
+
+
 def combine_noteheads_with_stems(
     noteheads: list[BoundingEllipse], stems: list[RotatedBoundingBox]
 ) -> tuple[list[NoteheadWithStem], list[RotatedBoundingBox]]:
@@ -135,31 +176,46 @@ def combine_noteheads_with_stems(
     result = []
     noteheads = sorted(noteheads, key=lambda notehead: notehead.box[0][1])
     used_stems = set()
+    stem_index = StemIndex(stems)
     for notehead in noteheads:
         thickened_notehead = notehead.make_box_thicker(15)
-        found_stem = False
-        for stem in stems:
-            if stem.is_overlapping(thickened_notehead):
-                is_stem_above = stem.center[1] < notehead.center[1]
-                if is_stem_above:
-                    direction = StemDirection.UP
-                else:
-                    direction = StemDirection.DOWN
-                result.append(NoteheadWithStem(notehead, stem, direction))
-                used_stems.add(stem)
-                found_stem = True
-                break
-        if not found_stem:
+        stem = stem_index.get_first_overlapping(thickened_notehead)
+        if stem is not None:
+            is_stem_above = stem.center[1] < notehead.center[1]
+            if is_stem_above:
+                direction = StemDirection.UP
+            else:
+                direction = StemDirection.DOWN
+            result.append(NoteheadWithStem(notehead, stem, direction))
+            used_stems.add(stem)
+        else:
             result.append(NoteheadWithStem(notehead, None, None))
 
     unaccounted_stems_or_bars = [stem for stem in stems if stem not in used_stems]
     return result, unaccounted_stems_or_bars
 
 
-def _are_notes_likely_a_chord(note1: Note, note2: Note, tolerance: float) -> bool:
-    if note1.stem is None or note2.stem is None:
-        return abs(note1.center[0] - note2.center[0]) < tolerance
-    return abs(note1.stem.center[0] - note2.stem.center[0]) < tolerance
+class _SortedPositions:
+    """
+    X positions in sorted order, each with the index of the group of its note.
+    """
+
+    def __init__(self) -> None:
+        self._positions: list[float] = []
+        self._groups: list[int] = []
+
+    def add(self, position: float, group: int) -> None:
+        index = bisect_right(self._positions, position)
+        self._positions.insert(index, position)
+        self._groups.insert(index, group)
+
+    def get_groups_within(self, position: float, tolerance: float) -> list[int]:
+        """
+        Returns the groups of all positions with abs(other - position) < tolerance.
+        """
+        start = bisect_left(self._positions, True, key=lambda other: position - other < tolerance)
+        stop = bisect_left(self._positions, True, key=lambda other: other - position >= tolerance)
+        return self._groups[start:stop]
 
 
 def _create_note_group(notes: list[Note]) -> Note | NoteGroup:
@@ -170,22 +226,36 @@ def _create_note_group(notes: list[Note]) -> Note | NoteGroup:
 
 
 def _group_notes_on_staff(staff: Staff) -> None:
+    """
+    Every note joins the first group with a note which is likely in a chord with it:
+    The stems of both notes are closer than the tolerance in x, or if one of them
+    has no stem then their centers are. Instead of comparing a note with every
+    grouped note, the notes within the tolerance are looked up in sorted positions.
+    """
     notes = staff.get_notes()
+    tolerance = constants.tolerance_note_grouping(staff.average_unit_size)
     groups: list[list[Note]] = []
+    stem_positions = _SortedPositions()
+    positions_without_stem = _SortedPositions()
+    positions = _SortedPositions()
     for note in notes:
-        group_found = False
-        for group in groups:
-            for grouped_note in group:
-                if _are_notes_likely_a_chord(
-                    note, grouped_note, constants.tolerance_note_grouping(staff.average_unit_size)
-                ):
-                    group_found = True
-                    group.append(note)
-                    break
-            if group_found:
-                break
-        if not group_found:
+        if note.stem is None:
+            candidates = positions.get_groups_within(note.center[0], tolerance)
+        else:
+            candidates = stem_positions.get_groups_within(
+                note.stem.center[0], tolerance
+            ) + positions_without_stem.get_groups_within(note.center[0], tolerance)
+        if len(candidates) > 0:
+            group_index = min(candidates)
+            groups[group_index].append(note)
+        else:
+            group_index = len(groups)
             groups.append([note])
+        positions.add(note.center[0], group_index)
+        if note.stem is None:
+            positions_without_stem.add(note.center[0], group_index)
+        else:
+            stem_positions.add(note.stem.center[0], group_index)
     note_groups: list[SymbolOnStaff] = [_create_note_group(group) for group in groups]
     note_groups.extend(staff.get_all_except_notes())
     sorted_by_x = sorted(note_groups, key=lambda group: group.center[0])
@@ -196,34 +266,26 @@ def add_notes_to_staffs(
     staffs: list[Staff], noteheads: list[NoteheadWithStem], symbols: NDArray, notehead_pred: NDArray
 ) -> list[Note]:
     result = []
-    for staff in staffs:
-        for notehead_chunk in noteheads:
-            if not staff.is_on_staff_zone(notehead_chunk.notehead):
-                continue
-            center = notehead_chunk.notehead.center
-            point = staff.get_at(center[0])
-            if point is None:
-                continue
+    notehead_boxes = [notehead_chunk.notehead for notehead_chunk in noteheads]
+    for staff, point, index in find_symbols_on_staffs(staffs, notehead_boxes):
+        notehead_chunk = noteheads[index]
+        if (
+            notehead_chunk.notehead.size[0] < 0.5 * point.average_unit_size
+            or notehead_chunk.notehead.size[1] < 0.5 * point.average_unit_size
+        ):
+            continue
+        for notehead in split_clumps_of_noteheads(notehead_chunk, notehead_pred, staff):
             if (
-                notehead_chunk.notehead.size[0] < 0.5 * point.average_unit_size
-                or notehead_chunk.notehead.size[1] < 0.5 * point.average_unit_size
+                notehead.notehead.size[0] < 0.5 * point.average_unit_size
+                or notehead.notehead.size[0] > 3 * point.average_unit_size
+                or notehead.notehead.size[1] < 0.5 * point.average_unit_size
+                or notehead.notehead.size[1] > 2 * point.average_unit_size
             ):
                 continue
-            for notehead in split_clumps_of_noteheads(notehead_chunk, notehead_pred, staff):
-                point = staff.get_at(center[0])
-                if point is None:
-                    continue
-                if (
-                    notehead.notehead.size[0] < 0.5 * point.average_unit_size
-                    or notehead.notehead.size[0] > 3 * point.average_unit_size
-                    or notehead.notehead.size[1] < 0.5 * point.average_unit_size
-                    or notehead.notehead.size[1] > 2 * point.average_unit_size
-                ):
-                    continue
-                position = point.find_position_in_unit_sizes(notehead.notehead)
-                note = create_detailed_note(notehead, symbols, position)
-                result.append(note)
-                staff.add_symbol(note)
+            position = point.find_position_in_unit_sizes(notehead.notehead)
+            note = create_detailed_note(notehead, symbols, position)
+            result.append(note)
+            staff.add_symbol(note)
     number_of_notes = 0
     number_of_note_groups = 0
     for staff in staffs:
@@ -0,0 +1,190 @@
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+
+class Stage:
+    """
+    One step of a pipeline. Every worker of the stage is a thread which applies
+    the function to the items it receives from the previous stage.
+    """
+
+    def __init__(self, name: str, function: Callable[[Any], Any], workers: int = 1) -> None:
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        self.name = name
+        self.function = function
+        self.workers = workers
+
+
+class StageStatistics:
+    def __init__(self, name: str, workers: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy_seconds: float) -> None:
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += busy_seconds
+
+    def get_utilisation(self, wall_seconds: float) -> float:
+        """
+        Fraction of the time in which the workers of the stage were busy.
+        """
+        if wall_seconds <= 0:
+            return 0.0
+        return self.busy_seconds / (wall_seconds * self.workers)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.items} items, {self.workers} workers, "
+            + f"{self.busy_seconds:.2f}s busy"
+        )
+
+
+class PipelineResult:
+    """
+    The outcome for one input item, index is its position in the input.
+    If a stage failed then error is set and value is the input of the failed stage,
+    so that the caller can still clean up.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self, index: int, item: Any, value: Any, error: Exception | None, stage: str | None
+    ) -> None:
+        self.index = index
+        self.item = item
+        self.value = value
+        self.error = error
+        self.stage = stage
+
+
+class _Job:
+    def __init__(self, index: int, item: Any) -> None:
+        self.index = index
+        self.item = item
+        self.value = item
+        self.error: Exception | None = None
+        self.failed_stage: str | None = None
+
+
+_end_of_input = object()
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages. Neighbouring stages are connected by
+    bounded queues, so that a fast stage blocks instead of piling up intermediate
+    results while a slow stage is still busy. This way the stages of different
+    items overlap, e.g. the next page is segmented while the current one is decoded.
+    """
+
+    def __init__(self, stages: list[Stage], queue_size: int = 2) -> None:
+        if len(stages) == 0:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = max(queue_size, 1)
+        self.statistics = [StageStatistics(stage.name, stage.workers) for stage in stages]
+        self.wall_seconds = 0.0
+
+    def run(self, items: Iterable[Any]) -> Iterator[PipelineResult]:
+        """
+        Processes all items and yields the result of every item as soon as it
+        has passed the last stage, which isn't necessarily the order of the input.
+        The pipeline doesn't keep any reference to finished items, so that they can
+        be freed while the others are still running.
+        Errors are caught per item and don't stop the other items.
+        """
+        queues: list[queue.Queue[Any]] = [
+            queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining_workers = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(stage, self.statistics[i], queues[i], queues[i + 1]),
+                        kwargs={
+                            "remaining_workers": remaining_workers,
+                            "lock": lock,
+                            "next_workers": self._get_workers_of_stage(i + 1),
+                        },
+                        daemon=True,
+                    )
+                )
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while True:
+            job = queues[-1].get()
+            if job is _end_of_input:
+                break
+            yield PipelineResult(job.index, job.item, job.value, job.error, job.failed_stage)
+            # Don't keep the finished item alive while waiting for the next one
+            del job
+        for thread in threads:
+            thread.join()
+        self.wall_seconds = time.perf_counter() - start
+
+    def _get_workers_of_stage(self, index: int) -> int:
+        if index >= len(self.stages):
+            # The caller collects the results
+            return 1
+        return self.stages[index].workers
+
+    def _feed(self, items: Iterable[Any], output: "queue.Queue[Any]") -> None:
+        for index, item in enumerate(items):
+            output.put(_Job(index, item))
+        for _ in range(self.stages[0].workers):
+            output.put(_end_of_input)
+
+    def _work(  # noqa: PLR0913
+        self,
+        stage: Stage,
+        statistics: StageStatistics,
+        source: "queue.Queue[Any]",
+        destination: "queue.Queue[Any]",
+        remaining_workers: list[int],
+        lock: threading.Lock,
+        next_workers: int,
+    ) -> None:
+        while True:
+            job = source.get()
+            if job is _end_of_input:
+                break
+            if job.error is None:
+                start = time.perf_counter()
+                try:
+                    job.value = stage.function(job.value)
+                except Exception as e:
+                    job.error = e
+                    job.failed_stage = stage.name
+                statistics.add(time.perf_counter() - start)
+            destination.put(job)
+        with lock:
+            remaining_workers[0] -= 1
+            is_last_worker = remaining_workers[0] == 0
+        if is_last_worker:
+            for _ in range(next_workers):
+                destination.put(_end_of_input)
+
+    def get_utilisation(self) -> dict[str, float]:
+        return {
+            statistics.name: statistics.get_utilisation(self.wall_seconds)
+            for statistics in self.statistics
+        }
+
+    def format_report(self) -> str:
+        lines = [f"Pipeline finished after {self.wall_seconds:.2f}s"]
+        for statistics in self.statistics:
+            utilisation = statistics.get_utilisation(self.wall_seconds)
+            lines.append(f"  {statistics}, {100 * utilisation:.0f}% utilised")
+        return "\n".join(lines)
@@ -0,0 +1,224 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import FrameType
+
+# Profiles all top level stages of a page
+whole_page = "page"
+
+# Since Python 3.12 enabling a second cProfile.Profile raises a ValueError,
+# even if it runs on another thread
+_cprofile_lock = threading.Lock()
+
+
+class ProfileOptions:
+    """
+    stage is the name of a traced stage, e.g. "detect_staff", or "page" for all stages.
+    Only every_nth_page page of a batch run is profiled, which bounds the overhead.
+    With sampling the stacks of the stage thread are sampled every interval_in_seconds
+    and written as collapsed stacks, otherwise cProfile is used. Only one cProfile
+    can run at a time, stages which overlap with it are sampled instead.
+    """
+
+    def __init__(
+        self,
+        stage: str = whole_page,
+        every_nth_page: int = 1,
+        sampling: bool = False,
+        top: int = 20,
+        interval_in_seconds: float = 0.005,
+    ) -> None:
+        if every_nth_page < 1:
+            raise ValueError("every_nth_page must be at least 1")
+        self.stage = stage
+        self.every_nth_page = every_nth_page
+        self.sampling = sampling
+        self.top = top
+        self.interval_in_seconds = interval_in_seconds
+
+    def should_profile(self, page_index: int) -> bool:
+        return page_index % self.every_nth_page == 0
+
+
+def _describe_frame(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples the call stack of one thread from a background thread. This works
+    without any profiler package, the overhead only depends on the interval.
+    """
+
+    def __init__(self, thread_id: int, interval_in_seconds: float) -> None:
+        self.thread_id = thread_id
+        self.interval_in_seconds = interval_in_seconds
+        self.stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_in_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_describe_frame(frame))
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+class PageProfiler:
+    """
+    Profiles the selected stage of one page. Every execution of the stage gets its
+    own profile, as the stages of a page and the staffs of a stage can run on
+    different threads. The profiles are merged when they are written.
+    """
+
+    def __init__(self, output_prefix: str, options: ProfileOptions) -> None:
+        self.output_prefix = output_prefix
+        self.options = options
+        self.profiles: list[cProfile.Profile] = []
+        self.stacks: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._running = threading.local()
+
+    @contextmanager
+    def activate(self) -> Iterator["PageProfiler"]:
+        token = _current_profiler.set(self)
+        try:
+            yield self
+        finally:
+            _current_profiler.reset(token)
+
+    def _is_selected(self, stage: str) -> bool:
+        if self.options.stage == whole_page:
+            return True
+        return stage == self.options.stage
+
+    @contextmanager
+    def profile(self, stage: str) -> Iterator[None]:
+        """
+        Profiles the enclosed block if the stage is selected.
+        Nested stages of a profiled stage are part of its profile.
+        """
+        if getattr(self._running, "value", False) or not self._is_selected(stage):
+            yield
+            return
+        self._running.value = True
+        try:
+            if self.options.sampling:
+                with self._sample():
+                    yield
+            else:
+                with self._run_cprofile():
+                    yield
+        finally:
+            self._running.value = False
+
+    @contextmanager
+    def _run_cprofile(self) -> Iterator[None]:
+        if not _cprofile_lock.acquire(blocking=False):
+            with self._sample():
+                yield
+            return
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                with self._lock:
+                    self.profiles.append(profile)
+        finally:
+            _cprofile_lock.release()
+
+    @contextmanager
+    def _sample(self) -> Iterator[None]:
+        sampler = StackSampler(threading.get_ident(), self.options.interval_in_seconds)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            with self._lock:
+                self.stacks.update(sampler.stacks)
+
+    def _get_stats(self) -> pstats.Stats | None:
+        if len(self.profiles) == 0:
+            return None
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiles[0], stream=stream)
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def write(self) -> list[str]:
+        """
+        Writes a .prof file for cProfile or a .collapsed file with one
+        "frame;frame;frame count" line per stack, which flame graph tools read.
+        """
+        files = []
+        stats = self._get_stats()
+        if stats is not None:
+            path = self.output_prefix + ".prof"
+            stats.dump_stats(path)
+            files.append(path)
+        if len(self.stacks) > 0:
+            path = self.output_prefix + ".collapsed"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            files.append(path)
+        return files
+
+    def format_summary(self) -> str:
+        top = self.options.top
+        stats = self._get_stats()
+        if stats is not None:
+            stream = io.StringIO()
+            stats.stream = stream  # type: ignore
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+            return stream.getvalue()
+        total = sum(self.stacks.values())
+        if total == 0:
+            return f"No profile was recorded for stage {self.options.stage}"
+        own_samples: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            own_samples[stack.split(";")[-1]] += count
+        lines = [f"{total} samples, functions by own samples:"]
+        for function, count in own_samples.most_common(top):
+            lines.append(f"{count:>8} {100 * count / total:>5.1f}%  {function}")
+        return "\n".join(lines)
+
+
+_current_profiler: ContextVar[PageProfiler | None] = ContextVar("current_profiler", default=None)
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """
+    Profiles the enclosed block if the active page profiler selected the stage.
+    """
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.profile(name):
+        yield
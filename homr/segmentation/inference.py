@@ -1,9 +1,9 @@
 import json
 import os
+import threading
 from typing import Any
 
 import numpy as np
-import tensorflow as tf
 from PIL import Image
 
 from homr.simple_logging import eprint
@@ -80,7 +80,9 @@ class InferenceModel:
         return class_map, out
 
 
-cached_segmentation: dict[str, Any] = {}
+cached_segmentation: dict[str, InferenceModel] = {}
+# Several pages can be segmented at the same time, each model is only loaded once
+_cached_segmentation_lock = threading.Lock()
 
 
 def inference(
@@ -90,16 +92,17 @@ def inference(
     batch_size: int = 16,
     manual_th: Any | None = None,
 ) -> tuple[NDArray, NDArray]:
-    if model_path not in cached_segmentation:
-        model = InferenceModel(model_path)
-        cached_segmentation[model_path] = model
-    else:
+    with _cached_segmentation_lock:
+        if model_path not in cached_segmentation:
+            cached_segmentation[model_path] = InferenceModel(model_path)
         model = cached_segmentation[model_path]
     return model.inference(image, step_size, batch_size, manual_th)
 
 
 def _load_model(model_path: str) -> tuple[Any, dict[str, Any]]:
     """Load model and metadata"""
+    # Importing tensorflow takes seconds, so we only do it once a model is needed
+    import tensorflow as tf
 
     model = tf.saved_model.load(model_path)
     with open(os.path.join(model_path, "meta.json")) as f:
@@ -9,6 +9,7 @@ import numpy as np
 from homr.segmentation import config
 from homr.segmentation.inference import inference
 from homr.simple_logging import eprint
+from homr.tracing import trace_stage
 from homr.type_definitions import NDArray
 
 
@@ -16,21 +17,23 @@ def generate_pred(image: NDArray) -> tuple[NDArray, NDArray, NDArray, NDArray, N
     if config.unet_path == config.segnet_path:
         raise ValueError("unet_path and segnet_path should be different")
     eprint("Extracting staffline and symbols")
-    staff_symbols_map, _ = inference(
-        config.unet_path,
-        image,
-    )
+    with trace_stage("segmentation_staff_symbols"):
+        staff_symbols_map, _ = inference(
+            config.unet_path,
+            image,
+        )
     staff_layer = 1
     staff = np.where(staff_symbols_map == staff_layer, 1, 0)
     symbol_layer = 2
     symbols = np.where(staff_symbols_map == symbol_layer, 1, 0)
 
     eprint("Extracting layers of different symbols")
-    sep, _ = inference(
-        config.segnet_path,
-        image,
-        manual_th=None,
-    )
+    with trace_stage("segmentation_symbol_layers"):
+        sep, _ = inference(
+            config.segnet_path,
+            image,
+            manual_th=None,
+        )
     stems_layer = 1
     stems_rests = np.where(sep == stems_layer, 1, 0)
     notehead_layer = 2
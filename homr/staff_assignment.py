@@ -0,0 +1,78 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+from homr.bounding_boxes import AngledBoundingBox
+from homr.model import Staff, StaffPoint
+from homr.type_definitions import NDArray
+
+
+class StaffIndex:
+    """
+    Finds the staffs on whose zone a symbol lies, see Staff.is_on_staff_zone.
+
+    The staffs are indexed by the y range of their zone. The lower bounds are sorted
+    and a running maximum of the upper bounds limits the search from the other side,
+    so every symbol only looks at the few staffs around its y position.
+    """
+
+    def __init__(self, staffs: list[Staff]) -> None:
+        self.staffs = staffs
+        ranges = np.array([staff.get_zone_y_range() for staff in staffs]).reshape(-1, 2)
+        self._lower = ranges[:, 0]
+        self._upper = ranges[:, 1]
+        self._order = np.argsort(self._lower, kind="stable")
+        self._sorted_lower = self._lower[self._order]
+        self._max_upper = np.maximum.accumulate(self._upper[self._order])
+
+    def find(self, centers: NDArray) -> tuple[NDArray, NDArray, NDArray]:
+        """
+        Returns the staff index, symbol index and grid point index of every pair where
+        the symbol center is on the staff zone, ordered by staff and then by symbol.
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        y = centers[:, 1]
+        first = np.searchsorted(self._max_upper, y, side="left")
+        end = np.searchsorted(self._sorted_lower, y, side="right")
+        counts = np.maximum(end - first, 0)
+        symbols = np.repeat(np.arange(len(centers)), counts)
+        offsets = np.arange(len(symbols)) - np.repeat(np.cumsum(counts) - counts, counts)
+        staffs = self._order[first[symbols] + offsets]
+        in_range = y[symbols] <= self._upper[staffs]
+        symbols, staffs = symbols[in_range], staffs[in_range]
+
+        order = np.lexsort((symbols, staffs))
+        symbols, staffs = symbols[order], staffs[order]
+        points = np.full(len(symbols), -1, dtype=np.int64)
+        boundaries = np.flatnonzero(np.diff(staffs)) + 1
+        for start, stop in zip(
+            np.concatenate([[0], boundaries]).tolist(),
+            np.concatenate([boundaries, [len(staffs)]]).tolist(),
+            strict=True,
+        ):
+            if start < stop:
+                staff = self.staffs[staffs[start]]
+                points[start:stop] = staff.get_zone_points(centers[symbols[start:stop]])
+        keep = points >= 0
+        return staffs[keep], symbols[keep], points[keep]
+
+
+def find_symbols_on_staffs(
+    staffs: list[Staff], boxes: Sequence[AngledBoundingBox]
+) -> list[tuple[Staff, StaffPoint, int]]:
+    """
+    Returns the staff, the staff point at the symbol and the index of the symbol
+    for every box which is on the zone of a staff. The order is the same as
+    looping over all staffs and then over all boxes.
+    """
+    if len(staffs) == 0 or len(boxes) == 0:
+        return []
+    centers = np.array([box.center for box in boxes], dtype=np.float64)
+    staff_indices, symbol_indices, point_indices = StaffIndex(staffs).find(centers)
+    result = []
+    for staff_index, symbol_index, point_index in zip(
+        staff_indices.tolist(), symbol_indices.tolist(), point_indices.tolist(), strict=True
+    ):
+        staff = staffs[staff_index]
+        result.append((staff, staff.grid[point_index], symbol_index))
+    return result
@@ -0,0 +1,223 @@
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any
+
+import numpy as np
+
+from homr.model import Staff
+from homr.results import ResultStaff
+from homr.staff_parsing_tromr import pick_best_result, predict_batch
+from homr.type_definitions import NDArray
+
+
+class StaffBatchQueue:
+    """
+    Collects work items from many pages and hands them out in batches.
+    Items are grouped into buckets by width: the staffs in a batch have a similar
+    number of symbols and therefore finish decoding after a similar number of steps.
+
+    A batch is handed out as soon as a bucket is full. A partial batch is handed out
+    if the oldest item waited longer than max_delay_in_seconds, if more than
+    max_pending items are queued or after the queue was closed.
+    put blocks while max_pending items are queued.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        bucket_width: int = 256,
+        max_pending: int | None = None,
+        max_delay_in_seconds: float = 1.0,
+    ) -> None:
+        self.batch_size = max(batch_size, 1)
+        self.bucket_width = bucket_width
+        self.max_pending = max_pending if max_pending is not None else 4 * self.batch_size
+        self.max_delay_in_seconds = max_delay_in_seconds
+        self.buckets: dict[int, list[tuple[float, Any]]] = {}
+        self.pending = 0
+        self.is_closed = False
+        self._condition = threading.Condition()
+
+    def put(self, width: int, item: Any) -> None:
+        with self._condition:
+            while self.pending >= self.max_pending:
+                self._condition.wait()
+            bucket = self.buckets.setdefault(width // self.bucket_width, [])
+            bucket.append((time.monotonic(), item))
+            self.pending += 1
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self.is_closed = True
+            self._condition.notify_all()
+
+    def get_batch(self) -> list[Any]:
+        """
+        Blocks until a batch is available. Returns an empty list once the queue
+        is closed and all items were handed out.
+        """
+        with self._condition:
+            while True:
+                key, wait_time = self._pick_bucket()
+                if key is not None:
+                    bucket = self.buckets[key]
+                    batch = bucket[: self.batch_size]
+                    del bucket[: self.batch_size]
+                    if len(bucket) == 0:
+                        del self.buckets[key]
+                    self.pending -= len(batch)
+                    self._condition.notify_all()
+                    return [item for _queued_at, item in batch]
+                if self.is_closed:
+                    return []
+                self._condition.wait(wait_time)
+
+    def _pick_bucket(self) -> tuple[int | None, float | None]:
+        """
+        Returns the bucket which should be handed out next or
+        how long to wait until the oldest item is due.
+        """
+        if len(self.buckets) == 0:
+            return None, None
+        full = [key for key, bucket in self.buckets.items() if len(bucket) >= self.batch_size]
+        if len(full) > 0:
+            return full[0], None
+        if self.is_closed or self.pending >= self.max_pending:
+            return max(self.buckets, key=lambda key: len(self.buckets[key])), None
+        oldest_key = min(self.buckets, key=lambda key: self.buckets[key][0][0])
+        waited = time.monotonic() - self.buckets[oldest_key][0][0]
+        if waited >= self.max_delay_in_seconds:
+            return oldest_key, None
+        return None, self.max_delay_in_seconds - waited
+
+
+def get_content_width(staff_image: NDArray) -> int:
+    """
+    The staff is drawn at the left border of the white canvas,
+    returns the position of the last column which isn't white.
+    """
+    white = 255
+    is_ink = staff_image < white
+    if is_ink.ndim == 3:  # noqa: PLR2004
+        is_ink = np.any(is_ink, axis=2)
+    non_white_columns = np.flatnonzero(np.any(is_ink, axis=0))
+    if len(non_white_columns) == 0:
+        return 0
+    return int(non_white_columns[-1]) + 1
+
+
+class _PageInDecoding:
+    def __init__(
+        self,
+        staffs: list[Staff],
+        number_of_options: list[int],
+        on_decoded: Callable[[list[list[list[str]]]], None] | None,
+    ) -> None:
+        self.staffs = staffs
+        self.on_decoded = on_decoded
+        self.results: list[list[list[str] | None]] = [[None] * n for n in number_of_options]
+        self.remaining = sum(number_of_options)
+        self.future: Future[list[ResultStaff]] = Future()
+
+
+class _StaffImage:
+    def __init__(self, page: _PageInDecoding, staff_index: int, option: int, image: NDArray):
+        self.page = page
+        self.staff_index = staff_index
+        self.option = option
+        self.image = image
+
+
+class CrossPageStaffDecoder:
+    """
+    Decodes the staffs of many pages in shared batches. Pages submit their prepared
+    staffs and get a future for the results, while run decodes batches from the
+    staffs of all pages in a background thread.
+    """
+
+    def __init__(
+        self,
+        queue: StaffBatchQueue,
+        decode: Callable[[list[NDArray]], list[list[str]]] = predict_batch,
+    ) -> None:
+        self.queue = queue
+        self.decode = decode
+        self.number_of_batches = 0
+        self.number_of_images = 0
+        self.busy_seconds = 0.0
+
+    def submit(
+        self,
+        staffs: list[Staff],
+        image_options: list[list[NDArray]],
+        on_decoded: Callable[[list[list[list[str]]]], None] | None = None,
+    ) -> Future[list[ResultStaff]]:
+        """
+        Queues all image options of the staffs of a page. The future returns one
+        result per staff, in the order of the staffs. on_decoded gets the model
+        outputs of all image options once the page is decoded.
+        """
+        page = _PageInDecoding(staffs, [len(options) for options in image_options], on_decoded)
+        if page.remaining == 0:
+            page.future.set_result([])
+            return page.future
+        for staff_index, options in enumerate(image_options):
+            width = get_content_width(options[0])
+            for option, image in enumerate(options):
+                self.queue.put(width, _StaffImage(page, staff_index, option, image))
+        return page.future
+
+    def close(self) -> None:
+        """
+        Signals that no more pages will be submitted, run returns after the last batch.
+        """
+        self.queue.close()
+
+    def run(self) -> None:
+        while True:
+            batch: list[_StaffImage] = self.queue.get_batch()
+            if len(batch) == 0:
+                return
+            start = time.perf_counter()
+            try:
+                outputs = self.decode([item.image for item in batch])
+            except Exception as e:
+                for item in batch:
+                    if not item.page.future.done():
+                        item.page.future.set_exception(e)
+                continue
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+            self.number_of_batches += 1
+            self.number_of_images += len(batch)
+            for item, output in zip(batch, outputs, strict=True):
+                self._add_result(item, output)
+
+    def _add_result(self, item: _StaffImage, output: list[str]) -> None:
+        page = item.page
+        page.results[item.staff_index][item.option] = output
+        page.remaining -= 1
+        if page.remaining > 0 or page.future.done():
+            return
+        outputs = [[option for option in options if option is not None] for options in page.results]
+        try:
+            if page.on_decoded is not None:
+                page.on_decoded(outputs)
+            results = [
+                pick_best_result(staff, options)
+                for staff, options in zip(page.staffs, outputs, strict=True)
+            ]
+        except Exception as e:
+            page.future.set_exception(e)
+            return
+        page.future.set_result(results)
+
+    def format_report(self) -> str:
+        average = self.number_of_images / self.number_of_batches if self.number_of_batches else 0
+        return (
+            f"Decoded {self.number_of_images} staff images in {self.number_of_batches} batches"
+            + f" (average batch size {average:.1f}), {self.busy_seconds:.2f}s busy"
+        )
@@ -1,4 +1,5 @@
-from collections.abc import Generator, Iterable
+import heapq
+from bisect import bisect_left, bisect_right
 
 import cv2
 import cv2.typing as cvt
@@ -9,12 +10,15 @@ from homr import constants
 from homr.bounding_boxes import (
     DebugDrawable,
     RotatedBoundingBox,
+    are_rectangles_intersecting,
     create_rotated_bounding_box,
+    get_rectangle_corners,
 )
 from homr.debug import Debug
 from homr.image_utils import crop_image
-from homr.model import Staff, StaffPoint
+from homr.model import Staff
 from homr.simple_logging import eprint
+from homr.tracing import trace_count
 from homr.type_definitions import NDArray
 
 
@@ -42,6 +46,29 @@ class StaffLineSegment(DebugDrawable):
         self.max_x = max([line.center[0] + line.size[0] / 2 for line in staff_fragments])
         self.min_y = min([line.center[1] - line.size[1] / 2 for line in staff_fragments])
         self.max_y = max([line.center[1] + line.size[1] / 2 for line in staff_fragments])
+        tolerance = constants.staff_line_segment_x_tolerance
+        self._starts = [
+            fragment.center[0] - fragment.size[0] / 2 - tolerance
+            for fragment in self.staff_fragments
+        ]
+        self._ends = [
+            fragment.center[0] + fragment.size[0] / 2 + tolerance
+            for fragment in self.staff_fragments
+        ]
+        # Fragments can overlap, so get_at searches on the running maximum of the ends
+        # and stops once no later fragment starts early enough
+        self._max_ends = list(np.maximum.accumulate(self._ends))
+        self._min_starts = list(np.minimum.accumulate(self._starts[::-1])[::-1])
+
+    def get_indices_at(self, xs: NDArray) -> NDArray:
+        """
+        Vectorized get_at, returns the index of the fragment at every x or -1.
+        """
+        result = np.full(len(xs), -1, dtype=np.int64)
+        # Going from right to left, so that the first fragment which covers x wins
+        for i in reversed(range(len(self.staff_fragments))):
+            result[(xs >= self._starts[i]) & (xs <= self._ends[i])] = i
+        return result
 
     def merge(self, other: "StaffLineSegment") -> "StaffLineSegment":
         staff_lines = self.staff_fragments.copy()
@@ -51,13 +78,14 @@ class StaffLineSegment(DebugDrawable):
         return StaffLineSegment(self.debug_id, staff_lines)
 
     def get_at(self, x: float) -> RotatedBoundingBox | None:
-        tolerance = constants.staff_line_segment_x_tolerance
-        for fragment in self.staff_fragments:
-            if (
-                x >= fragment.center[0] - fragment.size[0] / 2 - tolerance
-                and x <= fragment.center[0] + fragment.size[0] / 2 + tolerance
-            ):
-                return fragment
+        """
+        Returns the first fragment (from left to right) which covers x.
+        """
+        for i in range(bisect_left(self._max_ends, x), len(self.staff_fragments)):
+            if self._min_starts[i] > x:
+                break
+            if x >= self._starts[i] and x <= self._ends[i]:
+                return self.staff_fragments[i]
         return None
 
     def is_overlapping(self, other: "StaffLineSegment") -> bool:
@@ -119,6 +147,58 @@ class StaffAnchor(DebugDrawable):
         cv2.line(img, [x - 50, self.zone.stop], [x + 50, self.zone.stop], color, 2)
 
 
+class StaffFragmentIndex:
+    """
+    Staff fragments sorted by the y position of their centers together with their
+    corners and extents, so that a query only looks at the fragments in its window.
+    """
+
+    def __init__(self, fragments: list[RotatedBoundingBox]) -> None:
+        self.fragments = fragments
+        self._corners = get_rectangle_corners([fragment.box for fragment in fragments])
+        center_y = np.array([fragment.center[1] for fragment in fragments], dtype=np.float64)
+        self._order = np.argsort(center_y, kind="stable")
+        self._sorted_y = center_y[self._order]
+        self._min_xy = self._corners.min(axis=1, initial=np.inf)
+        self._max_xy = self._corners.max(axis=1, initial=-np.inf)
+        # How far a fragment reaches above or below its center
+        self._y_reach = float(
+            np.max(
+                np.maximum(self._max_xy[:, 1] - center_y, center_y - self._min_xy[:, 1]),
+                initial=0,
+            )
+        )
+
+    def _get_indices_by_center_y(self, min_y: float, max_y: float) -> NDArray:
+        start = np.searchsorted(self._sorted_y, min_y, side="left")
+        stop = np.searchsorted(self._sorted_y, max_y, side="right")
+        return np.sort(self._order[start:stop])
+
+    def get_by_center_y(self, min_y: float, max_y: float) -> list[RotatedBoundingBox]:
+        """
+        Returns the fragments with min_y <= center y <= max_y in their original order.
+        """
+        return [self.fragments[i] for i in self._get_indices_by_center_y(min_y, max_y)]
+
+    def get_intersecting(self, box: RotatedBoundingBox) -> list[RotatedBoundingBox]:
+        """
+        Returns the fragments which intersect the box in their original order,
+        see RotatedBoundingBox.is_intersecting.
+        """
+        corners = get_rectangle_corners([box.box])[0]
+        box_min, box_max = corners.min(axis=0), corners.max(axis=0)
+        candidates = self._get_indices_by_center_y(
+            box_min[1] - self._y_reach, box_max[1] + self._y_reach
+        )
+        in_window = np.all(
+            (self._min_xy[candidates] <= box_max) & (self._max_xy[candidates] >= box_min),
+            axis=1,
+        )
+        candidates = candidates[in_window]
+        is_intersecting = are_rectangles_intersecting(corners, self._corners[candidates])
+        return [self.fragments[i] for i in candidates[is_intersecting]]
+
+
 def _get_all_contours(lines: list[StaffLineSegment]) -> list[cvt.MatLike]:
     all_fragments: list[RotatedBoundingBox] = []
     for line in lines:
@@ -176,13 +256,10 @@ def find_raw_staffs_by_connecting_line_fragments(
     """
     staffs: list[RawStaff] = []
     staff_id = 0
+    fragment_index = StaffFragmentIndex(staff_fragments)
     for anchor in anchors:
         existing_staff = get_staff_for_anchor(anchor, staffs)
-        fragments = [
-            fragment
-            for fragment in staff_fragments
-            if fragment.center[1] >= anchor.zone.start and fragment.center[1] <= anchor.zone.stop
-        ]
+        fragments = fragment_index.get_by_center_y(anchor.zone.start, anchor.zone.stop)
         connected = connect_staff_lines(fragments, anchor.average_unit_size)
         staff_lines: list[StaffLineSegment] = []
         for anchor_line in anchor.staff_lines:
@@ -233,21 +310,59 @@ def connect_staff_lines(
     and builds a list of StaffLineSegments
     where segments have an increased likelyhood to belong to a staff.
     """
-    # With the pop below we are going through the elements from left to right
+    # Reversing the sort keeps the order in which fragments with the same x
+    # have always been processed
     sorted_by_right_to_left = sorted(staff_lines, key=lambda box: box.box[0][0], reverse=True)
+    tolerance = constants.tolerance_for_staff_line_detection(unit_size)
+    max_gap = constants.max_line_gap_size(unit_size)
     result: list[list[RotatedBoundingBox]] = []
-    while len(sorted_by_right_to_left) > 0:
-        current_staff_line: RotatedBoundingBox = sorted_by_right_to_left.pop()
+    # Sweep from left to right. The tails of the lines which can still be extended
+    # are kept sorted by y, together with a heap of the x positions at which they
+    # are too far away to be connected to any of the remaining fragments.
+    active_y: list[float] = []
+    active_lines: list[int] = []
+    slopes = [abs(float(np.tan(line.box[2] / 180 * np.pi))) for line in staff_lines]
+    max_slope = max(slopes, default=0.0)
+    slope_by_line: dict[int, float] = {}
+    out_of_reach: list[tuple[float, int, int]] = []
+    for current_staff_line in reversed(sorted_by_right_to_left):
         is_short_line = current_staff_line.box[1][0] < constants.is_short_line(unit_size)
         if is_short_line:
             continue
-        connected = False
-        for staff_lines in result:
-            if staff_lines[-1].is_overlapping_extrapolated(current_staff_line, unit_size):
-                staff_lines.append(current_staff_line)
-                connected = True
-        if not connected:
+        (x, y), (width, _height), angle = current_staff_line.box
+        while len(out_of_reach) > 0 and out_of_reach[0][0] < x:
+            _, line_id, length = heapq.heappop(out_of_reach)
+            if len(result[line_id]) == length:
+                _remove_line_tail(active_y, active_lines, result[line_id][-1], line_id)
+
+        # The fragments meet at most this far away from their centers
+        # if they pass the gap check of is_overlapping_extrapolated,
+        # that limits how far apart their y positions can be
+        max_distance = max_gap + width / 2 + 1
+        slope = abs(float(np.tan(angle / 180 * np.pi)))
+        window = tolerance + max_distance * (max_slope + slope) + 1
+        start = bisect_left(active_y, y - window)
+        stop = bisect_right(active_y, y + window)
+        connected_to = sorted(
+            line_id
+            for line_y, line_id in zip(active_y[start:stop], active_lines[start:stop], strict=True)
+            if abs(line_y - y) <= tolerance + max_distance * (slope_by_line[line_id] + slope) + 1
+            and result[line_id][-1].is_overlapping_extrapolated(current_staff_line, unit_size)
+        )
+        for line_id in connected_to:
+            _remove_line_tail(active_y, active_lines, result[line_id][-1], line_id)
+            result[line_id].append(current_staff_line)
+        if len(connected_to) == 0:
+            connected_to = [len(result)]
             result.append([current_staff_line])
+
+        reach = x + 2 * (width / 2 + max_gap + 1)
+        for line_id in connected_to:
+            position = bisect_right(active_y, y)
+            active_y.insert(position, y)
+            active_lines.insert(position, line_id)
+            slope_by_line[line_id] = slope
+            heapq.heappush(out_of_reach, (reach, line_id, len(result[line_id])))
     result_top_to_bottom = sorted(result, key=lambda lines: lines[0].box[0][1])
     connected_lines = [
         StaffLineSegment(i, staff_lines) for i, staff_lines in enumerate(result_top_to_bottom)
@@ -255,6 +370,16 @@ def connect_staff_lines(
     return connected_lines
 
 
+def _remove_line_tail(
+    active_y: list[float], active_lines: list[int], tail: RotatedBoundingBox, line_id: int
+) -> None:
+    position = bisect_left(active_y, tail.box[0][1])
+    while active_lines[position] != line_id:
+        position += 1
+    del active_y[position]
+    del active_lines[position]
+
+
 def are_lines_crossing(lines: list[StaffLineSegment]) -> bool:
     for i in range(len(lines)):
         for j in range(i + 1, len(lines)):
@@ -307,6 +432,7 @@ def find_staff_anchors(
     (and never above or beyond them like notes can be).
     """
     result: list[StaffAnchor] = []
+    fragment_index = StaffFragmentIndex(staff_lines)
 
     for center_symbol in anchor_symbols:
         # As the symbol disconnects the staff lines it's the hardest to detect them at the center.
@@ -329,9 +455,7 @@ def find_staff_anchors(
         for symbol in adjacent:
             estimated_unit_size = round(symbol.size[1] / (constants.number_of_lines_on_a_staff - 1))
             thickened_bar_line = symbol.make_box_taller(estimated_unit_size)
-            overlapping_staff_lines = [
-                line for line in staff_lines if line.is_intersecting(thickened_bar_line)
-            ]
+            overlapping_staff_lines = fragment_index.get_intersecting(thickened_bar_line)
             connected_lines = connect_staff_lines(overlapping_staff_lines, estimated_unit_size)
             if len(connected_lines) > constants.number_of_lines_on_a_staff:
                 connected_lines = [
@@ -340,6 +464,8 @@ def find_staff_anchors(
                     if (line.max_x - line.min_x)
                     > constants.is_short_connected_line(estimated_unit_size)
                 ]
+            if len(connected_lines) == 0:
+                continue
             if are_lines_crossing(connected_lines) or not are_lines_parallel(
                 connected_lines, estimated_unit_size
             ):
@@ -355,53 +481,71 @@ def find_staff_anchors(
     return result
 
 
-def resample_staff_segment(  # noqa: C901
-    anchor: StaffAnchor, staff: RawStaff, axis_range: Iterable[int]
-) -> Generator[StaffPoint, None, None]:
-    x = anchor.symbol.center[0]
-    line_fragments = [line.staff_fragments[0] for line in anchor.staff_lines]
-    centers: list[float] = [line.get_center_extrapolated(x) for line in line_fragments]
-    previous_point = StaffPoint(
-        x, centers, float(np.mean([line.angle for line in line_fragments]))
-    )  # Dummy point at the anchor points
-    for x in axis_range:
-        lines = [line.get_at(x) for line in staff.lines]
-        axis_center = [
-            line.get_center_extrapolated(x) if line is not None else None for line in lines
-        ]
-        center_values = [center for center in axis_center if center is not None]
-        incomplete = all(center is None for center in axis_center)
-        if incomplete:
-            continue
-        deltas = np.diff(center_values)
-        non_parallel = [delta < 0.5 * anchor.average_unit_size for delta in deltas]
-        for i, invalid in enumerate(non_parallel):
-            if invalid:
-                axis_center[i] = None
-                axis_center[i + 1] = None
-
-        for i, previous_y in enumerate(previous_point.y):
-            center_value = axis_center[i]
-            if (
-                center_value is not None
-                and abs(center_value - previous_y) > 0.5 * anchor.average_unit_size
-            ):
-                axis_center[i] = None
-
-        prev_center = -1
-        for i in list(range(len(axis_center))) + list(reversed(list(range(len(axis_center))))):
-            if axis_center[i] is not None:
-                prev_center = i
-            elif prev_center >= 0:
-                center_value = axis_center[prev_center]
-                if center_value is not None:
-                    axis_center[i] = center_value + anchor.average_unit_size * (i - prev_center)
-        incomplete = any(center is None for center in axis_center)
-        if incomplete:
-            continue
-        angle = float(np.mean([line.angle for line in lines if line is not None]))
-        previous_point = StaffPoint(x, [c for c in axis_center if c is not None], angle)
-        yield previous_point
+def _fill_staff_lines(
+    centers: NDArray, previous: NDArray, unit_size: NDArray, half_unit_size: NDArray
+) -> NDArray:
+    """
+    Masks the line positions (N, 5) which jumped by more than half a unit size compared
+    to the previous point and fills the gaps by propagating the unit size from the
+    remaining lines. Rows which end up without any line position stay NaN.
+    """
+    is_valid = ~np.isnan(centers) & ~(np.abs(centers - previous) > half_unit_size)
+    line_index = np.arange(centers.shape[1])
+    before = np.maximum.accumulate(np.where(is_valid, line_index, -1), axis=1)
+    after = np.minimum.accumulate(
+        np.where(is_valid, line_index, centers.shape[1])[:, ::-1], axis=1
+    )[:, ::-1]
+    # Lines below the first valid one are filled from the last valid line above them,
+    # lines above it from the first valid line
+    source = np.where(before >= 0, before, after)
+    has_source = source < centers.shape[1]
+    source = np.where(has_source, source, 0)
+    filled = np.take_along_axis(centers, source, axis=1) + unit_size * (line_index - source)
+    result: NDArray = np.where(has_source, np.where(is_valid, centers, filled), np.nan)
+    return result
+
+
+def sample_staff_lines(staff: RawStaff, xs: NDArray) -> tuple[NDArray, NDArray]:
+    """
+    Returns the y positions (N, 5) of the staff lines at the given x positions,
+    NaN where a line has no fragment, and the mean angle of the found lines.
+    """
+    centers = np.full((len(xs), len(staff.lines)), np.nan)
+    angles = np.zeros((len(xs), len(staff.lines)))
+    for i, line in enumerate(staff.lines):
+        indices = line.get_indices_at(xs)
+        found = indices >= 0
+        fragments = [line.staff_fragments[index] for index in indices[found]]
+        fragment_x = np.array([fragment.box[0][0] for fragment in fragments], dtype=np.float64)
+        fragment_y = np.array([fragment.box[0][1] for fragment in fragments], dtype=np.float64)
+        slopes = np.array(
+            [np.tan(fragment.box[2] / 180 * np.pi) for fragment in fragments], dtype=np.float64
+        )
+        centers[found, i] = (xs[found] - fragment_x) * slopes + fragment_y
+        angles[found, i] = [fragment.angle for fragment in fragments]
+    has_line = ~np.isnan(centers)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_angles: NDArray = np.where(has_line, angles, 0).sum(axis=1) / has_line.sum(axis=1)
+    return centers, mean_angles
+
+
+def _remove_non_parallel_lines(centers: NDArray, half_unit_size: NDArray) -> NDArray:
+    """
+    Lines which are closer than half a unit size are not parallel. The differences are
+    taken between the found lines but applied to the line indices, same as it always was.
+    """
+    has_line = ~np.isnan(centers)
+    compacted_order = np.argsort(~has_line, axis=1, kind="stable")
+    compacted = np.take_along_axis(centers, compacted_order, axis=1)
+    delta_index = np.arange(centers.shape[1] - 1)
+    non_parallel = (delta_index < has_line.sum(axis=1)[:, None] - 1) & (
+        np.diff(compacted, axis=1) < half_unit_size
+    )
+    is_parallel = np.ones_like(has_line)
+    is_parallel[:, :-1] &= ~non_parallel
+    is_parallel[:, 1:] &= ~non_parallel
+    result: NDArray = np.where(is_parallel, centers, np.nan)
+    return result
 
 
 def resample_staff(staff: RawStaff) -> Staff:
@@ -409,10 +553,10 @@ def resample_staff(staff: RawStaff) -> Staff:
     staff_density = 10
     start = (staff.min_x // staff_density) * staff_density
     stop = (staff.max_x // staff_density + 1) * staff_density
-    current_anchor = 0
-    anchor = anchors_left_to_right[current_anchor]
 
-    grid: list[StaffPoint] = []
+    # Every anchor is the start of a segment to the left and one to the right,
+    # each segment is sampled in the order in which it moves away from its anchor
+    segments: list[tuple[StaffAnchor, range]] = []
     x = start
     for i, anchor in enumerate(anchors_left_to_right):
         to_left = range(int(x), int(anchor.symbol.center[0]), staff_density)
@@ -425,10 +569,61 @@ def resample_staff(staff: RawStaff) -> Staff:
         else:
             to_right = range(int(anchor.symbol.center[0]), int(stop), staff_density)
         x = to_right.stop
-        grid.extend(reversed(list(resample_staff_segment(anchor, staff, reversed(to_left)))))
-        grid.extend(resample_staff_segment(anchor, staff, to_right))
-
-    return Staff(grid)
+        segments.append((anchor, to_left[::-1]))
+        segments.append((anchor, to_right))
+
+    lengths = [len(axis_range) for _, axis_range in segments]
+    first_points = np.cumsum([0, *lengths[:-1]])
+    segment_of_point = np.repeat(np.arange(len(segments)), lengths)
+    segment_start = first_points[segment_of_point]
+    xs = np.array([x for _, axis_range in segments for x in axis_range], dtype=np.int64)
+    # Dummy points at the anchor points
+    anchor_centers = np.array(
+        [
+            [
+                line.staff_fragments[0].get_center_extrapolated(anchor.symbol.center[0])
+                for line in anchor.staff_lines
+            ]
+            for anchor, _ in segments
+        ]
+    )[segment_of_point]
+    unit_size = np.array([anchor.average_unit_size for anchor, _ in segments])[
+        segment_of_point, None
+    ]
+    half_unit_size = 0.5 * unit_size
+
+    centers, angles = sample_staff_lines(staff, xs)
+    centers = _remove_non_parallel_lines(centers, half_unit_size)
+
+    # Every point is compared with the last complete point before it in its segment.
+    # Instead of a loop over the points, all of them are first compared with the anchor
+    # and then with the last complete point of the previous round until nothing
+    # changes anymore. Every round settles at least one more point.
+    point_index = np.arange(len(xs))
+    previous = anchor_centers
+    while True:
+        filled = _fill_staff_lines(centers, previous, unit_size, half_unit_size)
+        is_complete = ~np.isnan(filled).any(axis=1)
+        last_complete = np.maximum.accumulate(np.where(is_complete, point_index, -1))
+        last_complete_before = np.concatenate([[-1], last_complete])[:-1]
+        next_previous = np.where(
+            (last_complete_before >= segment_start)[:, None],
+            filled[last_complete_before],
+            anchor_centers,
+        )
+        if np.array_equal(next_previous, previous):
+            break
+        previous = next_previous
+
+    # The segments to the left of the anchors were sampled from right to left
+    order = np.concatenate(
+        [
+            np.arange(first, first + length)[:: -1 if i % 2 == 0 else 1]
+            for i, (first, length) in enumerate(zip(first_points, lengths, strict=True))
+        ]
+    )
+    order = order[is_complete[order]]
+    return Staff.from_arrays(xs[order], filled[order], angles[order])
 
 
 def resample_staffs(staffs: list[RawStaff]) -> list[Staff]:
@@ -508,13 +703,16 @@ def init_zone(clef_anchors: list[StaffAnchor], image_shape: tuple[int, ...]) ->
 def filter_line_peaks(
     peaks: NDArray, norm: NDArray, max_gap_ratio: float = 1.5
 ) -> tuple[NDArray, list[int]]:
-    valid_peaks = np.array([True for _ in range(len(peaks))])
+    """
+    Groups the peaks into staffs by their gaps and marks the peaks which
+    belong to a complete staff of five lines as valid.
+    """
+    if len(peaks) == 0:
+        return np.zeros(0, dtype=bool), []
 
     # Filter by height
-    for idx, p in enumerate(peaks):
-        max_peak_height = 15
-        if norm[p] > max_peak_height:
-            valid_peaks[idx] = False
+    max_peak_height = 15
+    valid_peaks = norm[peaks] <= max_peak_height
 
     # Filter by x-axis
     gaps = peaks[1:] - peaks[:-1]
@@ -522,70 +720,78 @@ def filter_line_peaks(
     approx_unit = np.mean(np.sort(gaps)[:count])
     max_gap = approx_unit * max_gap_ratio
 
-    ext_peaks = [peaks[0] - max_gap - 1] + list(
-        peaks
-    )  # Prepend an invalid peak for better handling edge case
-    groups = []
-    group = -1
-    for i in range(1, len(ext_peaks)):
-        if ext_peaks[i] - ext_peaks[i - 1] > max_gap:
-            group += 1
-        groups.append(group)
-
-    groups.append(groups[-1] + 1)  # Append an invalid group for better handling edge case
-    cur_g = groups[0]
-    count = 1
-    for idx in range(1, len(groups)):
-        group = groups[idx]
-        if group == cur_g:
-            count += 1
-            continue
+    # Prepend an invalid peak, so that the first peak starts the first group
+    ext_peaks = np.concatenate([[peaks[0] - max_gap - 1], peaks])
+    groups = np.cumsum(np.diff(ext_peaks) > max_gap) - 1
 
-        if count < constants.number_of_lines_on_a_staff:
+    group_starts = np.flatnonzero(np.diff(groups, prepend=groups[0] - 1))
+    group_sizes = np.diff(group_starts, append=len(groups))
+    number_of_lines = constants.number_of_lines_on_a_staff
+    for start, size in zip(group_starts.tolist(), group_sizes.tolist(), strict=True):
+        if size < number_of_lines:
             # Incomplete peaks. Also eliminates the top and bottom incomplete staff lines.
-            valid_peaks[idx - count : idx] = False
-        elif count > constants.number_of_lines_on_a_staff:
-            cand_peaks = peaks[idx - count : idx]
-            head_part = cand_peaks[: constants.number_of_lines_on_a_staff]
-            tail_part = cand_peaks[-constants.number_of_lines_on_a_staff :]
+            valid_peaks[start : start + size] = False
+        elif size > number_of_lines:
+            cand_peaks = peaks[start : start + size]
+            head_part = cand_peaks[:number_of_lines]
+            tail_part = cand_peaks[-number_of_lines:]
             if sum(norm[head_part]) > sum(norm[tail_part]):
-                valid_peaks[idx - count + constants.number_of_lines_on_a_staff : idx] = False
+                valid_peaks[start + number_of_lines : start + size] = False
             else:
-                valid_peaks[idx - count : idx - constants.number_of_lines_on_a_staff] = False
+                valid_peaks[start : start + size - number_of_lines] = False
+    return valid_peaks, groups.tolist()
 
-        cur_g = group
-        count = 1
-    return valid_peaks, groups[:-1]
 
-
-def find_horizontal_lines(
-    image: NDArray, unit_size: float, line_threshold: float = 0.0
+def _find_lines_in_profile(
+    count: NDArray, unit_size: float, line_threshold: float
 ) -> list[list[int]]:
-    # Split into zones horizontally and detects staff lines separately.
-    count = np.zeros(len(image), dtype=np.uint16)
-    sub_ys, _sub_xs = np.where(image > 0)
-    for y in sub_ys:
-        count[y] += 1
-
     count = np.insert(count, [0, len(count)], [0, 0])  # Prepend / append
     norm = (count - np.mean(count)) / np.std(count)
     centers, _ = signal.find_peaks(norm, height=line_threshold, distance=unit_size, prominence=1)
     centers -= 1
     norm = norm[1:-1]  # Remove prepend / append
     _valid_centers, groups = filter_line_peaks(centers, norm)
-    grouped_centers: dict[int, list[int]] = {}
-    for i, center in enumerate(centers):
-        group_number = groups[i]
-        if group_number not in grouped_centers:
-            grouped_centers[group_number] = []
-        grouped_centers[group_number].append(center)
+    _group_ids, group_starts, group_sizes = np.unique(groups, return_index=True, return_counts=True)
     complete_groups = []
-    for key in grouped_centers.keys():
-        if len(grouped_centers[key]) == constants.number_of_lines_on_a_staff:
-            complete_groups.append(sorted(grouped_centers[key]))
+    for start, size in zip(group_starts.tolist(), group_sizes.tolist(), strict=True):
+        if size == constants.number_of_lines_on_a_staff:
+            complete_groups.append(sorted(centers[start : start + size].tolist()))
     return complete_groups
 
 
+def find_horizontal_lines(
+    image: NDArray, unit_size: float, line_threshold: float = 0.0
+) -> list[list[int]]:
+    """
+    Finds groups of five staff lines as peaks in the horizontal projection profile
+    (the number of foreground pixels per row) of the image. This is cheap enough
+    to be used on whole pages if the staffs are straight.
+    """
+    count = np.count_nonzero(image > 0, axis=1)
+    return _find_lines_in_profile(count, unit_size, line_threshold)
+
+
+def find_horizontal_lines_in_zones(
+    image: NDArray, zones: list[range], unit_size: float, line_threshold: float = 0.0
+) -> list[list[list[int]]]:
+    """
+    find_horizontal_lines for many vertical slices of the image at once.
+    The zones must be sorted and must not overlap, as the ones from init_zone.
+    """
+    mask = image > 0
+    width = mask.shape[1]
+    profiles = np.zeros((len(zones), len(mask)), dtype=np.int64)
+    non_empty = [i for i, zone in enumerate(zones) if len(zone) > 0]
+    # The sums between the boundaries are the profiles of the zones and of the gaps between them
+    boundaries = [bound for i in non_empty for bound in (zones[i].start, zones[i].stop)]
+    if len(boundaries) > 0 and boundaries[-1] == width:
+        boundaries.pop()
+    if len(boundaries) > 0:
+        sums = np.add.reduceat(mask, boundaries, axis=1, dtype=np.int64)
+        profiles[non_empty] = sums[:, ::2].T
+    return [_find_lines_in_profile(profile, unit_size, line_threshold) for profile in profiles]
+
+
 def predict_other_anchors_from_clefs(
     clef_anchors: list[StaffAnchor], image: NDArray
 ) -> list[RotatedBoundingBox]:
@@ -593,9 +799,8 @@ def predict_other_anchors_from_clefs(
     anchor_symbols = [anchor.symbol for anchor in clef_anchors]
     clef_zones = init_zone(clef_anchors, image.shape)
     result: list[RotatedBoundingBox] = []
-    for zone in clef_zones:
-        vertical_slice = image[:, zone]
-        lines_groups = find_horizontal_lines(vertical_slice, average_unit_size)
+    zone_lines = find_horizontal_lines_in_zones(image, clef_zones, average_unit_size)
+    for zone, lines_groups in zip(clef_zones, zone_lines, strict=True):
         for group in lines_groups:
             min_y = min(group)
             max_y = max(group)
@@ -606,6 +811,52 @@ def predict_other_anchors_from_clefs(
     return [r for r in result if not r.is_overlapping_with_any(anchor_symbols)]
 
 
+def _break_wide_fragment(fragment: RotatedBoundingBox, limit: int) -> list[RotatedBoundingBox]:
+    """
+    Cuts the fragment into parts which are limit wide, until the remaining part
+    is narrow enough.
+    """
+    points = np.asarray(fragment.contours).reshape(-1, 1, 2)
+    points = points[np.argsort(points[:, 0, 0], kind="stable")]
+    xs = points[:, 0, 0]
+    # Every part starts at the first point which is at least limit right of the
+    # start of the previous part
+    starts = [0]
+    while True:
+        start = int(np.searchsorted(xs, xs[starts[-1]] + limit))
+        if start >= len(xs):
+            break
+        starts.append(start)
+    ends = [*starts[1:], len(xs)]
+
+    # The hulls of the remaining parts after each cut, built up from the right,
+    # so that the remaining part can be fitted without looking at all of its points
+    hulls: list[cvt.MatLike] = []
+    hull = np.empty((0, 1, 2), dtype=points.dtype)
+    for start, end in zip(reversed(starts), reversed(ends), strict=True):
+        hull = cv2.convexHull(np.concatenate([points[start:end], hull]))
+        hulls.append(hull)
+    hulls.reverse()
+
+    remaining_fragment = fragment
+    number_of_parts = 0
+    while remaining_fragment.size[0] > limit and number_of_parts + 1 < len(starts):
+        number_of_parts += 1
+        remaining_fragment = RotatedBoundingBox(
+            cv2.minAreaRect(hulls[number_of_parts]),
+            points[starts[number_of_parts] :],
+            fragment.debug_id,
+        )
+    # Make sure that the parts remain connected by adding
+    # the first point of the next part to each part
+    result = [
+        create_rotated_bounding_box(points[start : end + 1], fragment.debug_id)
+        for start, end in zip(starts[:number_of_parts], ends[:number_of_parts], strict=True)
+    ]
+    result.append(remaining_fragment)
+    return result
+
+
 def break_wide_fragments(
     fragments: list[RotatedBoundingBox], limit: int = 100
 ) -> list[RotatedBoundingBox]:
@@ -616,27 +867,10 @@ def break_wide_fragments(
     """
     result = []
     for fragment in fragments:
-        remaining_fragment = fragment
-        while remaining_fragment.size[0] > limit:
-            min_x = min([c[0][0] for c in remaining_fragment.contours])
-            contours_left = [c for c in remaining_fragment.contours if c[0][0] < min_x + limit]
-            contours_right = [c for c in remaining_fragment.contours if c[0][0] >= min_x + limit]
-            # sort by x
-            contours_left = sorted(contours_left, key=lambda c: c[0][0])
-            contours_right = sorted(contours_right, key=lambda c: c[0][0])
-            if len(contours_left) == 0 or len(contours_right) == 0:
-                break
-            # Make sure that the contours remain connected by adding
-            # the first point of the right side to the left side and vice versa
-            contours_left.append(contours_right[0])
-            contours_right.append(contours_left[-1])
-            result.append(
-                create_rotated_bounding_box(np.array(contours_left), remaining_fragment.debug_id)
-            )
-            remaining_fragment = create_rotated_bounding_box(
-                np.array(contours_right), remaining_fragment.debug_id
-            )
-        result.append(remaining_fragment)
+        if fragment.size[0] > limit:
+            result.extend(_break_wide_fragment(fragment, limit))
+        else:
+            result.append(fragment)
     return result
 
 
@@ -705,6 +939,7 @@ def detect_staff(
 
     staff_anchors = filter_unusual_anchors(staff_anchors)
     eprint("Found " + str(len(staff_anchors)) + " staff anchors")
+    trace_count("anchors", len(staff_anchors))
     debug.write_bounding_boxes_alternating_colors("staff_anchors", staff_anchors)
 
     raw_staffs_with_possible_duplicates = find_raw_staffs_by_connecting_line_fragments(
@@ -30,6 +30,14 @@ class StaffDewarping:
             return point
         return self.tform(point)  # type: ignore
 
+    def dewarp_points(self, points: NDArray) -> NDArray:
+        """
+        Vectorized dewarp_point for an array of points (N, 2).
+        """
+        if self.tform is None:
+            return points
+        return self.tform(points)  # type: ignore
+
 
 def is_point_on_image(pts: tuple[int, int], image: NDArray) -> bool:
     height, width = image.shape[:2]
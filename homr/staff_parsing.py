@@ -1,3 +1,9 @@
+import contextvars
+import os
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
@@ -15,9 +21,15 @@ from homr.results import (
 )
 from homr.simple_logging import eprint
 from homr.staff_dewarping import StaffDewarping, dewarp_staff_image
-from homr.staff_parsing_tromr import parse_staff_tromr
+from homr.staff_parsing_tromr import build_image_options, parse_staff_tromr, pick_best_result
+from homr.stage_cache import StageCache
+from homr.tracing import trace_stage
 from homr.type_definitions import NDArray
 
+# The staff image, the staff in the coordinates of the image
+# and the image options for the model
+PreparedStaff = tuple[NDArray, Staff, list[NDArray]]
+
 
 def _ensure_same_number_of_staffs(staffs: list[MultiStaff]) -> list[MultiStaff]:
     have_all_the_same_number_of_staffs = True
@@ -190,8 +202,9 @@ def prepare_staff_image(
         region_step2 = np.array(region) - np.array([*top_left, *top_left])
         top_left = top_left / scaling_factor
         staff = _dewarp_staff(staff, None, top_left, scaling_factor)
-        dewarp = dewarp_staff_image(staff_image, staff, index, debug)
-        staff_image = (255 * dewarp.dewarp(staff_image)).astype(np.uint8)
+        with trace_stage("dewarp_staff"):
+            dewarp = dewarp_staff_image(staff_image, staff, index, debug)
+            staff_image = (255 * dewarp.dewarp(staff_image)).astype(np.uint8)
         staff_image, top_left = crop_image_and_return_new_top(staff_image, *region_step2)
         scaling_factor = 1
 
@@ -236,17 +249,13 @@ def _dewarp_staff(
     Applies the same transformation on the staff coordinates as we did on the image.
     """
 
-    def transform_coordinates(point: tuple[float, float]) -> tuple[float, float]:
-        x, y = point
-        x -= region[0]
-        y -= region[1]
+    def transform_coordinates(points: NDArray) -> NDArray:
+        points = points - np.array([region[0], region[1]])
         if dewarp is not None:
-            x, y = dewarp.dewarp_point((x, y))
-        x = x * scaling
-        y = y * scaling
-        return x, y
+            points = dewarp.dewarp_points(points)
+        return points * scaling
 
-    return staff.transform_coordinates(transform_coordinates)
+    return staff.transform_coordinates_in_bulk(transform_coordinates)
 
 
 def move_key_information(staff: Staff, destination: ResultStaff) -> None:
@@ -256,24 +265,51 @@ def move_key_information(staff: Staff, destination: ResultStaff) -> None:
         dest[i].circle_of_fifth = source[i].get_circle_of_fifth()
 
 
-def parse_staff_image(
+def prepare_staff_for_inference(
     debug: Debug, ranges: list[float], index: int, staff: Staff, predictions: InputPredictions
+) -> PreparedStaff:
+    """
+    All the image processing which is done before the model runs on a staff.
+    It doesn't depend on any other staff, so it can run in parallel.
+    """
+    with trace_stage("prepare_staff"):
+        staff_image, transformed_staff = prepare_staff_image(
+            debug, index, ranges, staff, predictions, perform_dewarp=True
+        )
+        with trace_stage("build_image_options"):
+            image_options = build_image_options(staff_image)
+    return staff_image, transformed_staff, image_options
+
+
+def run_inference_on_staff(
+    debug: Debug,
+    index: int,
+    prepared: PreparedStaff,
+    record: list[list[str]] | None = None,
 ) -> ResultStaff:
-    staff_image, transformed_staff = prepare_staff_image(
-        debug, index, ranges, staff, predictions, perform_dewarp=True
-    )
+    staff_image, transformed_staff, image_options = prepared
     attention_debug = debug.build_attention_debug(staff_image, f"_staff-{index}_output.jpg")
     eprint("Running TrOmr inference on staff image", index)
-    result = parse_staff_tromr(
-        staff_image=staff_image,
-        staff=transformed_staff,
-        debug=attention_debug,
-    )
+    with trace_stage("parse_staff"):
+        result = parse_staff_tromr(
+            staff_image=staff_image,
+            staff=transformed_staff,
+            debug=attention_debug,
+            image_options=image_options,
+            record=record,
+        )
     if attention_debug is not None:
         attention_debug.write()
     return result
 
 
+def parse_staff_image(
+    debug: Debug, ranges: list[float], index: int, staff: Staff, predictions: InputPredictions
+) -> ResultStaff:
+    prepared = prepare_staff_for_inference(debug, ranges, index, staff, predictions)
+    return run_inference_on_staff(debug, index, prepared)
+
+
 def _pick_most_dominant_clef(staff: ResultStaff) -> ResultStaff:  # noqa: C901, PLR0912
     clefs = [clef for clef in staff.get_symbols() if isinstance(clef, ResultClef)]
     clef_types = [clef.clef_type for clef in clefs]
@@ -372,33 +408,147 @@ def remember_new_line(measures: list[ResultMeasure]) -> None:
         measures[0].is_new_line = True
 
 
-def parse_staffs(
-    debug: Debug, staffs: list[MultiStaff], predictions: InputPredictions
-) -> list[ResultStaff]:
+# Every thread crops and resizes the staffs from the full page,
+# more threads mostly compete for the memory bandwidth
+default_staff_workers = min(4, os.cpu_count() or 1)
+
+
+def _prepare_staffs_in_order(
+    debug: Debug,
+    ranges: list[float],
+    staffs: list[Staff],
+    predictions: InputPredictions,
+    max_workers: int | None,
+) -> Iterator[PreparedStaff]:
     """
-    Dewarps each staff and then runs it through an algorithm which extracts
-    the rhythm and pitch information.
+    Prepares the staffs in a thread pool and yields them in their original order.
+    At most two staffs per worker are prepared ahead of the consumer, so that
+    the prepared images don't pile up in memory while the model is busy.
     """
-    staffs = _ensure_same_number_of_staffs(staffs)
-    # For simplicity we call every staff in a multi staff a voice,
-    # even if it's part of a grand staff.
-    number_of_voices = _get_number_of_voices(staffs)
-    i = 0
-    ranges = determine_ranges(staffs)
-    voices = []
-    for voice in range(number_of_voices):
-        staffs_for_voice = [staff.staffs[voice] for staff in staffs]
-        result_for_voice = []
-        for staff in staffs_for_voice:
-            if len(staff.symbols) == 0:
-                continue
-            result_staff = parse_staff_image(debug, ranges, i, staff, predictions)
+    number_of_workers = max_workers if max_workers is not None else default_staff_workers
+    if number_of_workers <= 1:
+        for index, staff in enumerate(staffs):
+            yield prepare_staff_for_inference(debug, ranges, index, staff, predictions)
+        return
+    queue_size = 2 * number_of_workers
+    pending: deque[Future[PreparedStaff]] = deque()
+    with ThreadPoolExecutor(max_workers=number_of_workers) as pool:
+        try:
+            for index, staff in enumerate(staffs):
+                if len(pending) >= queue_size:
+                    yield pending.popleft().result()
+                # The context carries the active trace into the worker thread
+                pending.append(
+                    pool.submit(
+                        contextvars.copy_context().run,
+                        prepare_staff_for_inference,
+                        debug,
+                        ranges,
+                        index,
+                        staff,
+                        predictions,
+                    )
+                )
+            while len(pending) > 0:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class StaffsToParse:
+    """
+    The staffs of a page in the order in which they are parsed, together with
+    the voice of every staff. For simplicity we call every staff in a multi staff
+    a voice, even if it's part of a grand staff.
+    """
+
+    def __init__(self, staffs: list[MultiStaff]) -> None:
+        staffs = _ensure_same_number_of_staffs(staffs)
+        self.number_of_voices = _get_number_of_voices(staffs)
+        self.ranges = determine_ranges(staffs)
+        self.staffs: list[Staff] = []
+        self.voices: list[int] = []
+        for voice in range(self.number_of_voices):
+            for multi_staff in staffs:
+                staff = multi_staff.staffs[voice]
+                if len(staff.symbols) == 0:
+                    continue
+                self.staffs.append(staff)
+                self.voices.append(voice)
+
+    def merge_results(self, results: list[ResultStaff]) -> list[ResultStaff]:
+        """
+        Merges the results of all staffs, given in the order of self.staffs,
+        into one staff per voice.
+        """
+        results_for_voices: list[list[ResultStaff]] = [[] for _ in range(self.number_of_voices)]
+        for i, (voice, result_staff) in enumerate(zip(self.voices, results, strict=True)):
             if result_staff.is_empty():
                 eprint("Skipping empty staff", i)
-                i += 1
                 continue
             remember_new_line(result_staff.measures)
-            result_for_voice.append(result_staff)
-            i += 1
-        voices.append(merge_and_clean(result_for_voice))
-    return voices
+            results_for_voices[voice].append(result_staff)
+        return [merge_and_clean(result_for_voice) for result_for_voice in results_for_voices]
+
+    def pick_results(self, outputs: list[list[list[str]]]) -> list[ResultStaff]:
+        """
+        Picks the result of every staff from the model outputs of its image options.
+        This only depends on the symbols and not on their coordinates,
+        so the staffs don't have to be dewarped.
+        """
+        return [
+            pick_best_result(staff, staff_outputs)
+            for staff, staff_outputs in zip(self.staffs, outputs, strict=True)
+        ]
+
+
+def prepare_staffs(
+    debug: Debug,
+    staffs: StaffsToParse,
+    predictions: InputPredictions,
+    max_workers: int | None = None,
+) -> list[PreparedStaff]:
+    """
+    Prepares all staffs of a page, e.g. to decode them later together
+    with the staffs of other pages.
+    """
+    return list(
+        _prepare_staffs_in_order(debug, staffs.ranges, staffs.staffs, predictions, max_workers)
+    )
+
+
+def parse_staffs(
+    debug: Debug,
+    staffs: list[MultiStaff],
+    predictions: InputPredictions,
+    max_workers: int | None = None,
+    stage_cache: StageCache | None = None,
+) -> list[ResultStaff]:
+    """
+    Dewarps each staff and then runs it through an algorithm which extracts
+    the rhythm and pitch information.
+
+    The staffs are prepared by max_workers threads (default: number of CPUs but
+    at most 4, 1 to prepare them one after another), while the model runs on one staff
+    after another in the calling thread.
+
+    If the stage cache has the model outputs of the staffs, then neither
+    the dewarping nor the model runs.
+    """
+    staffs_to_parse = StaffsToParse(staffs)
+    number_of_staffs = len(staffs_to_parse.staffs)
+    cached = stage_cache.load_transformer_outputs(staffs_to_parse.staffs) if stage_cache else None
+    if cached is not None:
+        return staffs_to_parse.merge_results(staffs_to_parse.pick_results(cached))
+    prepared_staffs = _prepare_staffs_in_order(
+        debug, staffs_to_parse.ranges, staffs_to_parse.staffs, predictions, max_workers
+    )
+    records: list[list[list[str]]] = [[] for _ in range(number_of_staffs)]
+    results = [
+        run_inference_on_staff(debug, i, prepared, records[i])
+        for i, prepared in enumerate(prepared_staffs)
+    ]
+    if stage_cache is not None:
+        stage_cache.save_transformer_outputs(staffs_to_parse.staffs, records)
+    return staffs_to_parse.merge_results(results)
@@ -1,4 +1,7 @@
+import threading
 from collections import Counter
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING
 
 import cv2
 import numpy as np
@@ -7,18 +10,31 @@ from homr.debug import AttentionDebug
 from homr.model import Staff
 from homr.results import ClefType, ResultStaff
 from homr.simple_logging import eprint
+from homr.staff_result_cache import StaffResultCache
 from homr.tr_omr_parser import TrOMRParser
+from homr.tracing import trace_count, trace_stage
 from homr.transformer.configs import default_config
-from homr.transformer.staff2score import Staff2Score
 from homr.type_definitions import NDArray
 
-inference: Staff2Score | None = None
+if TYPE_CHECKING:
+    from homr.transformer.staff2score import Staff2Score
+
+inference: "Staff2Score | None" = None
+# Several decoding workers of a pipeline can ask for the model at the same time
+_inference_lock = threading.Lock()
+result_cache: StaffResultCache | None = None
 
 
 def parse_staff_tromr(
-    staff: Staff, staff_image: NDArray, debug: AttentionDebug | None
+    staff: Staff,
+    staff_image: NDArray,
+    debug: AttentionDebug | None,
+    image_options: list[NDArray] | None = None,
+    record: list[list[str]] | None = None,
 ) -> ResultStaff:
-    return predict_best(staff_image, debug=debug, staff=staff)
+    return predict_best(
+        staff_image, debug=debug, staff=staff, image_options=image_options, record=record
+    )
 
 
 def apply_clahe(staff_image: NDArray, clip_limit: float = 2.0, kernel_size: int = 8) -> NDArray:
@@ -38,25 +54,89 @@ def build_image_options(staff_image: NDArray) -> list[NDArray]:
     ]
 
 
+def get_inference() -> "Staff2Score":
+    global inference  # noqa: PLW0603
+    with _inference_lock:
+        if inference is None:
+            # Loads torch and the transformer, which is only needed once a staff is parsed
+            from homr.transformer.staff2score import Staff2Score
+
+            inference = Staff2Score(default_config)
+        return inference
+
+
+def set_result_cache(cache: StaffResultCache | None) -> None:
+    """
+    Sets the cache which is consulted before a staff image is decoded.
+    """
+    global result_cache  # noqa: PLW0603
+    result_cache = cache
+
+
+def _predict(image: NDArray, debug: AttentionDebug | None) -> list[str]:
+    with trace_stage("decode_variant"):
+        result = result_cache.get(image) if result_cache is not None else None
+        if result is None:
+            result = get_inference().predict(image, debug=debug)
+            if result_cache is not None:
+                result_cache.put(image, result)
+        trace_count("tokens", sum(len(symbols.split("+")) for symbols in result))
+    return result
+
+
 def predict_best(
-    org_image: NDArray, staff: Staff, debug: AttentionDebug | None = None
+    org_image: NDArray,
+    staff: Staff,
+    debug: AttentionDebug | None = None,
+    image_options: list[NDArray] | None = None,
+    record: list[list[str]] | None = None,
 ) -> ResultStaff:
-    global inference  # noqa: PLW0603
-    if inference is None:
-        inference = Staff2Score(default_config)
-    images = build_image_options(org_image)
+    """
+    Runs the model on every image option and picks the result which fits best
+    to the staff. The image options are built from org_image if they aren't given.
+    The model outputs are appended to record, pick_best_result picks the same
+    result again from them.
+    """
+    images = image_options if image_options is not None else build_image_options(org_image)
+
+    def predict_attempts() -> Iterator[list[str]]:
+        for image in images:
+            if debug is not None:
+                debug.reset()
+            result = _predict(image, debug)
+            if record is not None:
+                record.append(result)
+            yield result
+
+    return pick_best_result(staff, predict_attempts())
+
+
+def predict_batch(images: list[NDArray]) -> list[list[str]]:
+    """
+    Runs the model on several images in one batch, the images can belong to different staffs.
+    Only the images which aren't in the result cache are decoded.
+    """
+    results = [result_cache.get(image) if result_cache is not None else None for image in images]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if len(missing) > 0:
+        decoded = get_inference().predict_batch([images[i] for i in missing])
+        for i, result in zip(missing, decoded, strict=True):
+            results[i] = result
+            if result_cache is not None:
+                result_cache.put(images[i], result)
+    return [result for result in results if result is not None]
+
+
+def pick_best_result(staff: Staff, results: Iterable[list[str]]) -> ResultStaff:
+    """
+    Picks the model output of the image options which fits best to the staff.
+    The results are only consumed until a decision is made.
+    """
     notes = staff.get_notes_and_groups()
     best_distance: float = 0
     best_attempt = 0
     best_result: ResultStaff = ResultStaff([])
-    for attempt, image in enumerate(images):
-        if debug is not None:
-            debug.reset()
-
-        result = inference.predict(
-            image,
-            debug=debug,
-        )
+    for attempt, result in enumerate(results):
         parser = TrOMRParser()
         result_staff = parser.parse_tr_omr_output(str.join("", result))
 
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from homr.stage_cache import get_checkpoint_version
+from homr.transformer.configs import default_config
+from homr.type_definitions import NDArray
+
+# Bump this whenever a change to the decoding alters the output for the same image
+decoding_version = "1"
+
+
+def get_decoding_settings() -> str:
+    config = default_config
+    return "/".join(
+        [
+            get_checkpoint_version(),
+            "decoding-" + decoding_version,
+            f"{config.max_height}x{config.max_width}",
+            f"seq-{config.max_seq_len}",
+        ]
+    )
+
+
+class StaffResultCache:
+    """
+    A persistent cache for the model outputs of staff images, stored in a SQLite file.
+    The key is the hash of the staff image together with the checkpoint and the
+    decoding settings, so a staff image which didn't change since the last run
+    doesn't have to be decoded again, even if the rest of the page changed.
+
+    If the entries take more than max_size_in_bytes then the least recently
+    used ones are removed.
+    """
+
+    def __init__(self, path: str, max_size_in_bytes: int = 64 * 1024 * 1024) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_size_in_bytes = max_size_in_bytes
+        self.settings = get_decoding_settings()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # The cache is shared by the threads of the pipeline, the lock serializes the access
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                + "key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                + " size INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+            )
+            # A counter instead of a timestamp, so that the order of accesses is always clear
+            row = self._connection.execute(
+                "SELECT COALESCE(MAX(last_used), 0) FROM results"
+            ).fetchone()
+            self._clock = int(row[0])
+
+    def get_key(self, image: NDArray) -> str:
+        sha = hashlib.sha256(self.settings.encode())
+        sha.update(str((image.shape, image.dtype.str)).encode())
+        sha.update(image.tobytes())
+        return sha.hexdigest()
+
+    def get(self, image: NDArray) -> list[str] | None:
+        key = self.get_key(image)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE results SET last_used = ? WHERE key = ?", (self._tick(), key)
+            )
+        result: list[str] = json.loads(row[0])
+        return result
+
+    def put(self, image: NDArray, result: list[str]) -> None:
+        key = self.get_key(image)
+        value = json.dumps(result)
+        size = len(key) + len(value.encode())
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, size, self._tick()),
+            )
+            self._evict()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _evict(self) -> None:
+        total_size = self._get_size()
+        if total_size <= self.max_size_in_bytes:
+            return
+        rows = self._connection.execute(
+            "SELECT key, size FROM results ORDER BY last_used"
+        ).fetchall()
+        to_remove = []
+        for key, size in rows:
+            if total_size <= self.max_size_in_bytes:
+                break
+            to_remove.append((key,))
+            total_size -= size
+        self._connection.executemany("DELETE FROM results WHERE key = ?", to_remove)
+        self.evictions += len(to_remove)
+
+    def _get_size(self) -> int:
+        row = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        return int(row[0])
+
+    def get_size(self) -> int:
+        with self._lock:
+            return self._get_size()
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()
+        return int(row[0])
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def format_statistics(self) -> str:
+        requests = self.hits + self.misses
+        hit_rate = 100 * self.hits / requests if requests else 0
+        return (
+            f"Staff result cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0f}% hits),"
+            + f" {self.evictions} evictions"
+        )
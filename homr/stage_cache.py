@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+
+import numpy as np
+
+from homr.model import Staff
+from homr.segmentation.config import segmentation_version
+from homr.simple_logging import eprint
+from homr.transformer.configs import default_config
+from homr.type_definitions import NDArray
+
+# Bump the version of a stage whenever a code change alters its output.
+# An artifact is only valid if the versions of its stage and of all previous
+# stages match, so bumping e.g. the detection version invalidates the
+# cached transformer outputs as well.
+# The transformer outputs are also keyed by the geometry of the detected staffs,
+# so a forgotten bump of the detection version can't assign them to other staffs.
+# The modules which the stages depend on:
+# - preprocessing: load_image in main.py, autocrop, resize and color_adjust
+# - detection: noise_filtering, bounding_boxes, staff_detection, note_detection,
+#   bar_line_detection, brace_dot_detection and staff_assignment
+# - staff_image: staff_parsing (prepare_staff_image), staff_dewarping and image_utils
+# - title: title_detection
+preprocessing_version = "1"
+detection_version = "1"
+staff_image_version = "1"
+title_version = "1"
+
+segmentation_layers = ["staff", "symbols", "stems_rest", "notehead", "clefs_keys"]
+
+
+def get_checkpoint_version() -> str:
+    return os.path.basename(default_config.filepaths.checkpoint).split(".")[0]
+
+
+stage_versions = {
+    "segmentation": ["preprocessing-" + preprocessing_version, segmentation_version],
+    "transformer": [
+        "preprocessing-" + preprocessing_version,
+        segmentation_version,
+        "detection-" + detection_version,
+        "staff_image-" + staff_image_version,
+        get_checkpoint_version(),
+    ],
+    "title": [
+        "preprocessing-" + preprocessing_version,
+        segmentation_version,
+        "detection-" + detection_version,
+        "title-" + title_version,
+    ],
+}
+
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_staffs(staffs: list[Staff]) -> str:
+    """
+    The staff images are cut out and dewarped along the grid of every staff,
+    a change of any grid point gives another hash.
+    """
+    sha = hashlib.sha256()
+    for staff in staffs:
+        sha.update(np.array(len(staff.grid)).tobytes())
+        sha.update(staff.grid_x.tobytes())
+        sha.update(staff.grid_y.tobytes())
+    return sha.hexdigest()
+
+
+def _pack_layer(layer: NDArray) -> dict[str, NDArray]:
+    """
+    The segmentation layers are masks of zeros and ones, which take one bit per pixel.
+    """
+    if layer.size > 0 and layer.max() > 1:
+        return {"raw": layer}
+    return {"bits": np.packbits(layer.astype(bool)), "shape": np.array(layer.shape)}
+
+
+def _unpack_layer(arrays: Any, name: str) -> NDArray:
+    if name + ".raw" in arrays:
+        raw: NDArray = arrays[name + ".raw"]
+        return raw
+    shape = tuple(arrays[name + ".shape"])
+    count = int(np.prod(shape))
+    layer: NDArray = np.unpackbits(arrays[name + ".bits"], count=count).reshape(shape)
+    return layer
+
+
+class StageCache:
+    """
+    Stores the outputs of the model stages of one page: the segmentation layers,
+    the transformer outputs of every staff and the title. A rerun resumes after
+    the latest stage with a valid artifact, e.g. after a change to the
+    post-processing no model has to run again.
+
+    Artifacts are keyed by the hash of the image file and are stored in a folder
+    per image below cache_dir. Every artifact stores the versions it was built
+    with, artifacts with other versions are ignored and overwritten.
+    """
+
+    def __init__(self, cache_dir: str, image_path: str) -> None:
+        self.image_hash = hash_file(image_path)
+        self.directory = os.path.join(cache_dir, self.image_hash[:2], self.image_hash)
+
+    def _get_path(self, stage: str, extension: str) -> str:
+        return os.path.join(self.directory, stage + extension)
+
+    def _get_version(self, stage: str) -> str:
+        return "/".join(stage_versions[stage])
+
+    def _write_atomically(self, path: str, write: Any) -> None:
+        """
+        Writes to a temporary file first, so that an interrupted run
+        never leaves a partial artifact behind.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                write(f)
+            os.replace(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def load_segmentation(self) -> dict[str, NDArray] | None:
+        path = self._get_path("segmentation", ".npz")
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as arrays:
+                if str(arrays["version"]) != self._get_version("segmentation"):
+                    eprint("Cached segmentation is outdated")
+                    return None
+                layers = {name: _unpack_layer(arrays, name) for name in segmentation_layers}
+        except (OSError, ValueError, KeyError) as e:
+            eprint("Failed to read cached segmentation", e)
+            return None
+        eprint("Loaded segmentation from cache")
+        return layers
+
+    def save_segmentation(self, layers: dict[str, NDArray]) -> None:
+        arrays: dict[str, NDArray] = {"version": np.array(self._get_version("segmentation"))}
+        for name in segmentation_layers:
+            for key, value in _pack_layer(layers[name]).items():
+                arrays[name + "." + key] = value
+        self._write_atomically(
+            self._get_path("segmentation", ".npz"),
+            lambda f: np.savez_compressed(f, **arrays),
+        )
+
+    def _load_json(self, stage: str) -> Any | None:
+        path = self._get_path(stage, ".json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError) as e:
+            eprint("Failed to read cached", stage, e)
+            return None
+        if content.get("version") != self._get_version(stage):
+            eprint("Cached", stage, "is outdated")
+            return None
+        return content["value"]
+
+    def _save_json(self, stage: str, value: Any) -> None:
+        content = json.dumps({"version": self._get_version(stage), "value": value})
+        self._write_atomically(
+            self._get_path(stage, ".json"), lambda f: f.write(content.encode("utf-8"))
+        )
+
+    def load_transformer_outputs(self, staffs: list[Staff]) -> list[list[list[str]]] | None:
+        """
+        Returns the model outputs of every image option of every staff,
+        if they were stored for staffs with the same geometry.
+        """
+        content = self._load_json("transformer")
+        if content is None:
+            return None
+        # Older artifacts stored only the outputs without the staffs
+        if not isinstance(content, dict) or content.get("staffs") != hash_staffs(staffs):
+            eprint("Cached transformer outputs don't match the staffs")
+            return None
+        eprint("Loaded transformer outputs from cache")
+        result: list[list[list[str]]] = content["outputs"]
+        return result
+
+    def save_transformer_outputs(self, staffs: list[Staff], outputs: list[list[list[str]]]) -> None:
+        self._save_json("transformer", {"staffs": hash_staffs(staffs), "outputs": outputs})
+
+    def load_title(self) -> str | None:
+        title = self._load_json("title")
+        return str(title) if title is not None else None
+
+    def save_title(self, title: str) -> None:
+        self._save_json("title", title)
@@ -1,11 +1,26 @@
 import re
-
-import easyocr  # type: ignore
+import threading
+from typing import Any
 
 from homr.debug import Debug
 from homr.model import Staff
 
-reader = easyocr.Reader(["de", "en"], gpu=False, verbose=False)
+reader: Any | None = None
+# The OCR runs in a background thread, possibly for several pages at once
+_reader_lock = threading.Lock()
+
+
+def get_reader() -> Any:
+    """
+    Creates the OCR reader on first use, as easyocr loads torch and its models.
+    """
+    global reader  # noqa: PLW0603
+    with _reader_lock:
+        if reader is None:
+            import easyocr  # type: ignore
+
+            reader = easyocr.Reader(["de", "en"], gpu=False, verbose=False)
+        return reader
 
 
 def cleanup_text(text: str) -> str:
@@ -16,6 +31,10 @@ def cleanup_text(text: str) -> str:
 
 
 def detect_title(debug: Debug, top_staff: Staff) -> str:
+    """
+    Reads the title from the region above the top staff. It only reads images,
+    so it can run in a background thread while the staffs are parsed.
+    """
     image = debug.original_image
     height = int(15 * top_staff.average_unit_size)
     y = max(int(top_staff.min_y) - height, 0)
@@ -25,8 +44,8 @@ def detect_title(debug: Debug, top_staff: Staff) -> str:
     height = min(height, image.shape[0] - y)
     above_staff = image[y : y + height, x : x + width]
 
-    tesseract_input = debug.write_model_input_image("_tesseract_input.png", above_staff)
-    result = reader.readtext(tesseract_input, detail=0, paragraph=True)
+    debug.write_image_with_fixed_suffix("_tesseract_input.png", above_staff)
+    result = get_reader().readtext(above_staff, detail=0, paragraph=True)
     if len(result) == 0:
         return ""
     return cleanup_text(result[0])
@@ -0,0 +1,207 @@
+import json
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+from homr.profiling import profile_stage
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory columns stay empty there
+    resource = None  # type: ignore
+
+
+def get_peak_rss_in_mb() -> float | None:
+    """
+    The peak resident set size of the process so far.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    bytes_per_unit = 1 if sys.platform == "darwin" else 1024
+    return peak * bytes_per_unit / (1024 * 1024)
+
+
+class StageRecord:
+    """
+    The measurements of one execution of a stage. cpu_seconds is the CPU time
+    of the whole process, which includes the threads of other pages in a pipelined run
+    and the threads of the model libraries. thread_cpu_seconds only counts the
+    thread which ran the stage. The peak RSS can only grow, so the delta shows
+    how much a stage raised the memory high-water mark of the process.
+    """
+
+    def __init__(self, name: str, parent: str | None, start_seconds: float) -> None:
+        self.name = name
+        self.parent = parent
+        self.start_seconds = start_seconds
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.thread_cpu_seconds = 0.0
+        self.peak_rss_delta_in_mb: float | None = None
+        self.counts: dict[str, int] = {}
+        self.failed = False
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "start_seconds": round(self.start_seconds, 6),
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "thread_cpu_seconds": round(self.thread_cpu_seconds, 6),
+            "peak_rss_delta_in_mb": (
+                round(self.peak_rss_delta_in_mb, 3)
+                if self.peak_rss_delta_in_mb is not None
+                else None
+            ),
+            "counts": self.counts,
+            "failed": self.failed,
+        }
+
+
+class PageTrace:
+    """
+    Collects the stage records of one page. The stages record into the trace
+    which is active in the current context, see activate and trace_stage.
+    """
+
+    def __init__(self, image_path: str) -> None:
+        self.image_path = image_path
+        self.records: list[StageRecord] = []
+        self._created = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator["PageTrace"]:
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def get_elapsed_seconds(self) -> float:
+        return time.perf_counter() - self._created
+
+    def add(self, record: StageRecord) -> None:
+        # Staffs are prepared in a thread pool and record concurrently
+        with self._lock:
+            self.records.append(record)
+
+    def get_wall_seconds(self) -> float:
+        top_level = [record for record in self.records if record.parent is None]
+        return sum(record.wall_seconds for record in top_level)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            records = sorted(self.records, key=lambda record: record.start_seconds)
+        return {
+            "image": self.image_path,
+            "wall_seconds": round(self.get_wall_seconds(), 6),
+            "peak_rss_in_mb": get_peak_rss_in_mb(),
+            "stages": [record.to_dict() for record in records],
+        }
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+_current_trace: ContextVar[PageTrace | None] = ContextVar("current_trace", default=None)
+_current_stage: ContextVar[StageRecord | None] = ContextVar("current_stage", default=None)
+
+
+def is_tracing() -> bool:
+    return _current_trace.get() is not None
+
+
+@contextmanager
+def trace_stage(name: str) -> Iterator[StageRecord | None]:
+    """
+    Measures the enclosed block as a stage of the active page trace.
+    Stages can be nested, the record of a nested stage points to its parent.
+    Without an active trace this does nothing. The stage is also profiled
+    if the active page profiler selected it.
+    """
+    with profile_stage(name), _measure_stage(name) as record:
+        yield record
+
+
+@contextmanager
+def _measure_stage(name: str) -> Iterator[StageRecord | None]:
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_stage.get()
+    record = StageRecord(
+        name, parent.name if parent is not None else None, trace.get_elapsed_seconds()
+    )
+    token = _current_stage.set(record)
+    peak_rss_before = get_peak_rss_in_mb()
+    cpu_before = time.process_time()
+    thread_cpu_before = time.thread_time()
+    wall_before = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record.failed = True
+        raise
+    finally:
+        record.wall_seconds = time.perf_counter() - wall_before
+        record.cpu_seconds = time.process_time() - cpu_before
+        record.thread_cpu_seconds = time.thread_time() - thread_cpu_before
+        peak_rss_after = get_peak_rss_in_mb()
+        if peak_rss_before is not None and peak_rss_after is not None:
+            record.peak_rss_delta_in_mb = peak_rss_after - peak_rss_before
+        _current_stage.reset(token)
+        trace.add(record)
+
+
+def trace_count(name: str, value: int) -> None:
+    """
+    Adds an item count, e.g. the number of staffs, to the innermost active stage.
+    """
+    record = _current_stage.get()
+    if record is not None:
+        record.counts[name] = record.counts.get(name, 0) + value
+
+
+def format_trace_summary(traces: list[PageTrace]) -> str:
+    """
+    A table with the totals of every stage over all pages,
+    sorted by the total wall time.
+    """
+    totals: dict[str, dict[str, Any]] = {}
+    for trace in traces:
+        for record in trace.records:
+            total = totals.setdefault(
+                record.name,
+                {"calls": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0, "rss": 0.0, "counts": {}},
+            )
+            total["calls"] += 1
+            total["wall"] += record.wall_seconds
+            total["max_wall"] = max(total["max_wall"], record.wall_seconds)
+            total["cpu"] += record.cpu_seconds
+            total["rss"] = max(total["rss"], record.peak_rss_delta_in_mb or 0.0)
+            for key, value in record.counts.items():
+                total["counts"][key] = total["counts"].get(key, 0) + value
+    header = (
+        f"{'stage':<28}{'calls':>7}{'total s':>10}{'mean s':>9}{'max s':>9}"
+        + f"{'cpu s':>9}{'max rss +MB':>13}  counts"
+    )
+    lines = [f"Trace summary of {len(traces)} pages", header]
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["wall"]):
+        counts = ", ".join(f"{key}={value}" for key, value in total["counts"].items())
+        lines.append(
+            f"{name:<28}{total['calls']:>7}{total['wall']:>10.3f}"
+            + f"{total['wall'] / total['calls']:>9.3f}{total['max_wall']:>9.3f}"
+            + f"{total['cpu']:>9.3f}{total['rss']:>13.1f}  {counts}"
+        )
+    return "\n".join(lines)
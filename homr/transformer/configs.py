@@ -1,5 +1,6 @@
 import json
 import os
+from functools import cached_property
 from typing import Any
 
 workspace = os.path.join(os.path.dirname(__file__))
@@ -50,7 +51,17 @@ class DecoderArgs:
         return json.dumps(self.to_dict(), indent=2)
 
 
+def _load_vocab(tokenizer_path: str) -> dict[str, int]:
+    with open(tokenizer_path) as f:
+        vocab: dict[str, int] = json.load(f)["model"]["vocab"]
+    return vocab
+
+
 class Config:
+    """
+    The vocabularies are only loaded from the tokenizer files once they are used.
+    """
+
     def __init__(self) -> None:
         self.filepaths = FilePaths()
         self.channels = 1
@@ -79,16 +90,40 @@ class Config:
         self.decoder_heads = 8
         self.temperature = 0.01
         self.decoder_args = DecoderArgs()
-        self.lift_vocab = json.load(open(self.filepaths.lifttokenizer))["model"]["vocab"]
-        self.pitch_vocab = json.load(open(self.filepaths.pitchtokenizer))["model"]["vocab"]
-        self.note_vocab = json.load(open(self.filepaths.notetokenizer))["model"]["vocab"]
-        self.rhythm_vocab = json.load(open(self.filepaths.rhythmtokenizer))["model"]["vocab"]
-        self.noteindexes = self._get_values_of_keys_starting_with("note-")
-        self.restindexes = self._get_values_of_keys_starting_with(
+
+    @cached_property
+    def lift_vocab(self) -> dict[str, int]:
+        return _load_vocab(self.filepaths.lifttokenizer)
+
+    @cached_property
+    def pitch_vocab(self) -> dict[str, int]:
+        return _load_vocab(self.filepaths.pitchtokenizer)
+
+    @cached_property
+    def note_vocab(self) -> dict[str, int]:
+        return _load_vocab(self.filepaths.notetokenizer)
+
+    @cached_property
+    def rhythm_vocab(self) -> dict[str, int]:
+        return _load_vocab(self.filepaths.rhythmtokenizer)
+
+    @cached_property
+    def noteindexes(self) -> list[int]:
+        return self._get_values_of_keys_starting_with("note-")
+
+    @cached_property
+    def restindexes(self) -> list[int]:
+        return self._get_values_of_keys_starting_with(
             "rest-"
         ) + self._get_values_of_keys_starting_with("multirest-")
-        self.chordindex = self.rhythm_vocab["|"]
-        self.barlineindex = self.rhythm_vocab["barline"]
+
+    @cached_property
+    def chordindex(self) -> int:
+        return self.rhythm_vocab["|"]
+
+    @cached_property
+    def barlineindex(self) -> int:
+        return self.rhythm_vocab["barline"]
 
     def _get_values_of_keys_starting_with(self, prefix: str) -> list[int]:
         return [value for key, value in self.rhythm_vocab.items() if key.startswith(prefix)]
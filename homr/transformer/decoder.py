@@ -180,7 +180,7 @@ class ScoreDecoder(nn.Module):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     @torch.no_grad()
-    def generate(  # noqa: PLR0915
+    def generate(  # noqa: PLR0915, C901, PLR0912
         self,
         start_tokens: torch.Tensor,
         nonote_tokens: torch.Tensor,
@@ -190,6 +190,11 @@ class ScoreDecoder(nn.Module):
         filter_thres: float = 0.7,
         **kwargs: Any,
     ) -> list[str]:
+        """
+        Decodes every row of the batch and returns one merged symbol string per row.
+        Rows which reached the end token are carried along until all rows are done,
+        but their further samples are ignored.
+        """
         was_training = self.net.training
         num_dims = len(start_tokens.shape)
 
@@ -203,7 +208,10 @@ class ScoreDecoder(nn.Module):
         out_pitch = nonote_tokens
         out_lift = nonote_tokens
         mask = kwargs.pop("mask", None)
-        merger = SymbolMerger()
+        mergers = [SymbolMerger() for _ in range(b)]
+        is_finished = [False] * b
+        # The center of attention is only defined for a single image
+        return_center_of_attention = b == 1
 
         if mask is None:
             mask = torch.full_like(out_rhythm, True, dtype=torch.bool, device=out_rhythm.device)
@@ -215,33 +223,54 @@ class ScoreDecoder(nn.Module):
             x_rhythm = out_rhythm[:, -self.max_seq_len :]
 
             rhythmsp, pitchsp, liftsp, notesp, _ignored, center_of_attention = self.net(
-                x_rhythm, x_pitch, x_lift, mask=mask, return_center_of_attention=True, **kwargs
+                x_rhythm,
+                x_pitch,
+                x_lift,
+                mask=mask,
+                return_center_of_attention=return_center_of_attention,
+                **kwargs,
             )
 
             filtered_lift_logits = top_k(liftsp[:, -1, :], thres=filter_thres)
             filtered_pitch_logits = top_k(pitchsp[:, -1, :], thres=filter_thres)
             filtered_rhythm_logits = top_k(rhythmsp[:, -1, :], thres=filter_thres)
 
+            lift_sample = torch.zeros((b, 1), dtype=torch.long, device=out_rhythm.device)
+            pitch_sample = torch.zeros_like(lift_sample)
+            rhythm_sample = torch.zeros_like(lift_sample)
             current_temperature = temperature
-            retry = True
+            rows_to_sample = [row for row in range(b) if not is_finished[row]]
             attempt = 0
             max_attempts = 5
-            while retry and attempt < max_attempts:
-                lift_probs = F.softmax(filtered_lift_logits / current_temperature, dim=-1)
-                pitch_probs = F.softmax(filtered_pitch_logits / current_temperature, dim=-1)
-                rhythm_probs = F.softmax(filtered_rhythm_logits / current_temperature, dim=-1)
-
-                lift_sample = torch.multinomial(lift_probs, 1)
-                pitch_sample = torch.multinomial(pitch_probs, 1)
-                rhythm_sample = torch.multinomial(rhythm_probs, 1)
-
-                lift_token = detokenize(lift_sample, self.lifttokenizer)
-                pitch_token = detokenize(pitch_sample, self.pitchtokenizer)
-                rhythm_token = detokenize(rhythm_sample, self.rhythmtokenizer)
-                is_eos = len(rhythm_token[0])
-                if is_eos == 0:
-                    break
-                retry = merger.add_symbol(rhythm_token[0][0], pitch_token[0][0], lift_token[0][0])
+            while len(rows_to_sample) > 0 and attempt < max_attempts:
+                lift_probs = F.softmax(
+                    filtered_lift_logits[rows_to_sample] / current_temperature, dim=-1
+                )
+                pitch_probs = F.softmax(
+                    filtered_pitch_logits[rows_to_sample] / current_temperature, dim=-1
+                )
+                rhythm_probs = F.softmax(
+                    filtered_rhythm_logits[rows_to_sample] / current_temperature, dim=-1
+                )
+
+                lift_sample[rows_to_sample] = torch.multinomial(lift_probs, 1)
+                pitch_sample[rows_to_sample] = torch.multinomial(pitch_probs, 1)
+                rhythm_sample[rows_to_sample] = torch.multinomial(rhythm_probs, 1)
+
+                lift_tokens = detokenize(lift_sample[rows_to_sample], self.lifttokenizer)
+                pitch_tokens = detokenize(pitch_sample[rows_to_sample], self.pitchtokenizer)
+                rhythm_tokens = detokenize(rhythm_sample[rows_to_sample], self.rhythmtokenizer)
+                rows_to_retry = []
+                for i, row in enumerate(rows_to_sample):
+                    is_eos = len(rhythm_tokens[i]) == 0
+                    if is_eos:
+                        continue
+                    retry = mergers[row].add_symbol(
+                        rhythm_tokens[i][0], pitch_tokens[i][0], lift_tokens[i][0]
+                    )
+                    if retry:
+                        rows_to_retry.append(row)
+                rows_to_sample = rows_to_retry
                 current_temperature *= 3.5
                 attempt += 1
 
@@ -250,18 +279,18 @@ class ScoreDecoder(nn.Module):
             out_rhythm = torch.cat((out_rhythm, rhythm_sample), dim=-1)
             mask = F.pad(mask, (0, 1), value=True)
 
-            if (
-                eos_token is not None
-                and (torch.cumsum(out_rhythm == eos_token, 1)[:, -1] >= 1).all()
-            ):
-                break
+            if eos_token is not None:
+                reached_eos = (torch.cumsum(out_rhythm == eos_token, 1)[:, -1] >= 1).tolist()
+                is_finished = [bool(finished) for finished in reached_eos]
+                if all(is_finished):
+                    break
 
         out_lift = out_lift[:, t:]
         out_pitch = out_pitch[:, t:]
         out_rhythm = out_rhythm[:, t:]
 
         self.net.train(was_training)
-        return [merger.complete()]
+        return [merger.complete() for merger in mergers]
 
     def forward(
         self,
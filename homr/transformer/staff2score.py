@@ -46,6 +46,17 @@ class Staff2Score:
             debug=debug,
         )
 
+    def predict_batch(self, images: list[NDArray]) -> list[list[str]]:
+        """
+        Decodes several staff images at once. All images must have the same size,
+        which is the case for images which were put on the canvas of the model.
+        """
+        tensors = [
+            self._image_to_tensor(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)) for image in images
+        ]
+        results = self._generate(torch.cat(tensors))
+        return [[result] for result in results]
+
     def _image_to_tensor(self, image: NDArray) -> torch.Tensor:
         transformed = _transform(image=image)["image"][:1]
         imgs_tensor = transformed.float().unsqueeze(1)
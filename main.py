@@ -1,7 +1,13 @@
 import argparse
+import contextlib
+import contextvars
+import functools
 import glob
 import os
 import sys
+import threading
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -14,8 +20,8 @@ from homr.autocrop import autocrop
 from homr.bar_line_detection import add_bar_lines_to_staffs, detect_bar_lines
 from homr.bounding_boxes import (
     BoundingEllipse,
+    ContourStore,
     RotatedBoundingBox,
-    create_bounding_ellipses,
     create_rotated_bounding_boxes,
 )
 from homr.brace_dot_detection import (
@@ -23,17 +29,29 @@ from homr.brace_dot_detection import (
     prepare_brace_dot_image,
 )
 from homr.debug import Debug
-from homr.model import InputPredictions
+from homr.model import InputPredictions, MultiStaff, Staff
 from homr.noise_filtering import filter_predictions
-from homr.note_detection import add_notes_to_staffs, combine_noteheads_with_stems
+from homr.note_detection import (
+    NoteheadWithStem,
+    add_notes_to_staffs,
+    combine_noteheads_with_stems,
+)
+from homr.pipeline import Pipeline, Stage
+from homr.profiling import PageProfiler, ProfileOptions
 from homr.resize import resize_image
 from homr.rest_detection import add_rests_to_staffs
+from homr.results import ResultStaff
 from homr.segmentation.config import segnet_path, unet_path
 from homr.segmentation.segmentation import segmentation
 from homr.simple_logging import eprint
+from homr.staff_batching import CrossPageStaffDecoder, StaffBatchQueue
 from homr.staff_detection import break_wide_fragments, detect_staff, make_lines_stronger
-from homr.staff_parsing import parse_staffs
+from homr.staff_parsing import StaffsToParse, parse_staffs, prepare_staffs
+from homr.staff_parsing_tromr import set_result_cache
+from homr.staff_result_cache import StaffResultCache
+from homr.stage_cache import StageCache
 from homr.title_detection import detect_title
+from homr.tracing import PageTrace, format_trace_summary, trace_count, trace_stage
 from homr.transformer.configs import default_config
 from homr.type_definitions import NDArray
 from homr.xml_generator import generate_xml
@@ -60,19 +78,33 @@ class PredictedSymbols:
 
 
 def get_predictions(
-    original: NDArray, preprocessed: NDArray, img_path: str, save_cache: bool
+    original: NDArray,
+    preprocessed: NDArray,
+    img_path: str,
+    save_cache: bool,
+    stage_cache: StageCache | None = None,
 ) -> InputPredictions:
-    result = segmentation(preprocessed, img_path, use_cache=save_cache)
-    original_image = cv2.resize(original, (result.staff.shape[1], result.staff.shape[0]))
-    preprocessed_image = cv2.resize(preprocessed, (result.staff.shape[1], result.staff.shape[0]))
+    layers = stage_cache.load_segmentation() if stage_cache is not None else None
+    if layers is None:
+        result = segmentation(preprocessed, img_path, use_cache=save_cache)
+        layers = {
+            "staff": result.staff.astype(np.uint8),
+            "symbols": result.symbols.astype(np.uint8),
+            "stems_rest": result.stems_rests.astype(np.uint8),
+            "notehead": result.notehead.astype(np.uint8),
+            "clefs_keys": result.clefs_keys.astype(np.uint8),
+        }
+        if stage_cache is not None:
+            stage_cache.save_segmentation(layers)
+    size = (layers["staff"].shape[1], layers["staff"].shape[0])
     return InputPredictions(
-        original=original_image,
-        preprocessed=preprocessed_image,
-        notehead=result.notehead.astype(np.uint8),
-        symbols=result.symbols.astype(np.uint8),
-        staff=result.staff.astype(np.uint8),
-        clefs_keys=result.clefs_keys.astype(np.uint8),
-        stems_rest=result.stems_rests.astype(np.uint8),
+        original=cv2.resize(original, size),
+        preprocessed=cv2.resize(preprocessed, size),
+        notehead=layers["notehead"],
+        symbols=layers["symbols"],
+        staff=layers["staff"],
+        clefs_keys=layers["clefs_keys"],
+        stems_rest=layers["stems_rest"],
     )
 
 
@@ -84,18 +116,32 @@ def replace_extension(path: str, new_extension: str) -> str:
     )
 
 
-def load_and_preprocess_predictions(
-    image_path: str, enable_debug: bool, enable_cache: bool
+def load_image(image_path: str) -> tuple[NDArray, NDArray]:
+    with trace_stage("read_image"):
+        image = cv2.imread(image_path)
+    with trace_stage("autocrop"):
+        image = autocrop(image)
+    with trace_stage("resize"):
+        image = resize_image(image)
+    with trace_stage("color_adjust"):
+        preprocessed, _background = color_adjust.color_adjust(image, 40)
+    return image, preprocessed
+
+
+def segment_image(
+    image_path: str,
+    image: NDArray,
+    preprocessed: NDArray,
+    enable_debug: bool,
+    enable_cache: bool,
+    stage_cache: StageCache | None = None,
 ) -> tuple[InputPredictions, Debug]:
-    image = cv2.imread(image_path)
-    image = autocrop(image)
-    image = resize_image(image)
-    preprocessed, _background = color_adjust.color_adjust(image, 40)
-    predictions = get_predictions(image, preprocessed, image_path, enable_cache)
+    predictions = get_predictions(image, preprocessed, image_path, enable_cache, stage_cache)
     debug = Debug(predictions.original, image_path, enable_debug)
     debug.write_image("color_adjust", preprocessed)
 
-    predictions = filter_predictions(predictions, debug)
+    with trace_stage("filter_predictions"):
+        predictions = filter_predictions(predictions, debug)
 
     predictions.staff = make_lines_stronger(predictions.staff, (1, 2))
     debug.write_threshold_image("staff", predictions.staff)
@@ -106,77 +152,112 @@ def load_and_preprocess_predictions(
     return predictions, debug
 
 
+def load_and_preprocess_predictions(
+    image_path: str,
+    enable_debug: bool,
+    enable_cache: bool,
+    stage_cache: StageCache | None = None,
+) -> tuple[InputPredictions, Debug]:
+    image, preprocessed = load_image(image_path)
+    return segment_image(image_path, image, preprocessed, enable_debug, enable_cache, stage_cache)
+
+
 def predict_symbols(debug: Debug, predictions: InputPredictions) -> PredictedSymbols:
+    contours = ContourStore()
     eprint("Creating bounds for noteheads")
-    noteheads = create_bounding_ellipses(predictions.notehead, min_size=(4, 4))
+    noteheads = contours.create_bounding_ellipses(predictions.notehead, min_size=(4, 4))
     eprint("Creating bounds for staff_fragments")
-    staff_fragments = create_rotated_bounding_boxes(
-        predictions.staff, skip_merging=True, min_size=(5, 1), max_size=(10000, 100)
+    staff_fragments = contours.create_rotated_bounding_boxes(
+        predictions.staff,
+        skip_merging=True,
+        min_size=(5, 1),
+        max_size=(10000, 100),
+        mode=cv2.RETR_TREE,
     )
 
     eprint("Creating bounds for clefs_keys")
-    clefs_keys = create_rotated_bounding_boxes(
+    clefs_keys = contours.create_rotated_bounding_boxes(
         predictions.clefs_keys, min_size=(20, 40), max_size=(1000, 1000)
     )
     eprint("Creating bounds for accidentals")
-    accidentals = create_rotated_bounding_boxes(
+    accidentals = contours.create_rotated_bounding_boxes(
         predictions.clefs_keys, min_size=(5, 5), max_size=(100, 100)
     )
     eprint("Creating bounds for stems_rest")
-    stems_rest = create_rotated_bounding_boxes(predictions.stems_rest)
+    stems_rest = contours.create_rotated_bounding_boxes(predictions.stems_rest, mode=cv2.RETR_TREE)
     eprint("Creating bounds for bar_lines")
     bar_line_img = predictions.stems_rest
     debug.write_threshold_image("bar_line_img", bar_line_img)
-    bar_lines = create_rotated_bounding_boxes(bar_line_img, skip_merging=True, min_size=(1, 5))
+    bar_lines = contours.create_rotated_bounding_boxes(
+        bar_line_img, skip_merging=True, min_size=(1, 5), mode=cv2.RETR_TREE
+    )
 
     return PredictedSymbols(
         noteheads, staff_fragments, clefs_keys, accidentals, stems_rest, bar_lines
     )
 
 
-def process_image(  # noqa: PLR0915
-    image_path: str, enable_debug: bool, enable_cache: bool
-) -> tuple[str, str, str]:
-    eprint("Processing " + image_path)
-    predictions, debug = load_and_preprocess_predictions(image_path, enable_debug, enable_cache)
-    xml_file = replace_extension(image_path, ".musicxml")
-    try:
-        eprint("Loaded segmentation")
+def find_bar_lines(
+    noteheads_with_stems: list[NoteheadWithStem], bar_line_candidates: list[RotatedBoundingBox]
+) -> tuple[list[RotatedBoundingBox], list[RotatedBoundingBox]]:
+    """
+    Returns the candidates which don't overlap with any notehead or stem,
+    which are bar lines or rests, and the bar lines among them.
+    """
+    average_note_head_height = float(
+        np.mean([notehead.notehead.size[1] for notehead in noteheads_with_stems])
+    )
+    eprint("Average note head height: " + str(average_note_head_height))
+
+    all_noteheads = [notehead.notehead for notehead in noteheads_with_stems]
+    all_stems = [note.stem for note in noteheads_with_stems if note.stem is not None]
+    bar_lines_or_rests = [
+        line
+        for line in bar_line_candidates
+        if not line.is_overlapping_with_any(all_noteheads)
+        and not line.is_overlapping_with_any(all_stems)
+    ]
+    return bar_lines_or_rests, detect_bar_lines(bar_lines_or_rests, average_note_head_height)
+
+
+def detect_staffs(  # noqa: PLR0915
+    debug: Debug, predictions: InputPredictions
+) -> tuple[list[Staff], list[MultiStaff]]:
+    eprint("Loaded segmentation")
+    with trace_stage("predict_symbols"):
         symbols = predict_symbols(debug, predictions)
-        eprint("Predicted symbols")
+        trace_count("noteheads", len(symbols.noteheads))
+        trace_count("staff_fragments", len(symbols.staff_fragments))
+        trace_count("clefs_keys", len(symbols.clefs_keys))
+        trace_count("stems_rest", len(symbols.stems_rest))
+    eprint("Predicted symbols")
 
+    with trace_stage("break_wide_fragments"):
         symbols.staff_fragments = break_wide_fragments(symbols.staff_fragments)
-        debug.write_bounding_boxes("staff_fragments", symbols.staff_fragments)
-        eprint("Found " + str(len(symbols.staff_fragments)) + " staff line fragments")
+        trace_count("staff_fragments", len(symbols.staff_fragments))
+    debug.write_bounding_boxes("staff_fragments", symbols.staff_fragments)
+    eprint("Found " + str(len(symbols.staff_fragments)) + " staff line fragments")
 
+    with trace_stage("combine_noteheads_with_stems"):
         noteheads_with_stems, likely_bar_or_rests_lines = combine_noteheads_with_stems(
             symbols.noteheads, symbols.stems_rest
         )
-        debug.write_bounding_boxes_alternating_colors("notehead_with_stems", noteheads_with_stems)
-        eprint("Found " + str(len(noteheads_with_stems)) + " noteheads")
-        if len(noteheads_with_stems) == 0:
-            raise Exception("No noteheads found")
-
-        average_note_head_height = float(
-            np.mean([notehead.notehead.size[1] for notehead in noteheads_with_stems])
-        )
-        eprint("Average note head height: " + str(average_note_head_height))
-
-        all_noteheads = [notehead.notehead for notehead in noteheads_with_stems]
-        all_stems = [note.stem for note in noteheads_with_stems if note.stem is not None]
-        bar_lines_or_rests = [
-            line
-            for line in symbols.bar_lines
-            if not line.is_overlapping_with_any(all_noteheads)
-            and not line.is_overlapping_with_any(all_stems)
-        ]
-        bar_line_boxes = detect_bar_lines(bar_lines_or_rests, average_note_head_height)
-        debug.write_bounding_boxes_alternating_colors("bar_lines", bar_line_boxes)
-        eprint("Found " + str(len(bar_line_boxes)) + " bar lines")
-
-        debug.write_bounding_boxes(
-            "anchor_input", symbols.staff_fragments + bar_line_boxes + symbols.clefs_keys
-        )
+        trace_count("noteheads", len(noteheads_with_stems))
+    debug.write_bounding_boxes_alternating_colors("notehead_with_stems", noteheads_with_stems)
+    eprint("Found " + str(len(noteheads_with_stems)) + " noteheads")
+    if len(noteheads_with_stems) == 0:
+        raise Exception("No noteheads found")
+
+    with trace_stage("detect_bar_lines"):
+        bar_lines_or_rests, bar_line_boxes = find_bar_lines(noteheads_with_stems, symbols.bar_lines)
+        trace_count("bar_lines", len(bar_line_boxes))
+    debug.write_bounding_boxes_alternating_colors("bar_lines", bar_line_boxes)
+    eprint("Found " + str(len(bar_line_boxes)) + " bar lines")
+
+    debug.write_bounding_boxes(
+        "anchor_input", symbols.staff_fragments + bar_line_boxes + symbols.clefs_keys
+    )
+    with trace_stage("detect_staff"):
         staffs = detect_staff(
             debug,
             predictions.staff,
@@ -185,21 +266,27 @@ def process_image(  # noqa: PLR0915
             bar_line_boxes,
             predictions.original,
         )
-        if len(staffs) == 0:
-            raise Exception("No staffs found")
-        debug.write_bounding_boxes_alternating_colors("staffs", staffs)
+        trace_count("staffs", len(staffs))
+    if len(staffs) == 0:
+        raise Exception("No staffs found")
+    debug.write_bounding_boxes_alternating_colors("staffs", staffs)
 
-        global_unit_size = np.mean([staff.average_unit_size for staff in staffs])
+    global_unit_size = np.mean([staff.average_unit_size for staff in staffs])
 
+    with trace_stage("add_bar_lines"):
         bar_lines_found = add_bar_lines_to_staffs(staffs, bar_line_boxes)
-        eprint("Found " + str(len(bar_lines_found)) + " bar lines")
+        trace_count("bar_lines", len(bar_lines_found))
+    eprint("Found " + str(len(bar_lines_found)) + " bar lines")
 
+    with trace_stage("rest_detection"):
         possible_rests = [
             rest for rest in bar_lines_or_rests if not rest.is_overlapping_with_any(bar_line_boxes)
         ]
         rests = add_rests_to_staffs(staffs, possible_rests)
-        eprint("Found", len(rests), "rests")
+        trace_count("rests", len(rests))
+    eprint("Found", len(rests), "rests")
 
+    with trace_stage("prepare_brace_dot_image"):
         all_classified = predictions.notehead + predictions.clefs_keys + predictions.stems_rest
         brace_dot_img = prepare_brace_dot_image(
             predictions.symbols, predictions.staff, all_classified, global_unit_size
@@ -209,43 +296,158 @@ def process_image(  # noqa: PLR0915
             brace_dot_img, skip_merging=True, max_size=(100, 1000)
         )
 
+    with trace_stage("note_detection"):
         notes = add_notes_to_staffs(
             staffs, noteheads_with_stems, predictions.symbols, predictions.notehead
         )
+        trace_count("notes", len(notes))
+    with trace_stage("accidental_detection"):
         accidentals = add_accidentals_to_staffs(staffs, symbols.accidentals)
-        eprint("Found", len(accidentals), "accidentals")
+        trace_count("accidentals", len(accidentals))
+    eprint("Found", len(accidentals), "accidentals")
 
+    with trace_stage("brace_detection"):
         multi_staffs = find_braces_brackets_and_grand_staff_lines(debug, staffs, brace_dot)
-        eprint(
-            "Found",
-            len(multi_staffs),
-            "connected staffs (after merging grand staffs, multiple voices): ",
-            [len(staff.staffs) for staff in multi_staffs],
+        trace_count("multi_staffs", len(multi_staffs))
+    eprint(
+        "Found",
+        len(multi_staffs),
+        "connected staffs (after merging grand staffs, multiple voices): ",
+        [len(staff.staffs) for staff in multi_staffs],
+    )
+
+    debug.write_all_bounding_boxes_alternating_colors(
+        "notes", multi_staffs, notes, rests, accidentals
+    )
+    return staffs, multi_staffs
+
+
+def get_title(debug: Debug, staff: Staff, stage_cache: StageCache | None) -> str:
+    title = stage_cache.load_title() if stage_cache is not None else None
+    if title is None:
+        with trace_stage("title_ocr"):
+            title = detect_title(debug, staff)
+        if stage_cache is not None:
+            stage_cache.save_title(title)
+    return title
+
+
+def parse_music(  # noqa: PLR0913
+    debug: Debug,
+    staffs: list[Staff],
+    multi_staffs: list[MultiStaff],
+    predictions: InputPredictions,
+    enable_ocr: bool,
+    stage_cache: StageCache | None = None,
+    staff_workers: int | None = None,
+) -> tuple[list[ResultStaff], str]:
+    with ThreadPoolExecutor(max_workers=1) as title_executor:
+        # The OCR runs while the staffs are parsed
+        # The context carries the active trace into the executor thread
+        title_future = (
+            title_executor.submit(
+                contextvars.copy_context().run, get_title, debug, staffs[0], stage_cache
+            )
+            if enable_ocr
+            else None
         )
 
-        debug.write_all_bounding_boxes_alternating_colors(
-            "notes", multi_staffs, notes, rests, accidentals
+        result_staffs = parse_staffs(
+            debug, multi_staffs, predictions, staff_workers, stage_cache=stage_cache
         )
 
-        title = detect_title(debug, staffs[0])
-        eprint("Found title: " + title)
+        with trace_stage("maintain_accidentals"):
+            result_staffs = maintain_accidentals(result_staffs)
 
-        result_staffs = parse_staffs(debug, multi_staffs, predictions)
+        title = title_future.result() if title_future is not None else ""
+    eprint("Found title: " + title)
+    return result_staffs, title
 
-        result_staffs = maintain_accidentals(result_staffs)
 
-        eprint("Writing XML")
+def write_results(
+    image_path: str,
+    debug: Debug,
+    staffs: list[Staff],
+    result_staffs: list[ResultStaff],
+    title: str,
+) -> tuple[str, str, str]:
+    xml_file = replace_extension(image_path, ".musicxml")
+    eprint("Writing XML")
+    with trace_stage("generate_xml"):
         xml = generate_xml(result_staffs, title)
+    with trace_stage("write_xml"):
         xml.write(xml_file)
 
-        eprint("Finished parsing " + str(len(staffs)) + " staffs")
-        teaser_file = replace_extension(image_path, "_teaser.png")
+    eprint("Finished parsing " + str(len(staffs)) + " staffs")
+    teaser_file = replace_extension(image_path, "_teaser.png")
+    with trace_stage("write_teaser"):
         debug.write_teaser(teaser_file, staffs)
-        debug.clean_debug_files_from_previous_runs()
+    debug.clean_debug_files_from_previous_runs()
 
-        eprint("Result was written to", xml_file)
+    eprint("Result was written to", xml_file)
 
-        return xml_file, title, teaser_file
+    return xml_file, title, teaser_file
+
+
+def process_image(
+    image_path: str,
+    enable_debug: bool,
+    enable_cache: bool,
+    enable_ocr: bool = True,
+    cache_dir: str | None = None,
+    enable_trace: bool = False,
+    profile_options: ProfileOptions | None = None,
+    staff_workers: int | None = None,
+) -> tuple[str, str, str]:
+    """
+    With a cache_dir the outputs of the segmentation, the transformer and the OCR
+    are stored, so that a rerun only repeats the stages whose inputs changed.
+    With enable_trace the timings of all stages are written to a _trace.json file.
+    With profile_options the selected stage is profiled.
+    staff_workers is the number of threads which prepare the staff images.
+    """
+    eprint("Processing " + image_path)
+    trace = PageTrace(image_path) if enable_trace else None
+    profiler = create_profiler(image_path, profile_options)
+    with contextlib.ExitStack() as stack:
+        if trace is not None:
+            stack.enter_context(trace.activate())
+        if profiler is not None:
+            stack.enter_context(profiler.activate())
+        try:
+            return _process_image(
+                image_path, enable_debug, enable_cache, enable_ocr, cache_dir, staff_workers
+            )
+        finally:
+            write_diagnostics(image_path, trace, profiler)
+
+
+def _process_image(
+    image_path: str,
+    enable_debug: bool,
+    enable_cache: bool,
+    enable_ocr: bool,
+    cache_dir: str | None,
+    staff_workers: int | None,
+) -> tuple[str, str, str]:
+    stage_cache = StageCache(cache_dir, image_path) if cache_dir is not None else None
+    with trace_stage("load"):
+        image, preprocessed = load_image(image_path)
+    with trace_stage("segmentation"):
+        predictions, debug = segment_image(
+            image_path, image, preprocessed, enable_debug, enable_cache, stage_cache
+        )
+    del image, preprocessed
+    xml_file = replace_extension(image_path, ".musicxml")
+    try:
+        with trace_stage("detection"):
+            staffs, multi_staffs = detect_staffs(debug, predictions)
+        with trace_stage("decoding"):
+            result_staffs, title = parse_music(
+                debug, staffs, multi_staffs, predictions, enable_ocr, stage_cache, staff_workers
+            )
+        with trace_stage("xml"):
+            return write_results(image_path, debug, staffs, result_staffs, title)
     except:
         if os.path.exists(xml_file):
             os.remove(xml_file)
@@ -254,6 +456,313 @@ def process_image(  # noqa: PLR0915
         debug.clean_debug_files_from_previous_runs()
 
 
+def create_profiler(image_path: str, profile_options: ProfileOptions | None) -> PageProfiler | None:
+    if profile_options is None:
+        return None
+    return PageProfiler(replace_extension(image_path, "_profile"), profile_options)
+
+
+def write_diagnostics(
+    image_path: str, trace: PageTrace | None, profiler: PageProfiler | None
+) -> None:
+    if trace is not None:
+        trace.write(replace_extension(image_path, "_trace.json"))
+    if profiler is not None:
+        eprint("Profile of", image_path)
+        eprint(profiler.format_summary())
+        eprint("Profile was written to", profiler.write())
+
+
+class PageJob:
+    """
+    The state of one image while it passes through the stages of process_images.
+    The attributes are filled in by the stages in the order of the pipeline.
+    """
+
+    image: NDArray
+    preprocessed: NDArray
+    predictions: InputPredictions
+    debug: Debug
+    staffs: list[Staff]
+    multi_staffs: list[MultiStaff]
+    result_staffs: list[ResultStaff]
+    title: str
+    teaser_file: str
+    staffs_to_parse: StaffsToParse
+    decoded_staffs: "Future[list[ResultStaff]]"
+
+    def __init__(  # noqa: PLR0913
+        self,
+        image_path: str,
+        enable_debug: bool,
+        enable_cache: bool,
+        enable_ocr: bool,
+        cache_dir: str | None = None,
+        enable_trace: bool = False,
+        profiler: PageProfiler | None = None,
+        staff_workers: int | None = None,
+    ) -> None:
+        self.image_path = image_path
+        self.enable_debug = enable_debug
+        self.enable_cache = enable_cache
+        self.enable_ocr = enable_ocr
+        self.cache_dir = cache_dir
+        self.stage_cache: StageCache | None = None
+        self.trace = PageTrace(image_path) if enable_trace else None
+        self.profiler = profiler
+        self.staff_workers = staff_workers
+        self.xml_file = replace_extension(image_path, ".musicxml")
+
+    @contextlib.contextmanager
+    def _trace_stage(self, name: str) -> Iterator[None]:
+        """
+        The stages of a page run on different threads, so the trace
+        and the profiler are activated again for every stage.
+        """
+        with contextlib.ExitStack() as stack:
+            if self.trace is not None:
+                stack.enter_context(self.trace.activate())
+            if self.profiler is not None:
+                stack.enter_context(self.profiler.activate())
+            with trace_stage(name):
+                yield
+
+    def load(self) -> "PageJob":
+        eprint("Processing " + self.image_path)
+        with self._trace_stage("load"):
+            if self.cache_dir is not None:
+                self.stage_cache = StageCache(self.cache_dir, self.image_path)
+            self.image, self.preprocessed = load_image(self.image_path)
+        return self
+
+    def segment(self) -> "PageJob":
+        with self._trace_stage("segmentation"):
+            self.predictions, self.debug = segment_image(
+                self.image_path,
+                self.image,
+                self.preprocessed,
+                self.enable_debug,
+                self.enable_cache,
+                self.stage_cache,
+            )
+        # Only the resized copies in the predictions are used from here on
+        del self.image, self.preprocessed
+        return self
+
+    def detect(self) -> "PageJob":
+        with self._trace_stage("detection"):
+            self.staffs, self.multi_staffs = detect_staffs(self.debug, self.predictions)
+        return self
+
+    def parse(self) -> "PageJob":
+        with self._trace_stage("decoding"):
+            self.result_staffs, self.title = parse_music(
+                self.debug,
+                self.staffs,
+                self.multi_staffs,
+                self.predictions,
+                self.enable_ocr,
+                self.stage_cache,
+                self.staff_workers,
+            )
+        return self
+
+    def submit_staffs(self, decoder: CrossPageStaffDecoder) -> "PageJob":
+        """
+        Prepares the staff images and queues them for decoding together with the
+        staffs of other pages. The title is detected while the staffs are decoded.
+        """
+        with self._trace_stage("preparation"):
+            self.staffs_to_parse = StaffsToParse(self.multi_staffs)
+            staffs = self.staffs_to_parse.staffs
+            cache = self.stage_cache
+            cached = cache.load_transformer_outputs(staffs) if cache is not None else None
+            if cached is not None:
+                self.decoded_staffs = Future()
+                self.decoded_staffs.set_result(self.staffs_to_parse.pick_results(cached))
+            else:
+                prepared = prepare_staffs(
+                    self.debug, self.staffs_to_parse, self.predictions, self.staff_workers
+                )
+                self.decoded_staffs = decoder.submit(
+                    [staff for _image, staff, _options in prepared],
+                    [image_options for _image, _staff, image_options in prepared],
+                    (
+                        functools.partial(cache.save_transformer_outputs, staffs)
+                        if cache is not None
+                        else None
+                    ),
+                )
+            self.title = get_title(self.debug, self.staffs[0], cache) if self.enable_ocr else ""
+        eprint("Found title: " + self.title)
+        return self
+
+    def collect_staffs(self) -> "PageJob":
+        with self._trace_stage("collect_staffs"):
+            # The staffs are decoded in shared batches, which aren't part of the page trace
+            result_staffs = self.staffs_to_parse.merge_results(self.decoded_staffs.result())
+            self.result_staffs = maintain_accidentals(result_staffs)
+        return self
+
+    def write(self) -> "PageJob":
+        with self._trace_stage("xml"):
+            _xml_file, _title, self.teaser_file = write_results(
+                self.image_path, self.debug, self.staffs, self.result_staffs, self.title
+            )
+        self.release()
+        return self
+
+    def release(self) -> None:
+        """
+        Drops the images and intermediate results of the page, once it was written
+        or failed. Only the trace and the profiler are kept for the summary of the run.
+        """
+        for attribute in [
+            "image",
+            "preprocessed",
+            "predictions",
+            "debug",
+            "staffs",
+            "multi_staffs",
+            "result_staffs",
+            "staffs_to_parse",
+            "decoded_staffs",
+        ]:
+            vars(self).pop(attribute, None)
+
+    def write_diagnostics(self) -> None:
+        write_diagnostics(self.image_path, self.trace, self.profiler)
+
+    def clean_up_after_error(self) -> None:
+        if os.path.exists(self.xml_file):
+            os.remove(self.xml_file)
+        if hasattr(self, "debug"):
+            self.debug.clean_debug_files_from_previous_runs()
+        self.release()
+
+
+class PipelineOptions:
+    """
+    Number of worker threads per stage of process_images. The segmentation and the
+    transformer are the expensive stages, but more than one worker for them
+    only pays off if the hardware can run several model invocations at once.
+    staff_workers threads prepare the staff images of a page, for every
+    decoding worker.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        load_workers: int = 1,
+        segmentation_workers: int = 1,
+        detection_workers: int = 1,
+        decoding_workers: int = 1,
+        writing_workers: int = 1,
+        queue_size: int = 2,
+        batch_size: int | None = None,
+        staff_workers: int | None = None,
+    ) -> None:
+        self.load_workers = load_workers
+        self.segmentation_workers = segmentation_workers
+        self.detection_workers = detection_workers
+        self.decoding_workers = decoding_workers
+        self.writing_workers = writing_workers
+        self.queue_size = queue_size
+        # Decode the staffs of all pages in shared batches of this size
+        self.batch_size = batch_size
+        self.staff_workers = staff_workers
+
+
+def process_images(
+    image_paths: list[str],
+    enable_debug: bool,
+    enable_cache: bool,
+    enable_ocr: bool = True,
+    options: PipelineOptions | None = None,
+    cache_dir: str | None = None,
+    enable_trace: bool = False,
+    profile_options: ProfileOptions | None = None,
+) -> list[str]:
+    """
+    Processes the images in a staged pipeline, so that e.g. the next image is
+    segmented while the staffs of the current one are decoded.
+    With options.batch_size the staffs of all pages are decoded in shared batches.
+    With enable_trace a trace is written for every page and a summary of
+    all pages is printed at the end.
+    With profile_options every n-th page is profiled.
+    Returns the files which failed.
+    """
+    if options is None:
+        options = PipelineOptions()
+    stages = [
+        Stage("load", PageJob.load, options.load_workers),
+        Stage("segmentation", PageJob.segment, options.segmentation_workers),
+        Stage("detection", PageJob.detect, options.detection_workers),
+    ]
+    decoder: CrossPageStaffDecoder | None = None
+    if options.batch_size is None:
+        stages += [
+            Stage("decoding", PageJob.parse, options.decoding_workers),
+            Stage("xml", PageJob.write, options.writing_workers),
+        ]
+    else:
+        batch_decoder = CrossPageStaffDecoder(StaffBatchQueue(options.batch_size))
+        decoder = batch_decoder
+        stages += [
+            Stage(
+                "preparation",
+                lambda job: job.submit_staffs(batch_decoder),
+                options.decoding_workers,
+            ),
+            Stage("xml", lambda job: job.collect_staffs().write(), options.writing_workers),
+        ]
+        decoder_thread = threading.Thread(target=decoder.run, daemon=True)
+        decoder_thread.start()
+    pipeline = Pipeline(stages, queue_size=options.queue_size)
+    # The jobs are only created once the pipeline asks for them, and the pipeline
+    # drops them when they are finished, so that only the pages in flight use memory
+    jobs = (
+        PageJob(
+            path,
+            enable_debug,
+            enable_cache,
+            enable_ocr,
+            cache_dir,
+            enable_trace,
+            (
+                create_profiler(path, profile_options)
+                if profile_options is not None and profile_options.should_profile(i)
+                else None
+            ),
+            options.staff_workers,
+        )
+        for i, path in enumerate(image_paths)
+    )
+    error_files = []
+    traces: list[PageTrace] = []
+    for result in pipeline.run(jobs):
+        result.item.write_diagnostics()
+        if result.item.trace is not None:
+            traces.append(result.item.trace)
+        if result.error is None:
+            eprint("Finished", result.item.image_path)
+            continue
+        eprint(
+            f"An error occurred while processing {result.item.image_path}"
+            + f" in stage {result.stage}: {result.error}"
+        )
+        result.item.clean_up_after_error()
+        error_files.append(result.item.image_path)
+    if decoder is not None:
+        decoder.close()
+        decoder_thread.join()
+    eprint(pipeline.format_report())
+    if decoder is not None:
+        eprint(decoder.format_report())
+    if enable_trace:
+        eprint(format_trace_summary(traces))
+    return error_files
+
+
 def get_all_image_files_in_folder(folder: str) -> list[str]:
     image_files = []
     for ext in ["png", "jpg", "jpeg"]:
@@ -294,8 +803,28 @@ def download_weights() -> None:
                     os.remove(downloaded_zip)
 
 
-def main(imagePath='bach1001_2.png', finit=False, fdebug=False, fcache=False) -> None:
-    print('in main')
+def main(
+    imagePath="bach1001_2.png",
+    finit=False,
+    fdebug=False,
+    fcache=False,
+    focr=True,
+    fbatch=None,
+    fqueuesize=2,
+    floadworkers=1,
+    fsegmentationworkers=1,
+    fdetectionworkers=1,
+    fdecodingworkers=1,
+    fwritingworkers=1,
+    fstaffworkers=None,
+    fcachedir=None,
+    fresultcache=None,
+    ftrace=False,
+    fprofile=None,
+    fprofileevery=1,
+    fprofilesampling=False,
+) -> None:
+    print("in main")
     download_weights()
     if finit:
         eprint("Init finished")
@@ -304,24 +833,49 @@ def main(imagePath='bach1001_2.png', finit=False, fdebug=False, fcache=False) ->
     if not imagePath:
         eprint("No image provided")
         sys.exit(1)
-    elif os.path.isfile(imagePath):
-        process_image(imagePath, fdebug, fcache)
-    elif os.path.isdir(imagePath):
-        image_files = get_all_image_files_in_folder(imagePath)
-        eprint("Processing", len(image_files), "files:", image_files)
-        error_files = []
-        for image_file in image_files:
-            eprint("=========================================")
-            try:
-                process_image(image_file, fdebug, fcache)
-                eprint("Finished", image_file)
-            except Exception as e:
-                eprint(f"An error occurred while processing {image_file}: {e}")
-                error_files.append(image_file)
-        if len(error_files) > 0:
-            eprint("Errors occurred while processing the following files:", error_files)
-    else:
-        raise ValueError(f"{imagePath} is not a valid file or directory")
+    # Staff images which were decoded in an earlier run are taken from this cache
+    result_cache = StaffResultCache(fresultcache) if fresultcache is not None else None
+    set_result_cache(result_cache)
+    # fprofile is the name of a stage, e.g. "detection", or "page" for all stages
+    profile_options = (
+        ProfileOptions(fprofile, fprofileevery, fprofilesampling) if fprofile is not None else None
+    )
+    try:
+        if os.path.isfile(imagePath):
+            process_image(
+                imagePath, fdebug, fcache, focr, fcachedir, ftrace, profile_options, fstaffworkers
+            )
+        elif os.path.isdir(imagePath):
+            image_files = get_all_image_files_in_folder(imagePath)
+            eprint("Processing", len(image_files), "files:", image_files)
+            error_files = process_images(
+                image_files,
+                fdebug,
+                fcache,
+                focr,
+                PipelineOptions(
+                    load_workers=floadworkers,
+                    segmentation_workers=fsegmentationworkers,
+                    detection_workers=fdetectionworkers,
+                    decoding_workers=fdecodingworkers,
+                    writing_workers=fwritingworkers,
+                    queue_size=fqueuesize,
+                    batch_size=fbatch,
+                    staff_workers=fstaffworkers,
+                ),
+                fcachedir,
+                ftrace,
+                profile_options,
+            )
+            if len(error_files) > 0:
+                eprint("Errors occurred while processing the following files:", error_files)
+        else:
+            raise ValueError(f"{imagePath} is not a valid file or directory")
+    finally:
+        if result_cache is not None:
+            eprint(result_cache.format_statistics())
+            set_result_cache(None)
+            result_cache.close()
 
 
 if __name__ == "__main__":
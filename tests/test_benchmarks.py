@@ -0,0 +1,51 @@
+import importlib.util
+import unittest
+
+from benchmarks.runner import BenchmarkResult, Task, compare_to_baseline, get_machine, measure
+from benchmarks.stages import DetectedSymbols, main_requires
+from benchmarks.synthetic import SyntheticPage, random_staff_image
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_synthetic_page_has_staffs_and_notes(self) -> None:
+        missing = [module for module in main_requires if importlib.util.find_spec(module) is None]
+        if len(missing) > 0:
+            self.skipTest(f"Dependencies of main are not installed: {missing}")
+        page = SyntheticPage(number_of_staffs=3, notes_per_staff=10)
+        symbols = DetectedSymbols(page)
+        staffs = symbols.detect_staffs_with_notes()
+        self.assertEqual(len(staffs), 3)  # noqa: PLR2004
+        self.assertEqual(sum(len(staff.get_notes()) for staff in staffs), 30)  # noqa: PLR2004
+        self.assertEqual(random_staff_image().shape, (128, 1280, 3))
+
+    def test_every_run_gets_a_fresh_input(self) -> None:
+        inputs: list[list[int]] = []
+
+        def run(values: list[int]) -> None:
+            values.append(1)
+            inputs.append(values)
+
+        timings = measure(Task(run, list), min_time_in_seconds=0, min_runs=3)
+        self.assertEqual(len(timings), 3)  # noqa: PLR2004
+        self.assertEqual(inputs, [[1]] * 4)
+
+    def test_slower_results_are_regressions(self) -> None:
+        baseline = {
+            "machine": get_machine(),
+            "results": {
+                "same": {"median_seconds": 1.0},
+                "slower": {"median_seconds": 1.0},
+                "faster": {"median_seconds": 1.0},
+            },
+        }
+        results = [
+            BenchmarkResult("same", [1.1]),
+            BenchmarkResult("slower", [1.5]),
+            BenchmarkResult("faster", [0.5]),
+            BenchmarkResult("new", [1.0]),
+        ]
+        lines, regressions = compare_to_baseline(results, baseline, tolerance=0.25)
+        self.assertEqual(regressions, ["slower"])
+        self.assertIn("faster", lines[3])
+        self.assertIn("new", lines[4])
@@ -1,8 +1,17 @@
 import unittest
 
+import cv2
 import numpy as np
 
-from homr.bounding_boxes import BoundingEllipse, RotatedBoundingBox
+from homr.bounding_boxes import (
+    BoundingEllipse,
+    BoxSet,
+    ContourStore,
+    RotatedBoundingBox,
+    create_bounding_ellipses,
+    create_rotated_bounding_boxes,
+    merge_overlaying_bounding_boxes,
+)
 
 empty = np.array([])
 
@@ -55,3 +64,146 @@ class TestBoundingBoxes(unittest.TestCase):
         )
         ellipse2 = BoundingEllipse(((536.93896484375, 470.5845947265625), (13, 17), 5), empty)
         self.assertFalse(box2.is_overlapping(ellipse2))
+
+    def test_merge_overlaying_bounding_boxes_is_transitive(self) -> None:
+        # Every box only touches its direct neighbors, but all of them form one chain
+        chain = [RotatedBoundingBox(((100 + 8 * i, 200), (10, 10), 0), empty) for i in range(30)]
+        separate = RotatedBoundingBox(((100, 400), (10, 10), 0), empty)
+        groups = merge_overlaying_bounding_boxes([*chain, separate])
+        self.assertEqual(groups, [chain, [separate]])
+
+    def test_merge_overlaying_bounding_boxes_matches_pairwise_overlaps(self) -> None:
+        rng = np.random.default_rng(42)
+        boxes = [
+            RotatedBoundingBox(
+                (
+                    (float(rng.uniform(0, 300)), float(rng.uniform(0, 300))),
+                    (float(rng.uniform(2, 30)), float(rng.uniform(2, 30))),
+                    float(rng.uniform(-45, 45)),
+                ),
+                empty,
+            )
+            for _ in range(150)
+        ]
+        groups = merge_overlaying_bounding_boxes(boxes)
+        group_of = {id(box): i for i, group in enumerate(groups) for box in group}
+        self.assertEqual(len(group_of), len(boxes))
+        for i, box in enumerate(boxes):
+            for other in boxes[i + 1 :]:
+                if box.is_overlapping(other):
+                    self.assertEqual(group_of[id(box)], group_of[id(other)])
+
+    def test_box_set_matches_rotated_bounding_boxes(self) -> None:
+        img = np.zeros((100, 200), dtype=np.uint8)
+        img[10:14, 10:80] = 1
+        img[40:70, 100:104] = 1
+        img[80:83, 150:152] = 1
+        contours, _ = cv2.findContours(img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        box_set = BoxSet.from_contours(contours)
+        self.assertEqual(len(box_set), 3)
+        for i, contour in enumerate(contours):
+            expected = RotatedBoundingBox(cv2.minAreaRect(contour), contour, i)
+            actual = box_set[i]
+            self.assertEqual(actual.box, expected.box)
+            self.assertTrue(np.array_equal(actual.polygon, expected.polygon))
+            self.assertTrue(np.array_equal(actual.contours, contour))
+            self.assertTrue(
+                np.allclose(
+                    box_set.corners[i],
+                    [
+                        expected.top_left,
+                        expected.bottom_left,
+                        expected.top_right,
+                        expected.bottom_right,
+                    ],
+                )
+            )
+
+        filtered = box_set.filter_by_size(min_size=(3, 3), max_size=(100, 100))
+        self.assertEqual([box.size for box in filtered], [(3.0, 29.0), (69.0, 3.0)])
+        self.assertEqual(len(box_set[1:]), 2)
+        self.assertTrue(np.array_equal(box_set[1:][0].contours, box_set[1].contours))
+
+    def test_create_rotated_bounding_boxes_filters_by_size(self) -> None:
+        img = np.zeros((100, 200), dtype=np.uint8)
+        img[10:14, 10:80] = 1
+        img[40:70, 100:104] = 1
+        boxes = create_rotated_bounding_boxes(img, skip_merging=True, min_size=(3, 3))
+        self.assertEqual(len(boxes), 2)
+        boxes = create_rotated_bounding_boxes(img, skip_merging=True, max_size=(40, 40))
+        self.assertEqual([box.size for box in boxes], [(3.0, 29.0)])
+
+    def test_get_color_ratio_only_looks_at_the_box(self) -> None:
+        img = np.zeros((200, 300), dtype=np.uint8)
+        img[:, 150:] = 1
+        box = RotatedBoundingBox(((150, 100), (20, 10), 0), empty)
+        self.assertAlmostEqual(box.get_color_ratio(img), 0.5, delta=0.05)
+        ellipse = BoundingEllipse(((200, 100), (20, 10), 0), empty)
+        self.assertEqual(ellipse.get_color_ratio(img), 1.0)
+        partly_outside = RotatedBoundingBox(((295, 5), (20, 20), 0), empty)
+        self.assertEqual(partly_outside.get_color_ratio(img), 1.0)
+
+    def test_contour_store_reuses_contours(self) -> None:
+        img = np.zeros((100, 200), dtype=np.uint8)
+        img[10:14, 10:80] = 1
+        img[40:70, 100:104] = 1
+        cv2.ellipse(img, (150, 50), (8, 5), 0, 0, 360, (1,), -1)
+        store = ContourStore()
+        self.assertIs(store.get_contours(img), store.get_contours(img))
+        self.assertIsNot(store.get_contours(img), store.get_contours(img, cv2.RETR_TREE))
+
+        for min_size, max_size in [((3, 3), None), (None, (40, 40)), ((1, 5), (100, 100))]:
+            expected = create_rotated_bounding_boxes(
+                img, skip_merging=True, min_size=min_size, max_size=max_size
+            )
+            actual = store.create_rotated_bounding_boxes(
+                img,
+                skip_merging=True,
+                min_size=min_size,
+                max_size=max_size,
+                mode=cv2.RETR_TREE,
+            )
+            self.assertEqual([box.box for box in actual], [box.box for box in expected])
+
+        expected_ellipses = create_bounding_ellipses(img, skip_merging=True, min_size=(4, 4))
+        actual_ellipses = store.create_bounding_ellipses(
+            img, skip_merging=True, min_size=(4, 4), mode=cv2.RETR_TREE
+        )
+        self.assertEqual(
+            [box.box for box in actual_ellipses], [box.box for box in expected_ellipses]
+        )
+        # Without holes the outer contours give the same merged result
+        merged = store.create_bounding_ellipses(img, min_size=(4, 4))
+        expected_merged = create_bounding_ellipses(img, min_size=(4, 4))
+        self.assertEqual([box.box for box in merged], [box.box for box in expected_merged])
+
+    def test_filtered_box_set_matches_contours(self) -> None:
+        rng = np.random.default_rng(7)
+        noise_ratio = 0.03
+        img = (rng.random((300, 400)) < noise_ratio).astype(np.uint8)
+        for _ in range(40):
+            center = (int(rng.integers(0, 400)), int(rng.integers(0, 300)))
+            axes = (int(rng.integers(2, 30)), int(rng.integers(2, 30)))
+            cv2.ellipse(img, center, axes, float(rng.uniform(0, 180)), 0, 360, (1,), -1)
+        store = ContourStore()
+        for min_size, max_size in [((5, 5), (100, 100)), ((20, 40), None), ((1, 5), None)]:
+            expected = store.get_rotated_box_set(img).filter_by_size(min_size, max_size)
+            actual = store.get_filtered_box_set(img, min_size, max_size)
+            self.assertEqual([box.box for box in actual], [box.box for box in expected])
+            self.assertEqual(actual.debug_ids.tolist(), expected.debug_ids.tolist())
+            for i in range(len(actual)):
+                self.assertTrue(np.array_equal(actual[i].contours, expected[i].contours))
+
+    def test_filtered_box_set_skips_components_in_holes(self) -> None:
+        ring = np.zeros((100, 100), dtype=np.uint8)
+        cv2.circle(ring, (50, 50), 40, (1,), 3)
+        ring[45:55, 45:55] = 1
+        fresh_store = ContourStore()
+        fast = fresh_store.create_rotated_bounding_boxes(ring, skip_merging=True, min_size=(5, 5))
+        fitted_store = ContourStore()
+        fitted_store.get_rotated_box_set(ring)
+        fitted = fitted_store.create_rotated_bounding_boxes(
+            ring, skip_merging=True, min_size=(5, 5)
+        )
+        self.assertEqual([box.size for box in fast], [(84.0, 84.0)])
+        self.assertEqual([box.box for box in fast], [box.box for box in fitted])
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from homr.transformer.configs import Config
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Frameworks which must only be imported by the stage which needs them
+heavy_modules = {
+    "tensorflow",
+    "torch",
+    "timm",
+    "transformers",
+    "x_transformers",
+    "albumentations",
+    "easyocr",
+}
+
+import_time_budget_in_seconds = 1.0
+
+
+def measure_import_times(module: str) -> tuple[dict[str, int], str]:
+    """
+    Imports the module in a fresh interpreter with -X importtime and returns
+    the cumulative import time in microseconds of every imported module and stderr.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],  # noqa: S603
+        cwd=repository,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _self_time, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    errors = result.stderr if result.returncode != 0 else ""
+    return times, errors
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_main_starts_without_heavy_frameworks(self) -> None:
+        times, errors = measure_import_times("main")
+        missing = errors.strip().splitlines()[-1] if errors else ""
+        if missing.startswith("ModuleNotFoundError") and not any(
+            f"'{module}" in missing for module in heavy_modules
+        ):
+            self.skipTest(f"Dependencies of main are not installed: {missing}")
+        self.assertEqual(errors, "")
+        imported_packages = {name.split(".")[0] for name in times}
+        self.assertEqual(imported_packages & heavy_modules, set())
+        self.assertLess(times["main"] / 1e6, import_time_budget_in_seconds)
+
+    def test_config_loads_tokenizers_on_first_use(self) -> None:
+        config = Config()
+        self.assertNotIn("rhythm_vocab", vars(config))
+        self.assertEqual(config.chordindex, config.rhythm_vocab["|"])
+        self.assertIn("rhythm_vocab", vars(config))
+        self.assertGreater(len(config.noteindexes), 0)
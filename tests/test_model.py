@@ -2,8 +2,17 @@ import unittest
 
 import numpy as np
 
-from homr.bounding_boxes import RotatedBoundingBox
-from homr.model import MultiStaff, Staff, StaffPoint
+from homr.bounding_boxes import BoundingEllipse, RotatedBoundingBox
+from homr.model import (
+    BarLine,
+    MultiStaff,
+    Note,
+    NoteGroup,
+    NoteHeadType,
+    Prediction,
+    Staff,
+    StaffPoint,
+)
 
 
 def make_staff(number: int) -> Staff:
@@ -39,3 +48,67 @@ class TestModel(unittest.TestCase):
             result2.connections,
             [staff2.connections[0], staff2.connections[1], staff1.connections[0]],
         )
+
+    def test_staff_get_at(self) -> None:
+        x_values = [0.0, 10.0, 20.0, 20.0, 30.0, 200.0]
+        staff = Staff([StaffPoint(x, [10 * i + x for i in range(5)], 0) for x in x_values])
+
+        def closest_point(x: float) -> StaffPoint | None:
+            point = min(staff.grid, key=lambda p: abs(p.x - x))
+            return point if abs(point.x - x) <= 50 else None  # noqa: PLR2004
+
+        queries = [-60.0, -50.0, 4.0, 5.0, 14.0, 15.0, 20.0, 22.0, 80.0, 81.0, 115.0, 150.0, 300.0]
+        for x in queries:
+            self.assertIs(staff.get_at(x), closest_point(x))
+        self.assertIs(staff.get_at(20.0), staff.grid[2])
+        self.assertIs(staff.get_at(80.0), staff.grid[4])
+        self.assertIsNone(staff.get_at(81.0))
+
+        indices = staff.get_at_many(np.array(queries))
+        expected: list[int] = []
+        for x in queries:
+            point = closest_point(x)
+            expected.append(-1 if point is None else staff.grid.index(point))
+        self.assertEqual(indices.tolist(), expected)
+        self.assertEqual(staff.y_distance_to((22.0, 53.0)), 3.0)
+        self.assertEqual(staff.y_distance_to((116.0, 53.0)), 1e10)
+
+    def test_transform_coordinates_in_bulk(self) -> None:
+        staff = Staff(
+            [StaffPoint(x, [10 * i + 0.1 * x for i in range(5)], 0.5) for x in [0.0, 10.0, 30.0]]
+        )
+        prediction = Prediction({NoteHeadType.SOLID: 1.0}, NoteHeadType.SOLID)
+        notes = [
+            Note(BoundingEllipse(((12, y), (8, 6), 0), np.array([])), 0, prediction, None, None)
+            for y in [5.0, 15.0]
+        ]
+        staff.add_symbols(
+            [
+                notes[0],
+                NoteGroup(notes),
+                BarLine(RotatedBoundingBox(((25, 20), (2, 40), 0), np.array([]))),
+            ]
+        )
+
+        def transformation(point: tuple[float, float]) -> tuple[float, float]:
+            return (point[0] - 3) * 1.5 + 0.01 * point[1], (point[1] + 7) * 1.5
+
+        expected = staff.transform_coordinates(transformation)
+        actual = staff.transform_coordinates_in_bulk(
+            lambda points: np.array([transformation(point) for point in points.tolist()])
+        )
+        self.assertEqual(
+            [(p.x, p.y, p.angle, p.average_unit_size) for p in actual.grid],
+            [(p.x, p.y, p.angle, p.average_unit_size) for p in expected.grid],
+        )
+        self.assertEqual(
+            [(type(s), tuple(s.center)) for s in actual.symbols],
+            [(type(s), tuple(s.center)) for s in expected.symbols],
+        )
+        actual_group = actual.get_note_groups()[0]
+        expected_group = expected.get_note_groups()[0]
+        self.assertEqual(
+            [note.center for note in actual_group.notes],
+            [note.center for note in expected_group.notes],
+        )
+        self.assertEqual(staff.symbols[0].center, (12, 5.0))
@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from homr.bounding_boxes import BoundingEllipse, RotatedBoundingBox
+from homr.model import Note, NoteHeadType, Prediction, Staff, StaffPoint
+from homr.note_detection import _group_notes_on_staff, combine_noteheads_with_stems
+
+empty = np.array([])
+
+
+def make_note(x: float, position: int, stem_x: float | None) -> Note:
+    notehead = BoundingEllipse(((x, 120), (12, 10), 0), empty)
+    stem = None
+    if stem_x is not None:
+        stem = RotatedBoundingBox(((stem_x, 100), (2, 40), 0), empty)
+    prediction = Prediction({NoteHeadType.SOLID: 1.0}, NoteHeadType.SOLID)
+    return Note(notehead, position, prediction, stem, None)
+
+
+class TestNoteDetection(unittest.TestCase):
+
+    def test_combine_noteheads_with_stems(self) -> None:
+        rng = np.random.default_rng(3)
+        noteheads = [
+            BoundingEllipse(
+                (
+                    (float(rng.uniform(0, 1000)), float(rng.uniform(0, 200))),
+                    (float(rng.uniform(8, 20)), float(rng.uniform(6, 14))),
+                    float(rng.uniform(-20, 20)),
+                ),
+                empty,
+            )
+            for _ in range(200)
+        ]
+        stems = [
+            RotatedBoundingBox(
+                (
+                    (float(rng.uniform(0, 1000)), float(rng.uniform(0, 200))),
+                    (float(rng.uniform(1, 4)), float(rng.uniform(20, 60))),
+                    float(rng.uniform(-5, 5)),
+                ),
+                empty,
+            )
+            for _ in range(150)
+        ]
+        result, unaccounted = combine_noteheads_with_stems(noteheads, stems)
+        self.assertEqual(len(result), len(noteheads))
+        for combined in result:
+            thickened_notehead = combined.notehead.make_box_thicker(15)
+            expected = next(
+                (stem for stem in stems if stem.is_overlapping(thickened_notehead)), None
+            )
+            self.assertIs(combined.stem, expected)
+        used_stems = {id(combined.stem) for combined in result}
+        self.assertEqual(unaccounted, [stem for stem in stems if id(stem) not in used_stems])
+
+    def test_group_notes_on_staff(self) -> None:
+        staff = Staff([StaffPoint(0.0, [100, 110, 120, 130, 140], 0)])
+        chord = [make_note(100, 1, 106), make_note(96, 3, 107), make_note(104, 5, None)]
+        # The stems are too far apart, even though the noteheads are close
+        separate = make_note(112, 2, 125)
+        # Joins the chord through the note without a stem
+        joined = make_note(113, 4, None)
+        single = make_note(300, 0, 306)
+        for note in [chord[0], separate, chord[1], single, chord[2], joined]:
+            staff.add_symbol(note)
+        _group_notes_on_staff(staff)
+        self.assertEqual(len(staff.symbols), 3)
+        group = staff.get_note_groups()[0]
+        self.assertIs(staff.symbols[0], group)
+        self.assertEqual(group.notes, [chord[2], joined, chord[1], chord[0]])
+        self.assertEqual(staff.symbols[1:], [separate, single])
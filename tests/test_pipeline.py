@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+
+from homr.pipeline import Pipeline, Stage
+
+
+def fail_on_three(value: int) -> int:
+    if value == 3:  # noqa: PLR2004
+        raise ValueError("three")
+    return value
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_results_know_their_input_index(self) -> None:
+        def wait_and_double(value: int) -> int:
+            # Later items finish first
+            time.sleep(0.001 * (10 - value))
+            return 2 * value
+
+        pipeline = Pipeline(
+            [Stage("double", wait_and_double, workers=4), Stage("add", lambda x: x + 1)]
+        )
+        results = sorted(pipeline.run(range(10)), key=lambda result: result.index)
+        self.assertEqual([result.value for result in results], [2 * i + 1 for i in range(10)])
+        self.assertEqual([result.item for result in results], list(range(10)))
+
+    def test_results_are_yielded_while_other_items_run(self) -> None:
+        first_received = threading.Event()
+
+        def wait_for_first_result(value: int) -> bool:
+            if value == 0:
+                return True
+            return first_received.wait(timeout=5)
+
+        pipeline = Pipeline([Stage("wait", wait_for_first_result)])
+        values: list[bool] = []
+        for result in pipeline.run(range(2)):
+            values.append(result.value)
+            first_received.set()
+        self.assertEqual(values, [True, True])
+
+    def test_errors_only_stop_the_failed_item(self) -> None:
+        calls: list[int] = []
+        pipeline = Pipeline([Stage("check", fail_on_three), Stage("record", calls.append)])
+        results = sorted(pipeline.run(range(5)), key=lambda result: result.index)
+        self.assertEqual(calls, [0, 1, 2, 4])
+        failed = results[3]
+        self.assertIsInstance(failed.error, ValueError)
+        self.assertEqual(failed.stage, "check")
+        self.assertEqual(failed.value, 3)
+        self.assertEqual(
+            [result.error is None for result in results], [True, True, True, False, True]
+        )
+
+    def test_stages_overlap_and_queues_are_bounded(self) -> None:
+        lock = threading.Lock()
+        in_flight = [0]
+        max_in_flight = [0]
+
+        def produce(value: int) -> int:
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            return value
+
+        def consume(value: int) -> int:
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return value
+
+        queue_size = 2
+        pipeline = Pipeline(
+            [Stage("produce", produce), Stage("consume", consume)], queue_size=queue_size
+        )
+        list(pipeline.run(range(20)))
+        # The queued items, one blocked in put and the one the consumer works on
+        self.assertLessEqual(max_in_flight[0], queue_size + 2)
+        utilisation = pipeline.get_utilisation()
+        self.assertGreater(utilisation["consume"], 0.5)
+        self.assertLess(utilisation["produce"], utilisation["consume"])
+        self.assertIn("consume: 20 items", pipeline.format_report())
+
+    def test_stage_needs_a_worker(self) -> None:
+        with self.assertRaises(ValueError):
+            Stage("none", fail_on_three, workers=0)
@@ -0,0 +1,88 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from homr.bounding_boxes import (
+    AngledBoundingBox,
+    BoundingEllipse,
+    RotatedBoundingBox,
+    do_polygons_overlap,
+    do_polygons_overlap_many,
+)
+from homr.type_definitions import NDArray
+
+empty = np.array([])
+
+
+def _any_point_inside(poly1: NDArray, poly2: NDArray) -> bool:
+    """
+    The original point by point implementation of do_polygons_overlap.
+    """
+    for point in poly1:
+        if cv2.pointPolygonTest(poly2, (float(point[0]), float(point[1])), False) >= 0:
+            return True
+    for point in poly2:
+        if cv2.pointPolygonTest(poly1, (float(point[0]), float(point[1])), False) >= 0:
+            return True
+    return False
+
+
+def _random_shape(rng: np.random.Generator, ellipse: bool | np.bool_) -> AngledBoundingBox:
+    box = (
+        (float(rng.uniform(0, 80)), float(rng.uniform(0, 80))),
+        (float(rng.uniform(1, 40)), float(rng.uniform(1, 40))),
+        float(rng.uniform(-90, 90)),
+    )
+    if ellipse:
+        return BoundingEllipse(box, empty)
+    return RotatedBoundingBox(box, empty)
+
+
+class TestPolygonOverlap(unittest.TestCase):
+
+    def test_known_cases(self) -> None:
+        box = RotatedBoundingBox(((100, 200), (10, 10), 0), empty)
+        others: list[AngledBoundingBox] = [
+            RotatedBoundingBox(((110, 200), (10, 10), 0), empty),
+            RotatedBoundingBox(((105, 200), (10, 10), 0), empty),
+            RotatedBoundingBox(((200, 200), (10, 10), 0), empty),
+            RotatedBoundingBox(((105, 205), (10, 10), 90), empty),
+            BoundingEllipse(((110, 200), (10, 10), 0), empty),
+            BoundingEllipse(((105, 200), (10, 10), 0), empty),
+            BoundingEllipse(((200, 200), (10, 10), 0), empty),
+        ]
+        expected = [True, True, False, True, True, True, False]
+        self.assertEqual(list(box.is_overlapping_with_each(others)), expected)
+        self.assertEqual([box.is_overlapping(other) for other in others], expected)
+
+        stem = RotatedBoundingBox(
+            ((570.1167602539062, 506.98968505859375), (2, 60), -5.042449951171875), empty
+        )
+        notehead = BoundingEllipse(((536.93896484375, 470.5845947265625), (13, 17), 5), empty)
+        self.assertFalse(stem.is_overlapping(notehead))
+        self.assertFalse(stem.is_overlapping_with_any([notehead]))
+
+    def test_crossing_boxes_without_a_point_inside_dont_overlap(self) -> None:
+        horizontal = RotatedBoundingBox(((100, 100), (60, 4), 0), empty)
+        vertical = RotatedBoundingBox(((100, 100), (4, 60), 0), empty)
+        self.assertFalse(_any_point_inside(horizontal.polygon, vertical.polygon))
+        self.assertFalse(horizontal.is_overlapping(vertical))
+        self.assertFalse(horizontal.is_overlapping_with_any([vertical]))
+
+    def test_random_shapes_match_reference(self) -> None:
+        rng = np.random.default_rng(1234)
+        ellipse_ratio = 0.5
+        for _ in range(50):
+            shape = _random_shape(rng, rng.random() < ellipse_ratio)
+            others = [_random_shape(rng, rng.random() < ellipse_ratio) for _ in range(40)]
+            expected = [_any_point_inside(shape.polygon, other.polygon) for other in others]
+            actual = do_polygons_overlap_many(shape.polygon, [other.polygon for other in others])
+            self.assertEqual(list(actual), expected)
+            for other, overlap in zip(others, expected, strict=True):
+                self.assertEqual(do_polygons_overlap(shape.polygon, other.polygon), overlap)
+
+    def test_empty_candidates(self) -> None:
+        box = RotatedBoundingBox(((100, 200), (10, 10), 0), empty)
+        self.assertEqual(len(box.is_overlapping_with_each([])), 0)
+        self.assertFalse(box.is_overlapping_with_any([]))
@@ -0,0 +1,97 @@
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+
+from homr.profiling import PageProfiler, ProfileOptions
+from homr.tracing import trace_stage
+
+
+def busy_function() -> int:
+    return sum(i * i for i in range(20000))
+
+
+def sleeping_function() -> None:
+    time.sleep(0.05)
+
+
+def run_stages() -> None:
+    with trace_stage("detection"):
+        busy_function()
+    with trace_stage("decoding"), trace_stage("parse_staff"):
+        busy_function()
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_only_the_selected_stage_is_profiled(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = PageProfiler(os.path.join(directory, "page"), ProfileOptions("parse_staff"))
+            with profiler.activate():
+                run_stages()
+            self.assertEqual(len(profiler.profiles), 1)
+            files = profiler.write()
+            self.assertEqual(files, [os.path.join(directory, "page.prof")])
+            stats = pstats.Stats(files[0])
+        functions = [function for _file, _line, function in stats.stats]  # type: ignore
+        self.assertIn("busy_function", functions)
+        self.assertIn("busy_function", profiler.format_summary())
+
+    def test_whole_page_profiles_every_top_level_stage(self) -> None:
+        profiler = PageProfiler("page", ProfileOptions())
+        with profiler.activate():
+            run_stages()
+        # Nested stages are part of the profile of their parent
+        self.assertEqual(len(profiler.profiles), 2)  # noqa: PLR2004
+
+    def test_nothing_is_profiled_without_an_active_profiler(self) -> None:
+        profiler = PageProfiler("page", ProfileOptions())
+        run_stages()
+        self.assertEqual(profiler.profiles, [])
+
+    def test_sampling_writes_collapsed_stacks(self) -> None:
+        options = ProfileOptions("detection", sampling=True, interval_in_seconds=0.001)
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = PageProfiler(os.path.join(directory, "page"), options)
+            with profiler.activate(), trace_stage("detection"):
+                sleeping_function()
+            files = profiler.write()
+            self.assertEqual(files, [os.path.join(directory, "page.collapsed")])
+            with open(files[0], encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        self.assertTrue(any("sleeping_function" in line for line in lines))
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn(";", stack)
+        self.assertIn("sleeping_function", profiler.format_summary())
+
+    def test_overlapping_stages_on_two_threads(self) -> None:
+        profiler = PageProfiler("page", ProfileOptions("detection", interval_in_seconds=0.001))
+        both_started = threading.Barrier(2)
+        errors: list[Exception] = []
+
+        def run_stage() -> None:
+            try:
+                with profiler.activate(), trace_stage("detection"):
+                    both_started.wait(timeout=5)
+                    sleeping_function()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run_stage) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # One thread gets cProfile, the other one is sampled
+        self.assertEqual(len(profiler.profiles), 1)
+        self.assertTrue(any("sleeping_function" in stack for stack in profiler.stacks))
+
+    def test_every_nth_page(self) -> None:
+        options = ProfileOptions(every_nth_page=3)
+        self.assertEqual([options.should_profile(i) for i in range(6)], [True, False, False] * 2)
+        with self.assertRaises(ValueError):
+            ProfileOptions(every_nth_page=0)
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from homr.bounding_boxes import RotatedBoundingBox
+from homr.model import Staff, StaffPoint
+from homr.staff_assignment import find_symbols_on_staffs
+
+empty = np.array([])
+
+
+def make_staff(top: float, unit_size: float, start_x: float, number_of_points: int) -> Staff:
+    grid = [
+        StaffPoint(start_x + 10 * i, [top + 0.01 * i + unit_size * j for j in range(5)], 0)
+        for i in range(number_of_points)
+    ]
+    return Staff(grid)
+
+
+class TestStaffAssignment(unittest.TestCase):
+
+    def test_matches_is_on_staff_zone(self) -> None:
+        rng = np.random.default_rng(3)
+        staffs = [
+            make_staff(
+                float(rng.uniform(0, 2000)),
+                float(rng.uniform(8, 20)),
+                float(rng.uniform(0, 300)),
+                int(rng.integers(1, 120)),
+            )
+            for _ in range(10)
+        ]
+        boxes = [
+            RotatedBoundingBox(
+                ((float(rng.uniform(-50, 1600)), float(rng.uniform(-100, 2200))), (5, 5), 0),
+                empty,
+            )
+            for _ in range(500)
+        ]
+        expected = [
+            (staff, staff.get_at(box.center[0]), i)
+            for staff in staffs
+            for i, box in enumerate(boxes)
+            if staff.is_on_staff_zone(box)
+        ]
+        actual = find_symbols_on_staffs(staffs, boxes)
+        self.assertGreater(len(actual), 0)
+        self.assertEqual(len(actual), len(expected))
+        for (staff, point, index), (expected_staff, expected_point, expected_index) in zip(
+            actual, expected, strict=True
+        ):
+            self.assertIs(staff, expected_staff)
+            self.assertIs(point, expected_point)
+            self.assertEqual(index, expected_index)
+
+    def test_overlapping_zones(self) -> None:
+        upper = make_staff(100, 10, 0, 20)
+        lower = make_staff(160, 10, 0, 20)
+        between = RotatedBoundingBox(((50, 150), (5, 5), 0), empty)
+        outside = RotatedBoundingBox(((50, 400), (5, 5), 0), empty)
+        right = RotatedBoundingBox(((400, 150), (5, 5), 0), empty)
+        result = find_symbols_on_staffs([lower, upper], [outside, between, right])
+        self.assertEqual([(staff, index) for staff, _, index in result], [(lower, 1), (upper, 1)])
+        self.assertEqual(find_symbols_on_staffs([], [between]), [])
+        self.assertEqual(find_symbols_on_staffs([upper], []), [])
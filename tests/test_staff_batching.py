@@ -0,0 +1,89 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from homr.model import Staff, StaffPoint
+from homr.staff_batching import CrossPageStaffDecoder, StaffBatchQueue, get_content_width
+from homr.tr_omr_parser import TrOMRParser
+from homr.type_definitions import NDArray
+
+treble_staff = "clef-G2+keySignature-CM+note-C4_quarter+barline"
+no_clef = "note-C4_quarter+barline"
+
+
+def make_staff_image(width: int) -> NDArray:
+    image = np.full((128, 1280, 3), 255, dtype=np.uint8)
+    image[40:90, :width] = 0
+    return image
+
+
+def make_staff() -> Staff:
+    return Staff([StaffPoint(0.0, [100, 110, 120, 130, 140], 0)])
+
+
+class TestStaffBatching(unittest.TestCase):
+
+    def test_queue_groups_items_by_width(self) -> None:
+        queue = StaffBatchQueue(batch_size=2, bucket_width=100, max_delay_in_seconds=60)
+        for width, item in [(10, "a"), (250, "b"), (20, "c"), (260, "d"), (30, "e")]:
+            queue.put(width, item)
+        self.assertEqual(queue.get_batch(), ["a", "c"])
+        self.assertEqual(queue.get_batch(), ["b", "d"])
+        queue.close()
+        self.assertEqual(queue.get_batch(), ["e"])
+        self.assertEqual(queue.get_batch(), [])
+
+    def test_queue_hands_out_partial_batches_after_a_delay(self) -> None:
+        queue = StaffBatchQueue(batch_size=8, max_delay_in_seconds=0.01)
+        queue.put(10, "a")
+        start = time.monotonic()
+        self.assertEqual(queue.get_batch(), ["a"])
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_get_content_width(self) -> None:
+        self.assertEqual(get_content_width(make_staff_image(300)), 300)
+        self.assertEqual(get_content_width(make_staff_image(0)), 0)
+
+    def test_staffs_of_several_pages_share_batches(self) -> None:
+        batches: list[int] = []
+
+        def decode(images: list[NDArray]) -> list[list[str]]:
+            batches.append(len(images))
+            return [[no_clef if image[0, 0, 0] == 1 else treble_staff] for image in images]
+
+        decoder = CrossPageStaffDecoder(StaffBatchQueue(batch_size=4), decode)
+        thread = threading.Thread(target=decoder.run)
+        thread.start()
+        missing_clef = make_staff_image(500)
+        missing_clef[0, 0] = 1
+        first_page = decoder.submit(
+            [make_staff(), make_staff()],
+            [[make_staff_image(500)] * 2, [missing_clef, make_staff_image(500)]],
+        )
+        second_page = decoder.submit([make_staff()], [[make_staff_image(520)] * 2])
+        empty_page = decoder.submit([], [])
+        decoder.close()
+        thread.join()
+
+        self.assertEqual(batches, [4, 2])
+        self.assertEqual(empty_page.result(), [])
+        first_results = first_page.result()
+        self.assertEqual(len(first_results), 2)
+        self.assertEqual(len(first_results[0].measures), 1)
+        # The first option has no clef and is taken as it is
+        self.assertEqual(str(first_results[1]), str(TrOMRParser().parse_tr_omr_output(no_clef)))
+        self.assertEqual(len(second_page.result()), 1)
+        self.assertIn("Decoded 6 staff images in 2 batches", decoder.format_report())
+
+    def test_decoding_errors_are_passed_to_the_pages(self) -> None:
+        def decode(images: list[NDArray]) -> list[list[str]]:
+            raise RuntimeError("out of memory")
+
+        decoder = CrossPageStaffDecoder(StaffBatchQueue(batch_size=4), decode)
+        page = decoder.submit([make_staff()], [[make_staff_image(100)]])
+        decoder.close()
+        decoder.run()
+        with self.assertRaises(RuntimeError):
+            page.result()
@@ -0,0 +1,145 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from homr.bounding_boxes import RotatedBoundingBox, create_rotated_bounding_boxes
+from homr.staff_detection import (
+    RawStaff,
+    StaffAnchor,
+    StaffFragmentIndex,
+    StaffLineSegment,
+    break_wide_fragments,
+    connect_staff_lines,
+    find_horizontal_lines,
+    find_horizontal_lines_in_zones,
+    resample_staff,
+)
+
+empty = np.array([])
+
+
+def random_box(rng: np.random.Generator, max_width: float, max_height: float) -> RotatedBoundingBox:
+    return RotatedBoundingBox(
+        (
+            (float(rng.integers(0, 400)) / 2, float(rng.integers(0, 400)) / 2),
+            (float(rng.integers(1, int(max_width))), float(rng.integers(1, int(max_height)))),
+            float(rng.choice([0.0, 90.0, 45.0, float(rng.uniform(-10, 10))])),
+        ),
+        empty,
+    )
+
+
+def fragment(center: tuple[float, float], width: float) -> RotatedBoundingBox:
+    box = (center, (width, 2), 0)
+    return RotatedBoundingBox(box, cv2.boxPoints(box).astype(np.int32).reshape(-1, 1, 2))
+
+
+class TestStaffDetection(unittest.TestCase):
+
+    def test_fragment_index_matches_is_intersecting(self) -> None:
+        rng = np.random.default_rng(11)
+        fragments = [random_box(rng, 120, 4) for _ in range(300)]
+        index = StaffFragmentIndex(fragments)
+        for _ in range(100):
+            symbol = random_box(rng, 6, 80)
+            expected = [fragment for fragment in fragments if fragment.is_intersecting(symbol)]
+            self.assertEqual(index.get_intersecting(symbol), expected)
+
+        min_y, max_y = 50, 80
+        expected = [fragment for fragment in fragments if min_y <= fragment.center[1] <= max_y]
+        self.assertEqual(index.get_by_center_y(min_y, max_y), expected)
+        self.assertEqual(StaffFragmentIndex([]).get_intersecting(fragments[0]), [])
+
+    def test_connect_staff_lines(self) -> None:
+        unit_size = 10
+        upper = [RotatedBoundingBox(((50 + 100 * i, 100), (90, 2), 0), empty, i) for i in range(5)]
+        lower = [
+            RotatedBoundingBox(((50 + 100 * i, 110), (90, 2), 0), empty, 10 + i) for i in range(5)
+        ]
+        far_away = RotatedBoundingBox(((1200, 100), (90, 2), 0), empty, 20)
+        short = RotatedBoundingBox(((150, 105), (1, 2), 0), empty, 21)
+        steep = RotatedBoundingBox(((250, 300), (60, 2), 30), empty, 22)
+        lines = connect_staff_lines([*lower, far_away, steep, short, *upper], unit_size)
+        self.assertEqual(
+            [line.staff_fragments for line in lines], [upper, [far_away], lower, [steep]]
+        )
+
+    def test_staff_line_segment_get_at(self) -> None:
+        fragments = [
+            RotatedBoundingBox(((100, 100), (100, 2), 0), empty, 0),
+            RotatedBoundingBox(((120, 100), (20, 2), 0), empty, 1),
+            RotatedBoundingBox(((300, 100), (100, 2), 0), empty, 2),
+        ]
+        segment = StaffLineSegment(0, fragments)
+        self.assertIs(segment.get_at(40), fragments[0])
+        self.assertIs(segment.get_at(125), fragments[0])
+        self.assertIs(segment.get_at(155), fragments[0])
+        self.assertIsNone(segment.get_at(200))
+        self.assertIs(segment.get_at(245), fragments[2])
+        self.assertIsNone(segment.get_at(400))
+
+    def test_find_horizontal_lines(self) -> None:
+        image = np.zeros((600, 300), dtype=np.uint8)
+        for top in [100, 400]:
+            for line in range(5):
+                image[top + 12 * line : top + 12 * line + 2, :280] = 1
+        # An incomplete staff only reaches into the second zone
+        for line in range(3):
+            image[250 + 12 * line, 150:] = 1
+        self.assertEqual(
+            find_horizontal_lines(image, 12),
+            [[100, 112, 124, 136, 148], [400, 412, 424, 436, 448]],
+        )
+        zones = [range(100), range(100, 200), range(200, 300)]
+        self.assertEqual(
+            find_horizontal_lines_in_zones(image, zones, 12),
+            [find_horizontal_lines(image[:, zone], 12) for zone in zones],
+        )
+
+    def test_resample_staff(self) -> None:
+        lines = []
+        for i, y in enumerate(range(100, 150, 10)):
+            fragments = [fragment((100, y), 200), fragment((300, y), 200)]
+            if i == 2:  # noqa: PLR2004
+                # Jumps away from the other lines and is replaced by the unit size
+                fragments[1] = fragment((300, y + 7), 200)
+            if i == 4:  # noqa: PLR2004
+                # Leaves a gap between x=140 and x=260
+                fragments = [fragment((70, y), 140), fragment((330, y), 140)]
+            lines.append(StaffLineSegment(i, fragments))
+        anchors = [
+            StaffAnchor(lines, RotatedBoundingBox(((x, 120), (3, 40), 0), empty)) for x in [320, 50]
+        ]
+        staff = resample_staff(RawStaff(0, lines, anchors))
+        expected_x = [*range(0, 190, 10), *range(185, 325, 10), *range(320, 410, 10)]
+        self.assertEqual([point.x for point in staff.grid], expected_x)
+        for point in staff.grid:
+            self.assertEqual(point.y, [100, 110, 120, 130, 140])
+            self.assertEqual(point.angle, 0)
+            self.assertEqual(point.average_unit_size, 10)
+
+        xs = np.arange(-10, 420, 5)
+        self.assertEqual(
+            [lines[4].staff_fragments[i] if i >= 0 else None for i in lines[4].get_indices_at(xs)],
+            [lines[4].get_at(x) for x in xs],
+        )
+
+    def test_break_wide_fragments(self) -> None:
+        image = np.zeros((200, 1000), dtype=np.uint8)
+        curve = [(x, int(100 + 40 * np.sin(x / 300))) for x in range(20, 980, 5)]
+        cv2.polylines(image, [np.array(curve, dtype=np.int32)], False, (1,), 2)
+        image[20:22, 100:160] = 1
+        fragments = create_rotated_bounding_boxes(image, skip_merging=True)
+        wide, narrow = sorted(fragments, key=lambda fragment: -fragment.size[0])
+        limit = 100
+        parts = break_wide_fragments([wide, narrow], limit)
+        self.assertIs(parts[-1], narrow)
+        parts = parts[:-1]
+        self.assertEqual(len(parts), 9)
+        for left, right in zip(parts, parts[1:], strict=False):
+            self.assertLessEqual(np.ptp(left.contours[:-1, 0, 0]), limit)
+            # Neighboring parts share a point
+            self.assertTrue(np.array_equal(left.contours[-1], right.contours[0]))
+        points = {tuple(point) for part in parts for point in part.contours.reshape(-1, 2)}
+        self.assertEqual(points, {tuple(point) for point in wide.contours.reshape(-1, 2)})
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from homr import staff_parsing_tromr
+from homr.staff_result_cache import StaffResultCache
+from homr.type_definitions import NDArray
+
+
+def make_image(seed: int) -> NDArray:
+    return np.random.default_rng(seed).integers(0, 255, (128, 1280, 3), dtype=np.uint8)
+
+
+class TestStaffResultCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache", "staffs.sqlite")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_results_are_stored_by_image(self) -> None:
+        cache = StaffResultCache(self.path)
+        image = make_image(1)
+        self.assertIsNone(cache.get(image))
+        cache.put(image, ["clef-G2+note-C4_quarter"])
+        self.assertEqual(cache.get(image), ["clef-G2+note-C4_quarter"])
+        changed = image.copy()
+        changed[0, 0, 0] ^= 1
+        self.assertIsNone(cache.get(changed))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertIn("1 hits, 2 misses", cache.format_statistics())
+        cache.close()
+
+        reopened = StaffResultCache(self.path)
+        self.assertEqual(reopened.get(image.copy()), ["clef-G2+note-C4_quarter"])
+        reopened.close()
+
+    def test_least_recently_used_entries_are_evicted(self) -> None:
+        cache = StaffResultCache(self.path)
+        images = [make_image(i) for i in range(4)]
+        cache.put(images[0], ["a" * 100])
+        entry_size = cache.get_size()
+        cache.max_size_in_bytes = 3 * entry_size
+        for image in images[1:3]:
+            cache.put(image, ["a" * 100])
+        # Reading the first entry makes the second one the oldest
+        cache.get(images[0])
+        cache.put(images[3], ["a" * 100])
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get(images[1]))
+        self.assertIsNotNone(cache.get(images[0]))
+        self.assertLessEqual(cache.get_size(), cache.max_size_in_bytes)
+        cache.close()
+
+    def test_predict_batch_only_decodes_missing_images(self) -> None:
+        cache = StaffResultCache(self.path)
+        cached = make_image(1)
+        cache.put(cached, ["clef-G2"])
+        staff_parsing_tromr.set_result_cache(cache)
+        try:
+            # The model isn't loaded as long as all images are in the cache
+            self.assertEqual(staff_parsing_tromr.predict_batch([cached, cached]), [["clef-G2"]] * 2)
+        finally:
+            staff_parsing_tromr.set_result_cache(None)
+            cache.close()
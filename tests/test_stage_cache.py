@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from homr import stage_cache
+from homr.model import Staff, StaffPoint
+from homr.stage_cache import StageCache, segmentation_layers
+
+
+def make_staff(top: float) -> Staff:
+    return Staff(
+        [StaffPoint(x, [top + 10 * line for line in range(5)], 0.0) for x in [0.0, 50.0, 100.0]]
+    )
+
+
+class TestStageCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, "cache")
+        self.image_path = os.path.join(self.directory.name, "page.png")
+        with open(self.image_path, "wb") as f:
+            f.write(b"not really an image")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_segmentation_layers_round_trip(self) -> None:
+        rng = np.random.default_rng(1)
+        layers = {
+            name: (rng.random((37, 53)) < 0.2).astype(np.uint8)  # noqa: PLR2004
+            for name in segmentation_layers
+        }
+        cache = StageCache(self.cache_dir, self.image_path)
+        self.assertIsNone(cache.load_segmentation())
+        cache.save_segmentation(layers)
+
+        loaded = StageCache(self.cache_dir, self.image_path).load_segmentation()
+        if loaded is None:
+            self.fail("The segmentation wasn't cached")
+        for name in segmentation_layers:
+            self.assertEqual(loaded[name].dtype, np.uint8)
+            self.assertTrue(np.array_equal(loaded[name], layers[name]))
+        self.assertEqual(os.listdir(cache.directory), ["segmentation.npz"])
+
+    def test_outputs_are_keyed_by_the_image_content(self) -> None:
+        cache = StageCache(self.cache_dir, self.image_path)
+        staffs = [make_staff(100), make_staff(300)]
+        outputs = [[["clef-G2+note-C4_quarter"], ["clef-G2"]], [["clef-F4"]]]
+        cache.save_transformer_outputs(staffs, outputs)
+        cache.save_title("Prelude")
+        self.assertEqual(cache.load_transformer_outputs(staffs), outputs)
+        self.assertIsNone(cache.load_transformer_outputs([*staffs, make_staff(500)]))
+        self.assertEqual(cache.load_title(), "Prelude")
+
+        with open(self.image_path, "ab") as f:
+            f.write(b"changed")
+        changed = StageCache(self.cache_dir, self.image_path)
+        self.assertIsNone(changed.load_transformer_outputs(staffs))
+        self.assertIsNone(changed.load_title())
+
+    def test_another_staff_layout_misses_the_transformer_outputs(self) -> None:
+        cache = StageCache(self.cache_dir, self.image_path)
+        cache.save_transformer_outputs([make_staff(100), make_staff(300)], [[["clef-G2"]]] * 2)
+        self.assertIsNotNone(cache.load_transformer_outputs([make_staff(100), make_staff(300)]))
+        # Same number of staffs, but the detection placed one of them elsewhere
+        self.assertIsNone(cache.load_transformer_outputs([make_staff(100), make_staff(301)]))
+
+    def test_a_new_stage_version_invalidates_the_later_stages(self) -> None:
+        cache = StageCache(self.cache_dir, self.image_path)
+        cache.save_segmentation(
+            {name: np.zeros((4, 4), dtype=np.uint8) for name in segmentation_layers}
+        )
+        staffs = [make_staff(100)]
+        cache.save_transformer_outputs(staffs, [[["clef-G2"]]])
+        cache.save_title("Title")
+        versions = {stage: list(version) for stage, version in stage_cache.stage_versions.items()}
+        versions["transformer"][-1] = "another checkpoint"
+        with mock.patch.dict(stage_cache.stage_versions, versions):
+            self.assertIsNotNone(cache.load_segmentation())
+            self.assertIsNone(cache.load_transformer_outputs(staffs))
+            self.assertEqual(cache.load_title(), "Title")
@@ -0,0 +1,76 @@
+import contextvars
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from homr.tracing import PageTrace, format_trace_summary, trace_count, trace_stage
+
+
+def prepare(index: int) -> int:
+    with trace_stage("prepare"):
+        trace_count("items", index)
+    return index
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_stages_are_nested_and_counted(self) -> None:
+        trace = PageTrace("page.png")
+        with trace.activate():
+            with trace_stage("detection"):
+                with trace_stage("detect_staff"):
+                    trace_count("staffs", 2)
+                    trace_count("staffs", 1)
+                trace_count("notes", 10)
+        records = {record.name: record for record in trace.records}
+        self.assertEqual(records["detect_staff"].parent, "detection")
+        self.assertIsNone(records["detection"].parent)
+        self.assertEqual(records["detect_staff"].counts, {"staffs": 3})
+        self.assertEqual(records["detection"].counts, {"notes": 10})
+        self.assertGreaterEqual(
+            records["detection"].wall_seconds, records["detect_staff"].wall_seconds
+        )
+        self.assertEqual(trace.get_wall_seconds(), records["detection"].wall_seconds)
+
+    def test_without_an_active_trace_nothing_is_recorded(self) -> None:
+        trace = PageTrace("page.png")
+        with trace_stage("load") as record:
+            trace_count("items", 1)
+        self.assertIsNone(record)
+        self.assertEqual(trace.records, [])
+
+    def test_failed_stages_are_recorded(self) -> None:
+        trace = PageTrace("page.png")
+        with trace.activate(), self.assertRaises(ValueError), trace_stage("detection"):
+            raise ValueError("no staffs")
+        self.assertTrue(trace.records[0].failed)
+
+    def test_the_trace_follows_the_context_into_threads(self) -> None:
+        trace = PageTrace("page.png")
+        with trace.activate(), trace_stage("decoding"), ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, prepare, i) for i in range(4)]
+            self.assertEqual([future.result() for future in futures], [0, 1, 2, 3])
+        prepared = [record for record in trace.records if record.name == "prepare"]
+        self.assertEqual(len(prepared), 4)  # noqa: PLR2004
+        self.assertTrue(all(record.parent == "decoding" for record in prepared))
+
+    def test_trace_is_written_as_json_and_summarized(self) -> None:
+        traces = []
+        for page in ["a.png", "b.png"]:
+            trace = PageTrace(page)
+            with trace.activate(), trace_stage("load"):
+                trace_count("staffs", 2)
+            traces.append(trace)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "a_trace.json")
+            traces[0].write(path)
+            with open(path, encoding="utf-8") as f:
+                content = json.load(f)
+        self.assertEqual(content["image"], "a.png")
+        self.assertEqual([stage["name"] for stage in content["stages"]], ["load"])
+        self.assertEqual(content["stages"][0]["counts"], {"staffs": 2})
+        summary = format_trace_summary(traces)
+        self.assertIn("2 pages", summary)
+        self.assertIn("staffs=4", summary)